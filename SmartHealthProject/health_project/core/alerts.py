@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+from django.conf import settings
+
+from . import background, outbox
+from .models import Patient
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# RULES
+# ==========================================
+
+class Rule(ABC):
+    """Base rule. Subclasses keep per-patient state and answer in O(1) per reading."""
+
+    def __init__(self, name, metric, conditions=None, patients=None, **options):
+        self.name = name
+        self.metric = metric
+        # Optional scope: medical conditions (case-insensitive) and/or patient ids
+        self.conditions = {c.lower() for c in conditions} if conditions else None
+        self.patients = set(patients) if patients else None
+
+    def applies_to(self, patient_id, condition):
+        if self.patients is not None and patient_id not in self.patients:
+            return False
+        if self.conditions is not None and (condition or '').lower() not in self.conditions:
+            return False
+        return True
+
+    def new_state(self):
+        return None
+
+    @abstractmethod
+    def check(self, state, ts, value):
+        """Returns (new_state, message or None). A state of None means nothing to remember."""
+
+
+class ThresholdRule(Rule):
+    """Fires when the value is above/below a limit, optionally for `for_seconds` in a row.
+
+    State is (first, last) breaching timestamp. Breaching samples more than
+    `max_gap` seconds apart (the device was offline) start the count over.
+    """
+
+    def __init__(self, name, metric, above=None, below=None, for_seconds=0, max_gap=60, **kwargs):
+        super().__init__(name, metric, **kwargs)
+        self.above = above
+        self.below = below
+        self.for_seconds = for_seconds
+        self.max_gap = max_gap
+
+    def check(self, state, ts, value):
+        breached = (self.above is not None and value > self.above) or (self.below is not None and value < self.below)
+        if not breached:
+            return None, None
+        breach_start, last = state or (ts, ts)
+        if ts - last > self.max_gap:
+            breach_start = ts
+        state = (breach_start, ts)
+        if ts - breach_start < self.for_seconds:
+            return state, None
+        limit = f"above {self.above}" if self.above is not None and value > self.above else f"below {self.below}"
+        held = f" for {int(ts - breach_start)}s" if self.for_seconds else ""
+        return state, f"{self.metric.replace('_', ' ')} {value:g} {limit}{held}"
+
+
+class RateOfChangeRule(Rule):
+    """Fires when the value moves by more than `max_change` within `window_seconds`."""
+
+    def __init__(self, name, metric, max_change, window_seconds=10, max_samples=64, **kwargs):
+        super().__init__(name, metric, **kwargs)
+        self.max_change = max_change
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+
+    def new_state(self):
+        return deque(maxlen=self.max_samples)
+
+    def check(self, window, ts, value):
+        window = window if window is not None else self.new_state()
+        while window and ts - window[0][0] > self.window_seconds:
+            window.popleft()
+        message = None
+        if window:
+            oldest_ts, oldest = window[0]
+            if abs(value - oldest) > self.max_change:
+                message = (f"{self.metric.replace('_', ' ')} changed {oldest:g} -> {value:g} "
+                           f"in {int(ts - oldest_ts)}s")
+        window.append((ts, value))
+        return window, message
+
+
+RULE_TYPES = {'threshold': ThresholdRule, 'rate': RateOfChangeRule}
+
+
+def build_rules(specs):
+    rules = []
+    for spec in specs:
+        spec = dict(spec)
+        rules.append(RULE_TYPES[spec.pop('type')](**spec))
+    return rules
+
+
+# ==========================================
+# ENGINE
+# ==========================================
+
+class PatientProfile:
+    __slots__ = ('name', 'condition', 'doctor_chat_id', 'loaded_at')
+
+    def __init__(self, name, condition, doctor_chat_id, loaded_at):
+        self.name = name
+        self.condition = condition
+        self.doctor_chat_id = doctor_chat_id
+        self.loaded_at = loaded_at
+
+
+class RuleEngine:
+    """Evaluates each ingested reading against the configured rules.
+
+    Rule state lives in memory per (patient, rule). Patient details needed for
+    scoping and for the alert message are cached per process and loaded once per
+    batch for patients not seen recently, so steady-state evaluation does no query.
+
+    Everything kept for a patient (rule state, cooldowns, profile) is dropped when
+    the patient is deleted, and once the patient has sent nothing for
+    `state_ttl` seconds; replacing the rules resets the rule state.
+    """
+
+    PROFILE_TTL = 600
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, rules, cooldown, state_ttl=None, clock=time.monotonic):
+        self.rules = rules
+        self.cooldown = cooldown
+        # Forgetting cooldowns earlier would let an idle patient's alert fire again too soon
+        self.state_ttl = max(cooldown, self.PROFILE_TTL) if state_ttl is None else state_ttl
+        self.clock = clock
+        self._state = {}       # patient_id -> {rule name: rule state}
+        self._last_fired = {}  # patient_id -> {rule name: clock time}
+        self._seen = {}        # patient_id -> clock time of the last evaluated reading
+        self._profiles = {}    # patient_id -> PatientProfile
+        self._last_prune = clock()
+        self._lock = threading.Lock()
+
+    def forget_profile(self, patient_id):
+        with self._lock:
+            self._profiles.pop(patient_id, None)
+
+    def forget_patient(self, patient_id):
+        with self._lock:
+            self._profiles.pop(patient_id, None)
+            self._state.pop(patient_id, None)
+            self._last_fired.pop(patient_id, None)
+            self._seen.pop(patient_id, None)
+
+    def forget_all_profiles(self):
+        with self._lock:
+            self._profiles.clear()
+
+    def set_rules(self, rules, cooldown=None):
+        """Replaces the rules. Rule state starts over; cooldowns of rules that are kept still apply."""
+        names = {rule.name for rule in rules}
+        with self._lock:
+            self.rules = rules
+            if cooldown is not None:
+                self.cooldown = cooldown
+            self._state.clear()
+            for fired in self._last_fired.values():
+                for name in [n for n in fired if n not in names]:
+                    del fired[name]
+
+    def _prune(self, now):
+        idle = [pid for pid, seen in self._seen.items() if now - seen > self.state_ttl]
+        for pid in idle:
+            for table in (self._state, self._last_fired, self._seen, self._profiles):
+                table.pop(pid, None)
+        self._last_prune = now
+
+    def _load_profiles(self, patient_ids, now):
+        missing = [pid for pid in patient_ids
+                   if pid not in self._profiles or now - self._profiles[pid].loaded_at > self.PROFILE_TTL]
+        if not missing:
+            return
+        rows = (Patient.objects.filter(id__in=missing)
+                .values_list('id', 'user__first_name', 'user__last_name', 'medical_condition', 'doctor__telegram_chat_id'))
+        for pid, first, last, condition, chat_id in rows:
+            self._profiles[pid] = PatientProfile(f"{first} {last}".strip(), condition, chat_id, now)
+
+    def evaluate(self, readings):
+        """Returns a list of (profile, rule, message) for every rule that fired."""
+        fired = []
+        with self._lock:
+            now = self.clock()
+            if now - self._last_prune > self.PRUNE_INTERVAL:
+                self._prune(now)
+            self._load_profiles({r.patient_id for r in readings}, now)
+            for r in sorted(readings, key=lambda r: r.timestamp):
+                profile = self._profiles.get(r.patient_id)
+                if profile is None:
+                    continue
+                self._seen[r.patient_id] = now
+                states = self._state.setdefault(r.patient_id, {})
+                ts = r.timestamp.timestamp()
+                for rule in self.rules:
+                    value = getattr(r, rule.metric, None)
+                    if value is None or not rule.applies_to(r.patient_id, profile.condition):
+                        continue
+                    state, message = rule.check(states.get(rule.name), ts, value)
+                    if state is None:
+                        states.pop(rule.name, None)
+                    else:
+                        states[rule.name] = state
+                    if message and self._cooled_down(r.patient_id, rule.name, now):
+                        fired.append((profile, rule, message))
+        return fired
+
+    def _cooled_down(self, patient_id, name, now):
+        fired = self._last_fired.setdefault(patient_id, {})
+        last = fired.get(name)
+        if last is not None and now - last < self.cooldown:
+            return False
+        fired[name] = now
+        return True
+
+
+rule_engine = RuleEngine(build_rules(settings.ALERT_RULES), cooldown=settings.ALERT_COOLDOWN_SECONDS)
+
+
+def evaluate_readings(sender, readings, **kwargs):
+    """readings_ingested receiver: hands the batch to the background worker, off the device's request."""
+    background.worker.submit(send_alerts, readings)
+
+
+def send_alerts(readings):
+    """Runs the rules and queues alerts in the notification outbox."""
+    for profile, rule, message in rule_engine.evaluate(readings):
+        logger.warning("Alert %s for %s: %s", rule.name, profile.name, message)
+        if not profile.doctor_chat_id:
+            continue
+        outbox.enqueue('alert', profile.doctor_chat_id, (
+            f"⚠️ **AUTOMATIC ALERT: {rule.name.replace('_', ' ').upper()}** ⚠️\n\n"
+            f"**Patient:** {profile.name}\n"
+            f"**Reading:** {message}"
+        ))
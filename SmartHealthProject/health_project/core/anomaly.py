@@ -0,0 +1,278 @@
+"""Vectorized anomaly detection over vital-sign series (used by `manage.py detect_anomalies`).
+
+The `*_py` functions at the bottom are plain-Python versions of the same maths,
+kept as the reference the tests compare against.
+"""
+import math
+
+import numpy as np
+
+
+# ==========================================
+# VECTORIZED PRIMITIVES
+# ==========================================
+
+def rolling_mean_std(x, window):
+    """Mean and std of the `window` samples *before* each index (NaN where there aren't enough)."""
+    n = len(x)
+    mean = np.full(n, np.nan)
+    std = np.full(n, np.nan)
+    if n <= window:
+        return mean, std
+    # Shift by the chunk mean so the running sums stay small (less cancellation)
+    shifted = x - x.mean()
+    c1 = np.concatenate(([0.0], np.cumsum(shifted)))
+    c2 = np.concatenate(([0.0], np.cumsum(shifted * shifted)))
+    s1 = c1[window:n] - c1[:n - window]
+    s2 = c2[window:n] - c2[:n - window]
+    m = s1 / window
+    mean[window:] = m + x.mean()
+    std[window:] = np.sqrt(np.maximum(s2 / window - m * m, 0.0))
+    return mean, std
+
+
+def rolling_zscore(x, window, min_std):
+    mean, std = rolling_mean_std(x, window)
+    return (x - mean) / np.maximum(std, min_std)
+
+
+def ewma(x, alpha, initial=None):
+    """Exponentially weighted moving average, y[t] = alpha*x[t] + (1-alpha)*y[t-1].
+
+    Solved in closed form per block so the recursion needs no Python loop per
+    sample; blocks keep the (1-alpha)^-k factors well inside float range.
+    """
+    x = np.asarray(x, dtype=float)
+    out = np.empty_like(x)
+    if len(x) == 0:
+        return out
+    if alpha >= 1.0:
+        out[:] = x
+        return out
+    decay = 1.0 - alpha
+    block = max(1, min(256, int(600 / -math.log(decay))))
+    prev = x[0] if initial is None else initial
+    for start in range(0, len(x), block):
+        chunk = x[start:start + block]
+        k = np.arange(1, len(chunk) + 1)
+        grow = decay ** -k                       # (1-a)^-(k+1) for k = 0..B-1
+        out[start:start + len(chunk)] = (decay ** k) * (prev + alpha * np.cumsum(chunk * grow))
+        prev = out[start + len(chunk) - 1]
+    return out
+
+
+def change_scores(x, window, min_std):
+    """Two-window mean-shift statistic at each index: |mean(after) - mean(before)| / pooled std.
+
+    `before` is x[i-window:i], `after` is x[i:i+window]; NaN where either is incomplete.
+    """
+    n = len(x)
+    mean, std = rolling_mean_std(x, window)
+    score = np.full(n, np.nan)
+    if n < 2 * window:
+        return score
+    before_mean, before_std = mean[window:n - window + 1], std[window:n - window + 1]
+    after_mean, after_std = mean[2 * window:], std[2 * window:]
+    # rolling stats at i+window describe x[i:i+window]; the last index (n-window) has no entry
+    after_mean = np.append(after_mean, x[n - window:].mean())
+    after_std = np.append(after_std, x[n - window:].std())
+    pooled = np.sqrt((before_std ** 2 + after_std ** 2) / 2)
+    score[window:n - window + 1] = np.abs(after_mean - before_mean) / np.maximum(pooled, min_std)
+    return score
+
+
+def local_peaks(score, threshold, radius):
+    """Indices where score >= threshold and is the maximum within +/- radius samples."""
+    n = len(score)
+    if n == 0:
+        return np.array([], dtype=int)
+    filled = np.where(np.isnan(score), -np.inf, score)
+    padded = np.pad(filled, radius, constant_values=-np.inf)
+    neighbourhood = np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1).max(axis=1)
+    peaks = np.flatnonzero((filled >= threshold) & (filled == neighbourhood))
+    # On a flat plateau keep only the first index
+    if len(peaks) > 1:
+        peaks = peaks[np.concatenate(([True], np.diff(peaks) > radius))]
+    return peaks
+
+
+def runs(mask):
+    """(starts, ends) of the True runs in a boolean array, ends exclusive."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+# Per-metric detector settings; min_std stops a flat signal from turning noise into huge z-scores
+METRIC_SETTINGS = {
+    'heart_rate': {'min_std': 2.0},
+    'body_temperature': {'min_std': 0.1},
+}
+
+
+# ==========================================
+# CHUNKED DETECTOR
+# ==========================================
+
+class SeriesDetector:
+    """Streams one metric of one patient through the detectors chunk by chunk.
+
+    Keeps 2*window samples of context between chunks and holds back the last
+    2*window samples of each chunk (a change point needs `window` samples after
+    it, and its score is compared with scores up to `window` away), so results
+    do not depend on where the chunks are cut.
+    """
+
+    def __init__(self, window=60, z_threshold=4.0, min_run=3, alpha=0.05, cp_threshold=3.0, min_std=0.5):
+        self.window = window
+        self.z_threshold = z_threshold
+        self.min_run = min_run
+        self.alpha = alpha
+        self.cp_threshold = cp_threshold
+        self.min_std = min_std
+
+        self._ts = np.empty(0)
+        self._x = np.empty(0)
+        self._offset = 0          # global index of self._x[0]
+        self._settled = 0         # global index up to which results are emitted
+        self._ewma_prev = None    # EWMA at the last settled sample
+        self.intervals = []       # [start, end, start_ts, end_ts, peak_z, peak_value, baseline]
+        self.change_points = []   # (ts, score, before_mean, after_mean)
+
+    def feed(self, ts, x):
+        self._ts = np.concatenate((self._ts, np.asarray(ts, dtype=float)))
+        self._x = np.concatenate((self._x, np.asarray(x, dtype=float)))
+        self._process(final=False)
+
+    def finish(self):
+        self._process(final=True)
+        return self.anomalies()
+
+    def _process(self, final):
+        w = self.window
+        end = self._offset + len(self._x)
+        emit_to = end if final else end - 2 * w
+        if emit_to <= self._settled:
+            return
+        lo = self._settled - self._offset          # local index of the first unsettled sample
+        hi = emit_to - self._offset
+        x, ts = self._x, self._ts
+
+        z = rolling_zscore(x, w, self.min_std)
+        smooth = ewma(x[lo:], self.alpha, self._ewma_prev)
+        cp = change_scores(x, w, self.min_std)
+
+        # --- Out-of-range intervals (|z| above threshold) ---
+        mask = np.abs(np.nan_to_num(z[lo:hi])) > self.z_threshold
+        starts, ends = runs(mask)
+        for s, e in zip(starts, ends):
+            seg = np.abs(z[lo + s:lo + e])
+            peak = int(np.argmax(seg))
+            baseline = smooth[s - 1] if s > 0 else self._ewma_prev
+            gs, ge = self._settled + s, self._settled + e
+            last = self.intervals[-1] if self.intervals else None
+            if last is not None and last[1] == gs:
+                # Continues a run cut at the previous chunk boundary
+                last[1], last[3] = ge, ts[lo + e - 1]
+                if seg[peak] > last[4]:
+                    last[4], last[5] = seg[peak], x[lo + s + peak]
+            else:
+                self.intervals.append([gs, ge, ts[lo + s], ts[lo + e - 1], seg[peak], x[lo + s + peak], baseline])
+
+        # --- Change points (local maxima of the mean-shift score) ---
+        for i in local_peaks(cp, self.cp_threshold, w):
+            if lo <= i < hi:
+                before = x[i - w:i].mean()
+                after = x[i:i + w].mean()
+                self.change_points.append((ts[i], cp[i], before, after))
+
+        self._ewma_prev = smooth[hi - lo - 1]
+        self._settled = emit_to
+        keep_from = max(0, hi - 2 * w)
+        self._x, self._ts = x[keep_from:], ts[keep_from:]
+        self._offset += keep_from
+
+    def anomalies(self):
+        """Intervals at least `min_run` samples long, plus change points."""
+        spikes = [
+            {'kind': 'spike', 'start': s_ts, 'end': e_ts, 'score': float(peak_z),
+             'peak_value': float(peak_value), 'baseline': None if baseline is None else float(baseline)}
+            for s, e, s_ts, e_ts, peak_z, peak_value, baseline in self.intervals if e - s >= self.min_run
+        ]
+        shifts = [
+            {'kind': 'shift', 'start': t, 'end': t, 'score': float(score),
+             'peak_value': float(after), 'baseline': float(before)}
+            for t, score, before, after in self.change_points
+        ]
+        return spikes + shifts
+
+
+# ==========================================
+# PURE-PYTHON REFERENCE (tests only)
+# ==========================================
+
+def rolling_zscore_py(x, window, min_std):
+    out = []
+    for i, v in enumerate(x):
+        if i < window:
+            out.append(math.nan)
+            continue
+        prev = x[i - window:i]
+        mean = sum(prev) / window
+        std = math.sqrt(sum((p - mean) ** 2 for p in prev) / window)
+        out.append((v - mean) / max(std, min_std))
+    return out
+
+
+def ewma_py(x, alpha, initial=None):
+    out = []
+    prev = x[0] if initial is None and x else initial
+    for v in x:
+        prev = alpha * v + (1 - alpha) * prev
+        out.append(prev)
+    return out
+
+
+def change_scores_py(x, window, min_std):
+    n = len(x)
+    out = [math.nan] * n
+    for i in range(window, n - window + 1):
+        before, after = x[i - window:i], x[i:i + window]
+        mb, ma = sum(before) / window, sum(after) / window
+        vb = sum((v - mb) ** 2 for v in before) / window
+        va = sum((v - ma) ** 2 for v in after) / window
+        out[i] = abs(ma - mb) / max(math.sqrt((vb + va) / 2), min_std)
+    return out
+
+
+def detect_py(ts, x, window=60, z_threshold=4.0, min_run=3, alpha=0.05, cp_threshold=3.0, min_std=0.5):
+    """Whole-series equivalent of SeriesDetector(...).feed(ts, x); .finish()."""
+    z = rolling_zscore_py(x, window, min_std)
+    smooth = ewma_py(x, alpha)
+    cp = change_scores_py(x, window, min_std)
+
+    spikes, i = [], 0
+    while i < len(x):
+        if not (abs(z[i]) > z_threshold):
+            i += 1
+            continue
+        s = i
+        while i < len(x) and abs(z[i]) > z_threshold:
+            i += 1
+        if i - s >= min_run:
+            peak = max(range(s, i), key=lambda j: abs(z[j]))
+            spikes.append({'kind': 'spike', 'start': ts[s], 'end': ts[i - 1], 'score': abs(z[peak]),
+                           'peak_value': x[peak], 'baseline': smooth[s - 1] if s > 0 else None})
+
+    shifts, last_peak = [], None
+    scores = [-math.inf if math.isnan(v) else v for v in cp]
+    for i, v in enumerate(scores):
+        if v < cp_threshold or v != max(scores[max(0, i - window):i + window + 1]):
+            continue
+        is_plateau = last_peak is not None and i - last_peak <= window
+        last_peak = i
+        if is_plateau:
+            continue
+        shifts.append({'kind': 'shift', 'start': ts[i], 'end': ts[i], 'score': v,
+                       'peak_value': sum(x[i:i + window]) / window,
+                       'baseline': sum(x[i - window:i]) / window})
+    return spikes + shifts
@@ -0,0 +1,143 @@
+import os
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import counters
+from .models import ArchivedPartition, SensorReading
+
+# Columns stored per partition besides `id` and `ts` (microseconds since the epoch, UTC).
+# Everything is float64 so NULL can be stored as NaN.
+VALUE_COLUMNS = ('heart_rate', 'body_temperature', 'room_temperature', 'humidity', 'battery_level', 'signal_strength')
+INT_COLUMNS = ('battery_level', 'signal_strength')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ONE_US = timedelta(microseconds=1)
+
+
+def partition_path(patient_id, day):
+    return f"{patient_id}/{day:%Y}/{day:%Y-%m-%d}.npz"
+
+
+def day_bounds(day):
+    """[start, end) of a local calendar day as aware datetimes."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+# ==========================================
+# FILE FORMAT (compressed .npz, one array per column)
+# ==========================================
+
+def to_columns(rows):
+    """rows: (id, timestamp, *VALUE_COLUMNS) tuples -> dict of column arrays."""
+    n = len(rows)
+    cols = {
+        'id': np.fromiter((r[0] for r in rows), dtype=np.int64, count=n),
+        'ts': np.fromiter(((r[1] - EPOCH) // ONE_US for r in rows), dtype=np.int64, count=n),
+    }
+    for i, name in enumerate(VALUE_COLUMNS, start=2):
+        cols[name] = np.array([np.nan if r[i] is None else r[i] for r in rows], dtype=np.float64)
+    return cols
+
+
+def read_partition(relpath):
+    with np.load(settings.ARCHIVE_DIR / relpath) as data:
+        return {name: data[name] for name in data.files}
+
+
+def write_partition(relpath, cols):
+    """Writes (merging with an existing file) sorted by (ts, id), one row per id. Atomic replace."""
+    path = settings.ARCHIVE_DIR / relpath
+    if path.exists():
+        old = read_partition(relpath)
+        cols = {name: np.concatenate((old[name], cols[name])) for name in cols}
+        # Keep one copy of ids archived twice (a run that died before deleting its rows)
+        _, first = np.unique(cols['id'], return_index=True)
+        cols = {name: arr[first] for name, arr in cols.items()}
+    order = np.lexsort((cols['id'], cols['ts']))
+    cols = {name: arr[order] for name, arr in cols.items()}
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **cols)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return cols
+
+
+def to_readings(patient_id, cols, index):
+    """Unsaved SensorReading objects (with their original ids) for the given row positions."""
+    readings = []
+    for i in index:
+        values = {}
+        for name in VALUE_COLUMNS:
+            v = cols[name][i]
+            values[name] = None if np.isnan(v) else (int(v) if name in INT_COLUMNS else float(v))
+        readings.append(SensorReading(id=int(cols['id'][i]), patient_id=patient_id,
+                                      timestamp=EPOCH + timedelta(microseconds=int(cols['ts'][i])), **values))
+    return readings
+
+
+# ==========================================
+# ARCHIVING (hot table -> files)
+# ==========================================
+
+def retention_cutoff(days=None):
+    """Local midnight `days` days ago; only whole local days are archived."""
+    days = settings.READING_RETENTION_DAYS if days is None else days
+    start, _ = day_bounds(timezone.localdate() - timedelta(days=days))
+    return start
+
+
+def archive_patient(patient_id, cutoff):
+    """Moves a patient's readings older than `cutoff` into daily partitions. Returns (days, rows).
+
+    Each day is written to disk first and deleted from SensorReading after, in
+    the same transaction as its registry row, so a crash at any point leaves
+    every reading in the table, the archive, or both (merged on the next run).
+    """
+    days = rows_moved = 0
+    readings = SensorReading.objects.filter(patient_id=patient_id, timestamp__lt=cutoff)
+    while True:
+        first = readings.order_by('timestamp').values_list('timestamp', flat=True).first()
+        if first is None:
+            return days, rows_moved
+        day = timezone.localdate(first)
+        start, end = day_bounds(day)
+        rows = list(readings.filter(timestamp__gte=start, timestamp__lt=end)
+                    .order_by('timestamp', 'id').values_list('id', 'timestamp', *VALUE_COLUMNS))
+        relpath = partition_path(patient_id, day)
+        cols = write_partition(relpath, to_columns(rows))
+
+        with transaction.atomic():
+            partition = ArchivedPartition.objects.filter(patient_id=patient_id, day=day)
+            previous = partition.values_list('row_count', flat=True).first() or 0
+            ArchivedPartition.objects.update_or_create(
+                patient_id=patient_id, day=day,
+                defaults=dict(path=relpath, row_count=len(cols['id']),
+                              ts_min=EPOCH + timedelta(microseconds=int(cols['ts'][0])),
+                              ts_max=EPOCH + timedelta(microseconds=int(cols['ts'][-1]))),
+            )
+            # id bound: a reading for this day that arrived after we read the day stays for the next run
+            _, deleted = readings.filter(timestamp__gte=start, timestamp__lt=end, id__lte=rows[-1][0]).delete()
+            # Bulk delete sends no signals: move the rows between the dashboard counters here
+            counters.add('readings', -deleted.get(SensorReading._meta.label, 0))
+            counters.add('archived_readings', len(cols['id']) - previous)
+        days += 1
+        rows_moved += len(rows)
+
+
+def hot_start(patient_id):
+    """Local midnight after the newest archived day (None if nothing archived).
+
+    Anything rebuilt from SensorReading must not reach before this.
+    """
+    day = (ArchivedPartition.objects.filter(patient_id=patient_id)
+           .order_by('-day').values_list('day', flat=True).first())
+    return day_bounds(day)[1] if day else None
@@ -0,0 +1,187 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .archive import EPOCH, ONE_US, read_partition, to_readings
+from .models import ArchivedPartition
+
+
+def to_us(ts):
+    return (ts - EPOCH) // ONE_US
+
+
+# ==========================================
+# RAW CACHE (compressed partition -> one .npy file per column)
+# ==========================================
+
+def _stamp(relpath):
+    # Changes whenever the archive job rewrites the partition
+    st = os.stat(settings.ARCHIVE_DIR / relpath)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def _expand(relpath, stamp):
+    """Decompresses a partition once into ARCHIVE_CACHE_DIR and returns its directory."""
+    base = settings.ARCHIVE_CACHE_DIR / relpath.removesuffix('.npz')
+    target = base / stamp
+    if target.exists():
+        return target
+    tmp = base / f".{stamp}.{os.getpid()}.{threading.get_ident()}"
+    tmp.mkdir(parents=True, exist_ok=True)
+    for name, arr in read_partition(relpath).items():
+        np.save(tmp / f"{name}.npy", np.ascontiguousarray(arr))
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        # Another worker expanded it first
+        shutil.rmtree(tmp, ignore_errors=True)
+    for old in base.iterdir():
+        if old.name != stamp and not old.name.startswith('.'):
+            # Open maps of a stale copy stay valid on POSIX until closed
+            shutil.rmtree(old, ignore_errors=True)
+    return target
+
+
+class Partition:
+    """Memory-mapped columns of one archived patient-day, sorted by (ts, id).
+
+    Every array handed out is a read-only view of the mapped cache file.
+    """
+
+    def __init__(self, directory):
+        self.columns = {p.stem: np.load(p, mmap_mode='r') for p in directory.glob('*.npy')}
+        self.ts = self.columns['ts']
+
+    def __len__(self):
+        return len(self.ts)
+
+    def bounds(self, start=None, end=None, before=None):
+        """Row range [lo, hi) for ts in [start, end) and (ts, id) < `before`, by binary search."""
+        lo = 0 if start is None else int(np.searchsorted(self.ts, to_us(start), 'left'))
+        hi = len(self.ts) if end is None else int(np.searchsorted(self.ts, to_us(end), 'left'))
+        if before is not None:
+            b_ts, b_id = to_us(before[0]), before[1]
+            cut = int(np.searchsorted(self.ts, b_ts, 'left'))
+            # Rows with ts == b_ts are sorted by id; keep those below b_id
+            same_end = int(np.searchsorted(self.ts, b_ts, 'right'))
+            cut += int(np.searchsorted(self.columns['id'][cut:same_end], b_id, 'left'))
+            hi = min(hi, cut)
+        return lo, max(lo, hi)
+
+    def window(self, lo, hi, names):
+        return {name: self.columns[name][lo:hi] for name in names}
+
+
+_open = OrderedDict()   # (relpath, stamp) -> Partition
+_open_lock = threading.Lock()
+MAX_OPEN_PARTITIONS = 128
+
+
+def open_partition(relpath):
+    key = (relpath, _stamp(relpath))
+    with _open_lock:
+        part = _open.get(key)
+        if part is not None:
+            _open.move_to_end(key)
+            return part
+    part = Partition(_expand(*key))
+    with _open_lock:
+        _open[key] = part
+        while len(_open) > MAX_OPEN_PARTITIONS:
+            _open.popitem(last=False)
+    return part
+
+
+def remove_partition(relpath):
+    """Deletes an archived partition file and its expanded cache, e.g. once its registry row is gone."""
+    with _open_lock:
+        for key in [key for key in _open if key[0] == relpath]:
+            del _open[key]
+    (settings.ARCHIVE_DIR / relpath).unlink(missing_ok=True)
+    shutil.rmtree(settings.ARCHIVE_CACHE_DIR / relpath.removesuffix('.npz'), ignore_errors=True)
+    for root in (settings.ARCHIVE_DIR, settings.ARCHIVE_CACHE_DIR):
+        # Drop the patient's year/patient folders once empty
+        for parent in Path(relpath).parents[:-1]:
+            try:
+                (root / parent).rmdir()
+            except OSError:
+                break
+
+
+# ==========================================
+# QUERIES
+# ==========================================
+
+class ArchiveReader:
+    """Range and aggregate queries over one patient's archive, without building model instances.
+
+    One registry query picks the partitions touching [start, end); each is then
+    answered from its memory map with binary search on the timestamp column.
+    """
+
+    def __init__(self, patient_id, start=None, end=None):
+        self.patient_id = patient_id
+        self.start = start
+        self.end = end
+        partitions = ArchivedPartition.objects.filter(patient_id=patient_id)
+        if start is not None:
+            partitions = partitions.filter(ts_max__gte=start)
+        if end is not None:
+            partitions = partitions.filter(ts_min__lt=end)
+        self.paths = list(partitions.order_by('day').values_list('path', flat=True))
+
+    def slices(self, names=('ts', 'heart_rate', 'body_temperature')):
+        """Yields {column: zero-copy view} per partition, oldest first."""
+        for relpath in self.paths:
+            part = open_partition(relpath)
+            lo, hi = part.bounds(self.start, self.end)
+            if hi > lo:
+                yield part.window(lo, hi, names)
+
+    def aggregate(self, metrics=('heart_rate', 'body_temperature')):
+        """{'count': rows, metric: {'count', 'sum', 'min', 'max'}} over the range; NaN (NULL) values skipped."""
+        result = {'count': 0}
+        for metric in metrics:
+            result[metric] = {'count': 0, 'sum': 0.0, 'min': None, 'max': None}
+        for cols in self.slices(metrics):
+            result['count'] += len(cols[metrics[0]])
+            for metric in metrics:
+                values = cols[metric]
+                present = values[~np.isnan(values)]
+                if not len(present):
+                    continue
+                agg = result[metric]
+                agg['count'] += len(present)
+                agg['sum'] += float(present.sum())
+                lo, hi = float(present.min()), float(present.max())
+                agg['min'] = lo if agg['min'] is None else min(agg['min'], lo)
+                agg['max'] = hi if agg['max'] is None else max(agg['max'], hi)
+        return result
+
+
+def read_range(patient_id, floor=None, ceiling=None, start=None, end=None, before=None, limit=50):
+    """Up to `limit` archived readings as SensorReading objects, newest first (for history pages).
+
+    `floor` / `ceiling` narrow which partitions are opened: only files whose
+    time span touches [floor, ceiling]. Only the rows returned are materialized.
+    """
+    partitions = ArchivedPartition.objects.filter(patient_id=patient_id)
+    if floor is not None:
+        partitions = partitions.filter(ts_max__gte=floor)
+    if ceiling is not None:
+        partitions = partitions.filter(ts_min__lte=ceiling)
+
+    found = []
+    for relpath in partitions.order_by('-day').values_list('path', flat=True):
+        part = open_partition(relpath)
+        lo, hi = part.bounds(start, end, before)
+        take = max(lo, hi - (limit - len(found)))
+        found += to_readings(patient_id, part.columns, range(hi - 1, take - 1, -1))
+        if len(found) >= limit:
+            break
+    return found
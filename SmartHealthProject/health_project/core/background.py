@@ -0,0 +1,112 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorker:
+    """One daemon thread per server process for work that must not hold up a request.
+
+    Jobs handed to submit() run in order on the thread; functions registered with
+    every_interval() run once per `interval` seconds (and at exit). The server
+    entry points (health_project/wsgi.py, asgi.py) call start(). Until then, e.g.
+    in management commands and tests, `running` is False and submit() runs the
+    job right away in the caller.
+    """
+
+    def __init__(self, interval, max_pending):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._jobs = deque()
+        self._periodic = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._held = False
+        self._stopping = False
+
+    @property
+    def running(self):
+        """True when submitted work is deferred instead of run in the caller."""
+        return self._thread is not None or self._held
+
+    def every_interval(self, func):
+        self._periodic.append(func)
+        return func
+
+    def submit(self, func, *args):
+        if self.running:
+            with self._lock:
+                queued = len(self._jobs) < self.max_pending
+                if queued:
+                    self._jobs.append((func, args))
+            if queued:
+                self._wakeup.set()
+                return
+            # Back-pressure: better a slower request than dropped work
+            logger.warning("Background queue full, running %s in the caller", func.__qualname__)
+        func(*args)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='background-worker', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def hold(self):
+        """Defers work without a thread; it runs when run_pending() is called (benchmarks)."""
+        self._held = True
+
+    def run_pending(self):
+        """Runs the queued jobs, then the periodic functions, on the calling thread."""
+        while True:
+            with self._lock:
+                if not self._jobs:
+                    break
+                func, args = self._jobs.popleft()
+            self._call(func, *args)
+        for func in self._periodic:
+            self._call(func)
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Background job %s failed", func.__qualname__)
+
+    def _run(self):
+        next_tick = time.monotonic() + self.interval
+        while not self._stopping:
+            self._wakeup.wait(max(0.0, next_tick - time.monotonic()))
+            self._wakeup.clear()
+            close_old_connections()
+            while True:
+                with self._lock:
+                    if not self._jobs:
+                        break
+                    func, args = self._jobs.popleft()
+                self._call(func, *args)
+            if time.monotonic() >= next_tick:
+                for func in self._periodic:
+                    self._call(func)
+                next_tick = time.monotonic() + self.interval
+        connection.close()
+
+    def stop(self):
+        """Stops the thread and finishes whatever is still queued (called at exit)."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 5)
+        self.run_pending()
+
+
+worker = BackgroundWorker(interval=settings.BACKGROUND_FLUSH_INTERVAL, max_pending=settings.BACKGROUND_MAX_PENDING)
@@ -0,0 +1,235 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+from django.db import IntegrityError, connection
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(patient_id, fields):
+    row = dict(fields, patient_id=patient_id)
+    row['timestamp'] = fields['timestamp'].isoformat()
+    return json.dumps(row, separators=(',', ':'))
+
+
+def _decode(line):
+    row = json.loads(line)
+    row['timestamp'] = parse_datetime(row['timestamp'])
+    return row.pop('patient_id'), row
+
+
+def read_journal(path):
+    """Yields (patient_id, fields) for every complete line of a journal segment."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            # A crash mid-write can leave a truncated last line; it was never acknowledged
+            if not line.endswith('\n'):
+                break
+            yield _decode(line)
+
+
+def write_journal(path, rows):
+    """Atomically (re)writes a journal file holding exactly `rows`."""
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(''.join(_encode(patient_id, fields) + '\n' for patient_id, fields in rows))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_rejected(journal_dir, rows):
+    """Writes rows that could not be committed to a file under journal_dir/rejected/; returns its path."""
+    directory = Path(journal_dir) / 'rejected'
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{os.getpid()}-{uuid.uuid4().hex}.jsonl"
+    write_journal(path, rows)
+    return path
+
+
+def save_by_patient(save, rows):
+    """Retries a failed bulk write one patient at a time.
+
+    Returns (unsaved, rejected): rows to try again later (the first non-integrity
+    error and everything after it, e.g. the database is down) and rows the database
+    refuses for good (IntegrityError, e.g. their patient was deleted).
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[0], []).append(row)
+    unsaved, rejected = [], []
+    for group in groups.values():
+        if unsaved:
+            unsaved.extend(group)
+            continue
+        try:
+            save(group)
+        except IntegrityError:
+            rejected.extend(group)
+        except Exception:
+            logger.exception("Ingest write for patient %s failed", group[0][0])
+            unsaved.extend(group)
+    return unsaved, rejected
+
+
+class ReadingBuffer:
+    """Write-behind buffer that coalesces accepted readings into periodic bulk inserts.
+
+    Readings are appended to an fsync'd journal segment before `offer()` returns, so an
+    acknowledged reading survives a crash. Segments are deleted once their readings
+    are committed to SensorReading; leftovers are replayed with `replay_ingest_journal`.
+
+    When a bulk write fails the batch is retried per patient: rows the database
+    refuses (IntegrityError) are set aside in journal_dir/rejected/, the rest is
+    requeued up to max_size.
+    """
+
+    def __init__(self, save, max_size, flush_size, flush_interval, journal_dir=None, fsync=True):
+        self._save = save                      # callable(list of (patient_id, fields))
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.journal_dir = Path(journal_dir) if journal_dir else None
+
+        self._pending = deque()
+        self._segments = []                    # closed segments not yet committed
+        self._journal = None
+        self._journal_path = None
+        self._lock = threading.Lock()          # guards _pending and the open segment
+        self._flush_lock = threading.Lock()    # one flush at a time
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    # --- Producer side (request threads) ---
+    def offer(self, patient_id, readings):
+        """Queues readings for one patient. Returns False when the buffer is full."""
+        with self._lock:
+            if self._closed or len(self._pending) + len(readings) > self.max_size:
+                return False
+            if self.journal_dir:
+                self._append_journal(patient_id, readings)
+            self._pending.extend((patient_id, fields) for fields in readings)
+            full = len(self._pending) >= self.flush_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+        return True
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _append_journal(self, patient_id, readings):
+        if self._journal is None:
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            self._journal_path = self.journal_dir / f"{os.getpid()}-{uuid.uuid4().hex}.jsonl"
+            self._journal = open(self._journal_path, 'a', encoding='utf-8')
+        self._journal.write(''.join(_encode(patient_id, f) + '\n' for f in readings))
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _rotate_journal(self):
+        # Caller holds self._lock
+        if self._journal is not None:
+            self._journal.close()
+            self._segments.append(self._journal_path)
+            self._journal = self._journal_path = None
+
+    # --- Consumer side (flusher thread / shutdown) ---
+    def flush(self):
+        """Writes everything queued so far. Returns the number of readings committed."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+                self._rotate_journal()
+                segments = list(self._segments)
+            if not batch:
+                return 0
+            try:
+                self._save(batch)
+                unsaved, rejected = [], []
+            except Exception:
+                logger.exception("Ingest buffer bulk write of %d readings failed, retrying per patient", len(batch))
+                unsaved, rejected = save_by_patient(self._save, batch)
+            if rejected:
+                self._reject(rejected, "refused by the database")
+            if unsaved:
+                # Put them back in front, within max_size; their journal segments stay on disk
+                with self._lock:
+                    room = max(0, self.max_size - len(self._pending))
+                    self._pending.extendleft(reversed(unsaved[:room]))
+                if len(unsaved) > room:
+                    self._reject(unsaved[room:], "buffer full on requeue")
+                logger.error("Ingest buffer flush failed, %d readings requeued", min(len(unsaved), room))
+                return len(batch) - len(unsaved) - len(rejected)
+            with self._lock:
+                del self._segments[:len(segments)]
+            for path in segments:
+                path.unlink(missing_ok=True)
+            return len(batch) - len(rejected)
+
+    def _reject(self, rows, reason):
+        """Sets rows aside so one bad row can't block the buffer (see `replay_ingest_journal --rejected`)."""
+        path = write_rejected(self.journal_dir, rows) if self.journal_dir else None
+        logger.error("Ingest buffer dropped %d readings (%s)%s", len(rows), reason,
+                     f", saved to {path}" if path else "")
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None and not self._closed:
+                    self._thread = threading.Thread(target=self._run, name='ingest-buffer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        connection.close()
+
+    def close(self):
+        """Stops the flusher and commits whatever is still queued (called at exit)."""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+        with self._lock:
+            self._rotate_journal()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Returns the process-wide buffer, or None when write-behind ingest is disabled."""
+    global _buffer
+    if not settings.INGEST_BUFFER_ENABLED:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                from .ingest import save_grouped_readings
+                _buffer = ReadingBuffer(
+                    save=save_grouped_readings,
+                    max_size=settings.INGEST_BUFFER_MAX_SIZE,
+                    flush_size=settings.INGEST_BUFFER_FLUSH_SIZE,
+                    flush_interval=settings.INGEST_BUFFER_FLUSH_INTERVAL,
+                    journal_dir=settings.INGEST_BUFFER_JOURNAL_DIR,
+                    fsync=settings.INGEST_BUFFER_FSYNC,
+                )
+                atexit.register(_buffer.close)
+    return _buffer
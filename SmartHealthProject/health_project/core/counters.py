@@ -0,0 +1,92 @@
+import threading
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import ArchivedPartition, Doctor, Patient, Prescription, SensorReading, SystemCounter
+
+# Counter name -> how to compute its true value (first use and `manage.py reconcile_counters`)
+SOURCES = {
+    'doctors': lambda: Doctor.objects.count(),
+    'patients': lambda: Patient.objects.count(),
+    'prescriptions': lambda: Prescription.objects.count(),
+    'readings': lambda: SensorReading.objects.count(),   # hot table only
+    'archived_readings': lambda: ArchivedPartition.objects.aggregate(n=Sum('row_count'))['n'] or 0,
+}
+
+
+def add(name, delta):
+    """Adjusts a counter by `delta`, in the caller's transaction. Call it after the change itself.
+
+    A counter that doesn't exist yet is created from its table instead (which
+    already includes the change).
+    """
+    if not delta:
+        return
+    if not SystemCounter.objects.filter(name=name).update(value=F('value') + delta):
+        reconcile([name])
+
+
+# --- Deferred mode: deltas from the ingest path, summed in memory and written by the background worker ---
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def defer(name, delta):
+    """Like add(), for changes already committed: written by flush(), one UPDATE per counter."""
+    with _pending_lock:
+        _pending[name] = _pending.get(name, 0) + delta
+
+
+def flush():
+    """Writes the deferred deltas in one transaction. Kept for the next flush if that fails.
+
+    A crash loses at most one interval of deltas; `manage.py reconcile_counters` repairs it.
+    """
+    with _pending_lock:
+        deltas = {name: delta for name, delta in _pending.items() if delta}
+        _pending.clear()
+    if not deltas:
+        return
+    try:
+        with transaction.atomic():
+            for name, delta in deltas.items():
+                add(name, delta)
+    except Exception:
+        for name, delta in deltas.items():
+            defer(name, delta)
+        raise
+
+
+def totals():
+    """{name: value} for every counter, in one query (plus this process's unwritten deltas)."""
+    values = dict(SystemCounter.objects.values_list('name', 'value'))
+    missing = [name for name in SOURCES if name not in values]
+    if missing:
+        values.update({name: value for name, (value, _) in reconcile(missing).items()})
+    with _pending_lock:
+        for name, delta in _pending.items():
+            values[name] = values.get(name, 0) + delta
+    return values
+
+
+def reconcile(names=None):
+    """Recounts from the real tables and overwrites the counters. Returns {name: (value, drift)}.
+
+    Each counter is recounted and written in its own transaction; a write that
+    lands between the two is picked up by the next run.
+    """
+    result = {}
+    for name in names or SOURCES:
+        with transaction.atomic():
+            value = SOURCES[name]()
+            with _pending_lock:
+                _pending.pop(name, None)   # already in the recount
+            counter, created = SystemCounter.objects.get_or_create(
+                name=name, defaults={'value': value, 'reconciled_at': timezone.now()})
+            drift = 0 if created else value - counter.value
+            if not created:
+                SystemCounter.objects.filter(name=name).update(value=value, reconciled_at=timezone.now())
+        result[name] = (value, drift)
+    return result
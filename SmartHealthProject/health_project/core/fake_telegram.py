@@ -0,0 +1,85 @@
+"""Minimal local stand-in for the Telegram Bot API, for tests and offline development.
+
+    server = FakeTelegramServer().start()
+    TelegramDelivery(token='123:abc', base_url=server.base_url, ...)
+
+Answers getMe and sendMessage, records every message with its arrival time, and
+can be told to fail the next requests (HTTP 429 flood control or 5xx).
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            params = json.loads(body or '{}')
+        else:
+            params = dict(parse_qsl(body))
+        method = self.path.rsplit('/', 1)[-1]
+        status, payload = self.server.fake.handle(method, params)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeTelegramServer:
+    def __init__(self, host='127.0.0.1', port=0):
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._lock = threading.Lock()
+        self._failures = []
+        self.messages = []   # dicts: chat_id, text, at (monotonic)
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name='fake-telegram', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def fail_next(self, count=1, status=500, retry_after=None):
+        """Makes the next `count` sendMessage calls fail (429 with retry_after, or `status`)."""
+        with self._lock:
+            self._failures += [(429 if retry_after is not None else status, retry_after)] * count
+
+    def handle(self, method, params):
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}}
+        if method != 'sendMessage':
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+        with self._lock:
+            failure = self._failures.pop(0) if self._failures else None
+            if failure is None:
+                self.messages.append({'chat_id': str(params.get('chat_id')), 'text': params.get('text'),
+                                      'at': time.monotonic()})
+                message_id = len(self.messages)
+        if failure is not None:
+            status, retry_after = failure
+            payload = {'ok': False, 'error_code': status, 'description': 'Fake failure'}
+            if retry_after is not None:
+                payload['description'] = 'Too Many Requests'
+                payload['parameters'] = {'retry_after': retry_after}
+            return status, payload
+
+        chat = {'id': int(params['chat_id']), 'type': 'private'}
+        return 200, {'ok': True, 'result': {'message_id': message_id, 'date': int(time.time()),
+                                            'chat': chat, 'text': params.get('text')}}
@@ -0,0 +1,135 @@
+import base64
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import archive_reader
+from .models import SensorReading
+
+
+# --- Cursor: opaque token for the (timestamp, id) of the last row on a page ---
+def encode_cursor(reading):
+    raw = f"{reading.timestamp.isoformat()}|{reading.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns (timestamp, id). Raises ValueError for a malformed token.
+
+    Cursors we hand out always carry a UTC offset; a naive timestamp can't be
+    compared with stored ones, so it is rejected like any other bad token.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        ts, reading_id = raw.split('|')
+        ts = parse_datetime(ts)
+        reading_id = int(reading_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if ts is None or timezone.is_naive(ts):
+        raise ValueError("Invalid cursor")
+    return ts, reading_id
+
+
+def parse_bound(value, end=False):
+    """Parses a from/to query value (date or datetime). A bare `to` date includes that whole day.
+
+    Returns None for an empty value, raises ValueError for an unparseable one.
+    """
+    if not value:
+        return None
+    ts = parse_datetime(value)
+    if ts is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        ts = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    if timezone.is_naive(ts):
+        ts = timezone.make_aware(ts)
+    return ts
+
+
+class HistoryPage:
+    def __init__(self, readings, next_cursor):
+        self.readings = readings
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def history_page(patient, cursor=None, start=None, end=None, page_size=None):
+    """One page of a patient's readings, newest first, within [start, end).
+
+    Keyset pagination on (timestamp, id): the cost of a page depends on the page
+    size only, not on how far back the page is. Readings moved to the cold
+    archive are merged in when the page reaches back into archived days.
+    """
+    page_size = page_size or settings.HISTORY_PAGE_SIZE
+    before = decode_cursor(cursor) if cursor else None
+    qs = SensorReading.objects.filter(patient=patient)
+    if start is not None:
+        qs = qs.filter(timestamp__gte=start)
+    if end is not None:
+        qs = qs.filter(timestamp__lt=end)
+    if before:
+        ts, reading_id = before
+        # timestamp <= ts keeps the index range; the OR breaks ties on id
+        qs = qs.filter(timestamp__lte=ts).filter(Q(timestamp__lt=ts) | Q(id__lt=reading_id))
+
+    rows = list(qs.order_by('-timestamp', '-id')[:page_size + 1])
+
+    # Archived readings can only land on this page if they are newer than the last hot row
+    floor = rows[-1].timestamp if len(rows) > page_size else start
+    cold = archive_reader.read_range(patient.id, floor=floor, ceiling=before[0] if before else end,
+                              start=start, end=end, before=before, limit=page_size + 1)
+    if cold:
+        merged = {r.id: r for r in cold}
+        merged.update((r.id, r) for r in rows)
+        rows = sorted(merged.values(), key=lambda r: (r.timestamp, r.id), reverse=True)[:page_size + 1]
+
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return HistoryPage(rows[:page_size], next_cursor)
+
+
+def range_summary(patient, start=None, end=None):
+    """Count / avg / min / max of vitals over [start, end), hot table and cold archive together.
+
+    Same keys as rollups.summarize(), computed from the readings themselves.
+    """
+    qs = SensorReading.objects.filter(patient=patient)
+    if start is not None:
+        qs = qs.filter(timestamp__gte=start)
+    if end is not None:
+        qs = qs.filter(timestamp__lt=end)
+    hot = qs.aggregate(count=Count('id'), hr_sum=Sum('heart_rate'), hr_min=Min('heart_rate'), hr_max=Max('heart_rate'),
+                       temp_sum=Sum('body_temperature'), temp_min=Min('body_temperature'),
+                       temp_max=Max('body_temperature'))
+    cold = archive_reader.ArchiveReader(patient.id, start, end).aggregate()
+
+    summary = {'count': hot['count'] + cold['count']}
+    for prefix, metric in (('hr', 'heart_rate'), ('temp', 'body_temperature')):
+        c = cold[metric]
+        n = hot['count'] + c['count']
+        total = (hot[f'{prefix}_sum'] or 0) + c['sum']
+        summary[f'{prefix}_avg'] = total / n if n else None
+        summary[f'{prefix}_min'] = min((v for v in (hot[f'{prefix}_min'], c['min']) if v is not None), default=None)
+        summary[f'{prefix}_max'] = max((v for v in (hot[f'{prefix}_max'], c['max']) if v is not None), default=None)
+    return summary
+
+
+def reading_json(r):
+    return {
+        'id': r.id,
+        'timestamp': r.timestamp.isoformat(),
+        'heart_rate': r.heart_rate,
+        'body_temperature': r.body_temperature,
+        'room_temperature': r.room_temperature,
+        'humidity': r.humidity,
+        'battery_level': r.battery_level,
+        'signal_strength': r.signal_strength,
+    }
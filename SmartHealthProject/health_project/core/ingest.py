@@ -0,0 +1,187 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import background, counters, rollups
+from .buffer import get_buffer
+from .models import LatestReading, SensorReading
+
+# Sent after a batch of device readings is committed, with readings=[SensorReading, ...] and
+# latest=[the readings that became their patient's LatestReading] (a replayed older batch has none).
+# Hook for consumers that don't need to be in the insert transaction (live push, alerts, ...).
+readings_ingested = Signal()
+
+# --- Fields a device is allowed to send for one reading ---
+REQUIRED_FIELDS = {
+    'heart_rate': float,
+    'body_temperature': float,
+}
+OPTIONAL_FIELDS = {
+    'room_temperature': float,
+    'humidity': float,
+    'battery_level': int,
+    'signal_strength': int,
+}
+
+# Readings stamped further in the future than this are rejected (device clock drift)
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+def _to_number(value, cast):
+    # bool is an int subclass, but "heart_rate": true is never a real reading
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError
+    return int(number) if cast is int else number
+
+
+def parse_reading(item, now=None):
+    """Validates one reading dict from a device and returns the clean model fields.
+
+    Raises ValueError with a short message when the reading must be rejected.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Reading must be a JSON object")
+
+    fields = {}
+    for name, cast in REQUIRED_FIELDS.items():
+        if item.get(name) is None:
+            raise ValueError(f"Missing {name}")
+        try:
+            fields[name] = _to_number(item[name], cast)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid {name}")
+
+    for name, cast in OPTIONAL_FIELDS.items():
+        if item.get(name) is None:
+            continue
+        try:
+            fields[name] = _to_number(item[name], cast)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid {name}")
+
+    # Device-side timestamp (ISO-8601). Buffered samples keep the time they were measured.
+    now = now or timezone.now()
+    raw_ts = item.get('timestamp')
+    if raw_ts is None:
+        fields['timestamp'] = now
+    else:
+        ts = parse_datetime(raw_ts) if isinstance(raw_ts, str) else None
+        if ts is None:
+            raise ValueError("Invalid timestamp")
+        if timezone.is_naive(ts):
+            ts = timezone.make_aware(ts, timezone.get_default_timezone())
+        if ts > now + MAX_CLOCK_SKEW:
+            raise ValueError("Timestamp is in the future")
+        fields['timestamp'] = ts
+
+    return fields
+
+
+def parse_batch(items):
+    """Validates a list of readings in one pass.
+
+    Returns (valid, results): `valid` is a list of (index, fields) for the readings
+    that passed, `results` holds one status dict per input item, in input order.
+    """
+    now = timezone.now()
+    valid = []
+    results = []
+    for index, item in enumerate(items):
+        try:
+            fields = parse_reading(item, now=now)
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'message': str(e)})
+            continue
+        valid.append((index, fields))
+        results.append({'index': index, 'status': 'ok'})
+    return valid, results
+
+
+def update_latest(readings):
+    """Moves each patient's LatestReading row forward to the newest of `readings`.
+
+    Older readings (e.g. a replayed batch) never overwrite a newer latest row.
+    Returns the readings that did become the latest row.
+    """
+    newest = {}
+    for r in readings:
+        current = newest.get(r.patient_id)
+        if current is None or (r.timestamp, r.pk or 0) >= (current.timestamp, current.pk or 0):
+            newest[r.patient_id] = r
+
+    advanced = []
+    for patient_id, r in newest.items():
+        values = LatestReading.values_from(r)
+        newer_or_same = LatestReading.objects.filter(patient_id=patient_id, timestamp__lte=r.timestamp)
+        if newer_or_same.update(**values):
+            advanced.append(r)
+            continue
+        _, created = LatestReading.objects.get_or_create(patient_id=patient_id, defaults=values)
+        # Row existed: either it is genuinely newer, or another writer just created it
+        if created or newer_or_same.update(**values):
+            advanced.append(r)
+    return advanced
+
+
+def _bulk_insert(objs):
+    if not objs:
+        return []
+    with transaction.atomic():
+        objs = SensorReading.objects.bulk_create(objs, batch_size=settings.INGEST_BULK_BATCH_SIZE)
+        latest = update_latest(objs)
+        if background.worker.running:
+            # Rows every upload would touch (the readings counter, rollup buckets) are written once per interval
+            transaction.on_commit(lambda: _defer_aggregates(objs))
+        else:
+            counters.add('readings', len(objs))
+            if settings.ROLLUPS_ON_INGEST:
+                rollups.apply_rollups(objs)
+        transaction.on_commit(lambda: readings_ingested.send(sender=SensorReading, readings=objs, latest=latest))
+    return objs
+
+
+def _defer_aggregates(objs):
+    counters.defer('readings', len(objs))
+    if settings.ROLLUPS_ON_INGEST:
+        rollups.defer(objs)
+
+
+@background.worker.every_interval
+def flush_aggregates():
+    """Writes the counter deltas and rollup buckets deferred by ingests since the last interval."""
+    try:
+        counters.flush()
+    finally:
+        rollups.flush()
+
+
+def save_readings(patient_id, readings):
+    """Writes a list of parsed readings for one patient with a single bulk insert."""
+    return _bulk_insert([SensorReading(patient_id=patient_id, **fields) for fields in readings])
+
+
+def save_grouped_readings(rows):
+    """Writes (patient_id, fields) pairs from many patients in one transaction."""
+    return _bulk_insert([SensorReading(patient_id=patient_id, **fields) for patient_id, fields in rows])
+
+
+def submit_readings(patient_id, readings):
+    """Entry point for device uploads.
+
+    Writes straight to the database, or queues into the write-behind buffer when
+    INGEST_BUFFER_ENABLED is on. Returns False if the buffer is full and the
+    device should retry later.
+    """
+    buffer = get_buffer()
+    if buffer is None:
+        save_readings(patient_id, readings)
+        return True
+    return buffer.offer(patient_id, readings)
@@ -0,0 +1,184 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Patient
+
+
+# ==========================================
+# RING BUFFERS (fixed memory, no queries)
+# ==========================================
+
+class RateRing:
+    """Event counts per wall-clock second over the last `size` seconds."""
+
+    def __init__(self, size):
+        self.size = size
+        self.counts = [0] * size
+        self.seconds = [-1] * size   # which second each slot currently holds
+
+    def add(self, n, now):
+        sec = int(now)
+        i = sec % self.size
+        if self.seconds[i] != sec:
+            self.seconds[i] = sec
+            self.counts[i] = 0
+        self.counts[i] += n
+
+    def rate(self, window, now):
+        """Average events per second over the last `window` seconds (at most `size`)."""
+        window = min(window, self.size)
+        sec = int(now)
+        total = sum(c for c, s in zip(self.counts, self.seconds) if sec - window < s <= sec)
+        return total / window
+
+
+class SampleRing:
+    """The last `size` observations of a value, for percentiles."""
+
+    def __init__(self, size):
+        self.values = np.zeros(size)
+        self.next = 0
+        self.filled = 0
+
+    def extend(self, values):
+        size = len(self.values)
+        values = np.asarray(values[-size:], dtype=float)
+        self.values[(self.next + np.arange(len(values))) % size] = values
+        self.next = (self.next + len(values)) % size
+        self.filled = min(size, self.filled + len(values))
+
+    def summary(self):
+        if not self.filled:
+            return None
+        p50, p95 = np.percentile(self.values[:self.filled], [50, 95])
+        return {'p50': float(p50), 'p95': float(p95), 'max': float(self.values[:self.filled].max()),
+                'samples': self.filled}
+
+
+# ==========================================
+# INGEST PIPELINE METRICS
+# ==========================================
+
+class IngestMetrics:
+    """Live fleet-health numbers kept on the ingest path, per process.
+
+    - readings/second overall and per doctor (per-second ring buffers)
+    - end-to-end lag: commit time minus the reading's (device) timestamp
+    - inter-arrival gap per device: time between two batches landing for the same patient
+
+    The doctor of each patient (and their name, for the dashboard) is cached and
+    looked up once per batch for patients not seen recently, so steady-state
+    recording does no query and neither does reading a snapshot.
+
+    Per-patient entries are dropped when the patient is deleted, and devices
+    silent for more than ARRIVAL_TTL seconds are forgotten.
+    """
+
+    DOCTOR_TTL = 600
+    ARRIVAL_TTL = 86400
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, window, samples):
+        self.window = window
+        self.samples = samples
+        self.total = RateRing(window)
+        self.per_doctor = {}     # doctor id (None = unassigned) -> RateRing
+        self.lag = SampleRing(samples)
+        self.gaps = SampleRing(samples)
+        self.last_arrival = {}   # patient_id -> unix time of the last batch for that device
+        self._doctors = {}       # patient_id -> (doctor id, loaded_at)
+        self.doctor_names = {}   # doctor id -> display name
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+
+    def forget_patient_doctor(self, patient_id):
+        with self._lock:
+            self._doctors.pop(patient_id, None)
+
+    def forget_patient(self, patient_id):
+        with self._lock:
+            self._doctors.pop(patient_id, None)
+            self.last_arrival.pop(patient_id, None)
+
+    def _prune(self, unix, now):
+        self.last_arrival = {pid: t for pid, t in self.last_arrival.items() if unix - t <= self.ARRIVAL_TTL}
+        self._doctors = {pid: entry for pid, entry in self._doctors.items() if now - entry[1] <= self.DOCTOR_TTL}
+        self._last_prune = unix
+
+    def _missing_doctors(self, patient_ids, now):
+        return [pid for pid in patient_ids
+                if pid not in self._doctors or now - self._doctors[pid][1] > self.DOCTOR_TTL]
+
+    def _load_doctors(self, patient_ids, now):
+        # Queried without holding the lock, so other ingest threads and snapshot() never wait on the database
+        rows = list(Patient.objects.filter(id__in=patient_ids)
+                    .values_list('id', 'doctor_id', 'doctor__user__first_name', 'doctor__user__last_name'))
+        with self._lock:
+            for pid, doctor_id, first, last in rows:
+                self._doctors[pid] = (doctor_id, now)
+                if doctor_id is not None:
+                    self.doctor_names[doctor_id] = f"Dr. {first} {last}".strip()
+
+    def record(self, readings, now=None):
+        if not readings:
+            return
+        now = timezone.now() if now is None else now
+        unix = now.timestamp()
+        counts = {}
+        for r in readings:
+            counts[r.patient_id] = counts.get(r.patient_id, 0) + 1
+        lags = [(now - r.timestamp).total_seconds() for r in readings]
+
+        with self._lock:
+            missing = self._missing_doctors(counts, time.monotonic())
+        if missing:
+            self._load_doctors(missing, time.monotonic())
+
+        with self._lock:
+            if unix - self._last_prune > self.PRUNE_INTERVAL:
+                self._prune(unix, time.monotonic())
+            self.total.add(len(readings), unix)
+            gaps = []
+            for pid, n in counts.items():
+                doctor_id = self._doctors.get(pid, (None, 0))[0]
+                ring = self.per_doctor.get(doctor_id)
+                if ring is None:
+                    ring = self.per_doctor[doctor_id] = RateRing(self.window)
+                ring.add(n, unix)
+                last = self.last_arrival.get(pid)
+                if last is not None:
+                    gaps.append(unix - last)
+                self.last_arrival[pid] = unix
+            self.lag.extend(lags)
+            self.gaps.extend(gaps)
+
+    def snapshot(self, now=None, top=10, silent_after=60):
+        now = (timezone.now() if now is None else now).timestamp()
+        with self._lock:
+            per_doctor = sorted(((ring.rate(60, now), doctor_id) for doctor_id, ring in self.per_doctor.items()),
+                                key=lambda item: item[0], reverse=True)
+            silent = sum(1 for t in self.last_arrival.values() if now - t > silent_after)
+            return {
+                'rate_1m': self.total.rate(60, now),
+                'rate_window': self.total.rate(self.window, now),
+                'window': self.window,
+                'per_doctor': [(self.doctor_names.get(doctor_id, "Unassigned"), rate)
+                               for rate, doctor_id in per_doctor[:top] if rate > 0],
+                'lag': self.lag.summary(),
+                'gap': self.gaps.summary(),
+                'devices_seen': len(self.last_arrival),
+                'devices_silent': silent,
+                'silent_after': silent_after,
+            }
+
+
+ingest_metrics = IngestMetrics(window=settings.INGEST_METRICS_WINDOW, samples=settings.INGEST_METRICS_SAMPLES)
+
+
+def record_ingest(sender, readings, **kwargs):
+    """readings_ingested receiver: feeds the pipeline ring buffers."""
+    ingest_metrics.record(readings)
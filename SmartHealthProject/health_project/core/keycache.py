@@ -0,0 +1,106 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Patient
+
+_MISSING = object()
+
+
+class ApiKeyCache:
+    """Bounded LRU + TTL map from Patient.api_key to patient id for device auth.
+
+    Unknown keys are cached as None (with a shorter TTL) so a client scanning
+    random keys costs one query per key per TTL instead of one per request.
+
+    Invalidation (see core.signals) only reaches the current process: another
+    worker keeps resolving a replaced or deleted key until its entry expires, so
+    the TTL stays short. A reading stored for a patient deleted meanwhile fails
+    the foreign key; the ingest views answer that like an invalid key.
+    """
+
+    def __init__(self, max_size, ttl, negative_ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()   # key -> (patient_id or None, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key, value, now):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries[key] = (value, now + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _normalize(api_key):
+        try:
+            return str(uuid.UUID(str(api_key)))
+        except ValueError:
+            return None
+
+    def resolve(self, api_key):
+        """Returns the patient id owning `api_key`, or None if the key is invalid."""
+        key = self._normalize(api_key)
+        if key is None:
+            # Malformed keys can never match a UUIDField, no query needed
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            value = self._get(key, now)
+            if value is not _MISSING:
+                self.hits += 1
+                if value is None:
+                    self.negative_hits += 1
+                return value
+            self.misses += 1
+
+        patient_id = Patient.objects.filter(api_key=key).values_list('id', flat=True).first()
+        with self._lock:
+            self._put(key, patient_id, now)
+        return patient_id
+
+    def invalidate(self, api_key):
+        with self._lock:
+            self._entries.pop(self._normalize(api_key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+api_key_cache = ApiKeyCache(
+    max_size=settings.API_KEY_CACHE_SIZE,
+    ttl=settings.API_KEY_CACHE_TTL,
+    negative_ttl=settings.API_KEY_CACHE_NEGATIVE_TTL,
+)
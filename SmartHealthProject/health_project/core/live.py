@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import LatestReading
+from .presence import presence
+
+
+def signal_label(sig):
+    if sig > -50: return "Excellent"
+    elif sig > -70: return "Good"
+    elif sig > -85: return "Weak"
+    return "Poor"
+
+
+def live_payload(reading):
+    """Serializes a SensorReading/LatestReading for the live dashboards (poll and push)."""
+    data = {
+        'is_active': False, 'heart_rate': '--', 'body_temp': '--',
+        'room_temp': '--', 'humidity': '--', 'battery': '--', 'signal': '--'
+    }
+    if reading:
+        data['patient_id'] = reading.patient_id
+        data['timestamp'] = reading.timestamp.isoformat()
+        data['is_active'] = presence.is_online(reading.patient_id, reading.timestamp)
+
+        data['heart_rate'] = int(reading.heart_rate)
+        data['body_temp'] = round(reading.body_temperature, 1)
+        if reading.room_temperature: data['room_temp'] = round(reading.room_temperature, 1)
+        if reading.humidity: data['humidity'] = int(reading.humidity)
+        if reading.battery_level: data['battery'] = reading.battery_level
+        if reading.signal_strength: data['signal'] = signal_label(reading.signal_strength)
+    return data
+
+
+def sse_event(payload, event='vitals'):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+class Subscription:
+    """One open stream. Keeps only the newest payload per patient, so a slow client
+    holds at most one pending update per patient it watches."""
+
+    def __init__(self, patient_ids, loop):
+        self.patient_ids = frozenset(patient_ids)
+        self.loop = loop
+        self._pending = {}
+        self._ready = asyncio.Event()
+
+    def push(self, payload, event):
+        # Runs on the subscriber's event loop
+        self._pending[(event, payload['patient_id'])] = payload
+        self._ready.set()
+
+    async def get(self, timeout):
+        """Waits up to `timeout` seconds and returns the pending (event, payload) pairs (maybe none)."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        pending, self._pending = self._pending, {}
+        return [(event, payload) for (event, _), payload in pending.items()]
+
+
+class LiveHub:
+    """In-process fan-out of new readings to SSE subscribers.
+
+    Publishing is thread-safe (ingest runs in sync request threads or the buffer
+    flusher); each payload is handed to the subscriber's own event loop. Only
+    readings ingested by this process reach its streams, so run the ASGI server
+    as a single process or put devices and dashboards on the same one.
+    """
+
+    def __init__(self):
+        self._subs = {}   # patient_id -> set of Subscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, patient_ids):
+        sub = Subscription(patient_ids, asyncio.get_running_loop())
+        with self._lock:
+            for pid in sub.patient_ids:
+                self._subs.setdefault(pid, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for pid in sub.patient_ids:
+                subs = self._subs.get(pid)
+                if subs:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subs[pid]
+
+    def has_subscribers(self, patient_id):
+        return patient_id in self._subs
+
+    def publish(self, payload, event='vitals'):
+        with self._lock:
+            subs = list(self._subs.get(payload['patient_id'], ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub.push, payload, event)
+            except RuntimeError:
+                # Loop already closed: the stream is going away
+                self.unsubscribe(sub)
+
+
+live_hub = LiveHub()
+
+
+def publish_readings(sender, readings, latest=(), **kwargs):
+    """readings_ingested receiver: pushes each patient's new latest reading to open streams.
+
+    Readings older than the stored latest one (a replayed backlog) are not pushed.
+    """
+    for reading in latest:
+        if live_hub.has_subscribers(reading.patient_id):
+            live_hub.publish(live_payload(reading))
+
+
+def publish_presence(patient_id, is_online):
+    """Presence listener: tells open streams when a device comes online or goes quiet."""
+    if live_hub.has_subscribers(patient_id):
+        live_hub.publish({'patient_id': patient_id, 'is_active': is_online}, event='status')
+
+
+presence.add_listener(publish_presence)
+
+
+# --- Version stamp for conditional GETs of the live-data API ---
+def _etag_key(patient_id):
+    return f'live-etag:{patient_id}'
+
+
+def bump_live_versions(sender, readings, latest=(), **kwargs):
+    """readings_ingested receiver: records (reading id, timestamp) of each new latest reading.
+
+    A version is only ever moved forward, also when two commits finish out of order.
+    """
+    if not latest:
+        return
+    stored = cache.get_many([_etag_key(r.patient_id) for r in latest])
+    versions = {}
+    for r in latest:
+        key = _etag_key(r.patient_id)
+        current = stored.get(key)
+        if current is None or current[1] is None or current[1] <= r.timestamp:
+            versions[key] = (r.pk, r.timestamp)
+    cache.set_many(versions, settings.LIVE_ETAG_CACHE_TIMEOUT)
+
+
+def live_etag(patient_id):
+    """ETag for a patient's live payload, built without loading the reading row.
+
+    Changes when a new reading arrives and when the device goes online or
+    offline, the only two things that change the payload. The version comes
+    from the cache entry kept current by bump_live_versions; the database is
+    read only when the entry is missing (new process, evicted entry).
+    """
+    version = cache.get(_etag_key(patient_id))
+    if version is None:
+        version = LatestReading.objects.filter(patient_id=patient_id).values_list('reading_id', 'timestamp').first()
+        version = version or (None, None)
+        cache.set(_etag_key(patient_id), version, settings.LIVE_ETAG_CACHE_TIMEOUT)
+
+    reading_id, timestamp = version
+    if timestamp is None:
+        return f'"{patient_id}-none"'
+    is_active = presence.is_online(patient_id, timestamp)
+    return f'"{patient_id}-{reading_id}-{int(timestamp.timestamp() * 1000)}-{int(is_active)}"'
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import archive
+from core.models import Patient
+
+
+class Command(BaseCommand):
+    help = ("Moves readings older than the retention period out of SensorReading into compressed "
+            "per-patient daily archive files. Safe to re-run; schedule it nightly (e.g. cron).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.READING_RETENTION_DAYS,
+                            help="Keep this many days (up to local midnight) in the hot table.")
+        parser.add_argument('--patient', type=int, default=None, help="Only this patient id.")
+
+    def handle(self, *args, **options):
+        cutoff = archive.retention_cutoff(options['days'])
+        patient_ids = Patient.objects.values_list('id', flat=True).order_by('id')
+        if options['patient']:
+            patient_ids = patient_ids.filter(id=options['patient'])
+
+        total_days = total_rows = 0
+        for patient_id in patient_ids.iterator():
+            days, rows = archive.archive_patient(patient_id, cutoff)
+            if rows:
+                self.stdout.write(f"Patient {patient_id}: archived {rows} readings over {days} days")
+            total_days += days
+            total_rows += rows
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total_rows} readings ({total_days} partitions) older than {cutoff:%Y-%m-%d}."))
@@ -0,0 +1,206 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from core import background
+from core.ingest import save_readings
+from core.keycache import api_key_cache
+from core.models import Doctor, Patient
+
+DEFAULT_BASELINE = settings.BASE_DIR / 'benchmarks' / 'baseline.json'
+
+
+# ==========================================
+# SEEDING
+# ==========================================
+
+def seed(doctors, patients_per_doctor, readings_per_patient, interval=4):
+    """Doctors with patients and a reading every `interval` seconds up to now, through the ingest path."""
+    now = timezone.now()
+    fixtures = {'admin': User.objects.create_superuser('bench-admin')}
+    for d in range(doctors):
+        user = User.objects.create_user(f'bench-doc-{d}', first_name='Doc', last_name=str(d))
+        doctor = Doctor.objects.create(user=user, telegram_chat_id=f'9{d:05d}')
+        fixtures.setdefault('doctor', doctor)
+        for p in range(patients_per_doctor):
+            user = User.objects.create_user(f'bench-pat-{d}-{p}', first_name='Pat', last_name=f'{d}-{p}')
+            patient = Patient.objects.create(user=user, doctor=doctor, medical_condition='Hypertension')
+            fixtures.setdefault('patient', patient)
+            save_readings(patient.id, [
+                {'heart_rate': 60 + (i * 7) % 40, 'body_temperature': 36.2 + (i % 9) / 10, 'room_temperature': 27.0,
+                 'humidity': 65.0, 'battery_level': 80, 'signal_strength': -60,
+                 'timestamp': now - timedelta(seconds=interval * i)}
+                for i in range(readings_per_patient)
+            ])
+    return fixtures
+
+
+# ==========================================
+# BENCHMARKS
+# ==========================================
+
+def benchmarks(fixtures):
+    """name -> (user to log in as or None, method, url, request kwargs)."""
+    patient, doctor = fixtures['patient'], fixtures['doctor']
+    payload = json.dumps({'api_key': str(patient.api_key), 'heart_rate': 72, 'body_temperature': 36.6,
+                          'room_temperature': 27.5, 'humidity': 64, 'battery_level': 80, 'signal_strength': -61})
+    return {
+        'api_submit_data': (None, 'post', reverse('api-submit-data'),
+                            {'data': payload, 'content_type': 'application/json'}),
+        'get_patient_live_data': (patient.user, 'get', reverse('patient-live-data'), {}),
+        'doctor_dashboard_view': (doctor.user, 'get', reverse('doctor-dashboard'), {}),
+        'patient_history_view': (patient.user, 'get', reverse('patient-history'), {}),
+        'patient_detail_view': (doctor.user, 'get', reverse('patient-detail', args=[patient.id]), {}),
+        'admin_dashboard_view': (fixtures['admin'], 'get', reverse('admin-dashboard'), {}),
+    }
+
+
+def measure(client, method, url, kwargs, repeat):
+    """Median/min wall time over `repeat` requests, then one traced request for queries and peak memory."""
+    call = getattr(client, method)
+    call(url, **kwargs)   # warm-up: template loading, caches
+    background.worker.run_pending()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = call(url, **kwargs)
+        times.append(time.perf_counter() - started)
+        # Deferred work runs between requests, as it would on the server's background thread
+        background.worker.run_pending()
+    if response.status_code >= 400:
+        raise CommandError(f"{method.upper()} {url} returned {response.status_code}")
+
+    # Separate pass: tracemalloc slows everything down, so it must not be in the timed loop
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as ctx:
+            call(url, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    background.worker.run_pending()
+    return {
+        'queries': len(ctx.captured_queries),
+        'wall_ms_median': statistics.median(times) * 1000,
+        'wall_ms_min': min(times) * 1000,
+        'peak_kib': peak / 1024,
+    }
+
+
+def compare(results, baseline, time_tolerance=0.5, memory_tolerance=0.5):
+    """Regressions of `results` against `baseline` as human-readable strings (empty list if none).
+
+    Query counts must not grow at all. Wall time and peak memory may grow by the
+    given fraction, plus a small absolute slack so tiny numbers don't flap.
+    """
+    if results['scale'] != baseline['scale']:
+        raise CommandError(f"Baseline was recorded at scale {baseline['scale']}, this run is {results['scale']}.")
+    problems = []
+    for name, old in baseline['benchmarks'].items():
+        new = results['benchmarks'].get(name)
+        if new is None:
+            continue
+        if new['queries'] > old['queries']:
+            problems.append(f"{name}: {new['queries']} queries (baseline {old['queries']})")
+        if new['wall_ms_median'] > old['wall_ms_median'] * (1 + time_tolerance) + 2:
+            problems.append(f"{name}: {new['wall_ms_median']:.1f} ms (baseline {old['wall_ms_median']:.1f} ms)")
+        if new['peak_kib'] > old['peak_kib'] * (1 + memory_tolerance) + 64:
+            problems.append(f"{name}: peak {new['peak_kib']:.0f} KiB (baseline {old['peak_kib']:.0f} KiB)")
+    return problems
+
+
+class Command(BaseCommand):
+    help = ("Seeds a throwaway test database and measures query count, wall time and peak memory "
+            "of the main views and the ingest API; compares against a stored baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=2)
+        parser.add_argument('--patients-per-doctor', type=int, default=25)
+        parser.add_argument('--readings-per-patient', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20, help="Timed requests per benchmark.")
+        parser.add_argument('--only', action='append', help="Run just this benchmark (repeatable).")
+        parser.add_argument('--output', help="Write results as JSON to this file.")
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE),
+                            help="Baseline JSON to compare against (skipped if missing).")
+        parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline.")
+        parser.add_argument('--time-tolerance', type=float, default=0.5,
+                            help="Allowed wall-time growth as a fraction of the baseline.")
+        parser.add_argument('--memory-tolerance', type=float, default=0.5,
+                            help="Allowed peak-memory growth as a fraction of the baseline.")
+
+    def handle(self, *args, **options):
+        scale = {'doctors': options['doctors'], 'patients_per_doctor': options['patients_per_doctor'],
+                 'readings_per_patient': options['readings_per_patient']}
+
+        # Never touch the real database: everything runs against a fresh test database
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run(scale, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, r in results['benchmarks'].items():
+            self.stdout.write(f"{name:<24} {r['queries']:>4} queries  {r['wall_ms_median']:>8.2f} ms median  "
+                              f"{r['wall_ms_min']:>8.2f} ms min  {r['peak_kib']:>9.1f} KiB peak")
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        baseline_path = options['baseline']
+        if options['save_baseline']:
+            Path(baseline_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(baseline_path, 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {baseline_path}."))
+            return
+        try:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            self.stdout.write(f"No baseline at {baseline_path}; run with --save-baseline to create one.")
+            return
+        problems = compare(results, baseline, options['time_tolerance'], options['memory_tolerance'])
+        if problems:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(problems))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def run(self, scale, options):
+        started = time.perf_counter()
+        fixtures = seed(**scale)
+        self.stdout.write(f"Seeded {scale} in {time.perf_counter() - started:.1f}s.")
+        # Measure requests as a server runs them: deferred work is queued, not done in the request
+        background.worker.hold()
+        api_key_cache.clear()
+        reset_queries()
+
+        measured = {}
+        for name, (user, method, url, kwargs) in benchmarks(fixtures).items():
+            if options['only'] and name not in options['only']:
+                continue
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            measured[name] = measure(client, method, url, kwargs, options['repeat'])
+        return {
+            'scale': scale,
+            'recorded_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'settings': {'INGEST_BUFFER_ENABLED': settings.INGEST_BUFFER_ENABLED,
+                         'ROLLUPS_ON_INGEST': settings.ROLLUPS_ON_INGEST},
+            'benchmarks': measured,
+        }
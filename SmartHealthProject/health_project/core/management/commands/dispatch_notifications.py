@@ -0,0 +1,58 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import outbox
+from core.notify import delivery
+
+
+class Command(BaseCommand):
+    help = "Delivers queued Telegram notifications from the outbox (runs until stopped unless --once)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain what is due now and exit.")
+        parser.add_argument('--stats', action='store_true', help="Print queue depth and latency, then exit.")
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help="Seconds to sleep when nothing is due.")
+        parser.add_argument('--stats-every', type=float, default=60, help="Seconds between stats lines.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.write_stats()
+            return
+
+        dispatcher = outbox.Dispatcher(delivery, batch_size=options['batch_size'])
+        last_stats = last_purge = time.monotonic()
+        try:
+            while True:
+                sent, failed = dispatcher.run_once()
+                if sent or failed:
+                    self.stdout.write(f"Sent {sent}, failed {failed}")
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+
+                now = time.monotonic()
+                if now - last_stats >= options['stats_every']:
+                    self.write_stats()
+                    last_stats = now
+                if now - last_purge >= 3600:
+                    outbox.purge_sent()
+                    last_purge = now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            delivery.stop()
+        self.write_stats()
+
+    def write_stats(self):
+        s = outbox.stats()
+        latency = (f"latency avg {s['latency_avg']:.1f}s p95 {s['latency_p95']:.1f}s"
+                   if s['sent_recent'] else "latency n/a")
+        self.stdout.write(
+            f"Outbox depth {s['depth']} (pending {s['pending']}, sending {s['sending']}), failed {s['failed']}, "
+            f"oldest pending {s['oldest_pending_seconds']:.0f}s, sent last 15 min {s['sent_recent']}, {latency}"
+        )
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import counters
+from core.models import Patient
+
+USERNAME_PREFIX = 'loadtest-device-'
+
+# Named server configurations for --serve (environment read by settings.py)
+PROFILES = {
+    'default': {},
+    'buffered': {'INGEST_BUFFER_ENABLED': 'True'},
+    'buffered-large-flush': {'INGEST_BUFFER_ENABLED': 'True', 'INGEST_BUFFER_FLUSH_SIZE': '2000',
+                             'INGEST_BUFFER_FLUSH_INTERVAL': '2.0'},
+}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}   # endpoint -> [seconds]
+        self.statuses = {}    # endpoint -> {status or error name: count}
+        self.readings_sent = 0
+        self.readings_accepted = 0
+
+    def record(self, endpoint, started, status, readings=1, accepted=0):
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - started)
+        counts = self.statuses.setdefault(endpoint, {})
+        counts[status] = counts.get(status, 0) + 1
+        self.readings_sent += readings
+        self.readings_accepted += accepted
+
+    def report(self, elapsed):
+        endpoints = {}
+        for endpoint, latencies in self.latencies.items():
+            arr = np.array(latencies) * 1000
+            counts = self.statuses[endpoint]
+            ok = counts.get(200, 0)
+            endpoints[endpoint] = {
+                'requests': len(arr),
+                'rps': len(arr) / elapsed,
+                'p50_ms': float(np.percentile(arr, 50)),
+                'p95_ms': float(np.percentile(arr, 95)),
+                'p99_ms': float(np.percentile(arr, 99)),
+                'max_ms': float(arr.max()),
+                'error_rate': 1 - ok / len(arr),
+                'statuses': {str(k): v for k, v in counts.items()},
+            }
+        return {
+            'elapsed_s': elapsed,
+            'readings_sent': self.readings_sent,
+            'readings_accepted': self.readings_accepted,
+            'readings_per_s': self.readings_accepted / elapsed,
+            'endpoints': endpoints,
+        }
+
+
+class Device:
+    """One simulated ESP32: the firmware's JSON payload on its cadence, plus offline spells.
+
+    While offline it keeps sampling with device timestamps and uploads the
+    backlog to /api/submit_batch/ when it reconnects, like a real device would.
+    """
+
+    def __init__(self, api_key, interval, rng):
+        self.api_key = api_key
+        self.interval = interval
+        self.rng = rng
+        self.heart_rate = rng.uniform(60, 95)
+        self.body_temp = rng.uniform(36.2, 37.1)
+        self.battery = rng.randint(40, 100)
+        self.rssi = rng.randint(-90, -40)
+        self.backlog = []
+
+    def sample(self, with_timestamp=False):
+        rng = self.rng
+        self.heart_rate = min(180, max(40, self.heart_rate + rng.gauss(0, 2)))
+        self.body_temp = min(41, max(34, self.body_temp + rng.gauss(0, 0.05)))
+        reading = {
+            'heart_rate': round(self.heart_rate),
+            'body_temperature': round(self.body_temp, 1),
+            'room_temperature': round(rng.uniform(24, 31), 1),
+            'humidity': round(rng.uniform(50, 80)),
+            'battery_level': self.battery,
+            'signal_strength': self.rssi + rng.randint(-3, 3),
+        }
+        if with_timestamp:
+            reading['timestamp'] = timezone.now().isoformat()
+        return reading
+
+    async def run(self, client, stats, deadline, outage_every, outage_seconds, outage_fraction):
+        await asyncio.sleep(self.rng.uniform(0, self.interval))   # devices don't boot in lockstep
+        next_outage = time.monotonic() + self.rng.uniform(0, outage_every) if outage_every else None
+        offline_until = 0
+        while time.monotonic() < deadline:
+            now = time.monotonic()
+            if next_outage is not None and now >= next_outage:
+                if self.rng.random() < outage_fraction:
+                    offline_until = now + outage_seconds
+                next_outage = now + outage_every
+
+            if now < offline_until:
+                self.backlog.append(self.sample(with_timestamp=True))
+            else:
+                if self.backlog:
+                    await self.flush_backlog(client, stats)
+                await self.post(client, stats, '/api/submit_data/', dict(self.sample(), api_key=self.api_key), 1)
+            await asyncio.sleep(max(0.0, self.interval + self.rng.uniform(-0.2, 0.2) * self.interval))
+
+    async def flush_backlog(self, client, stats):
+        size = settings.INGEST_MAX_BATCH_SIZE
+        while self.backlog:
+            chunk, self.backlog = self.backlog[:size], self.backlog[size:]
+            await self.post(client, stats, '/api/submit_batch/', {'api_key': self.api_key, 'readings': chunk}, len(chunk))
+
+    async def post(self, client, stats, path, payload, count):
+        started = time.perf_counter()
+        try:
+            response = await client.post(path, json=payload)
+        except httpx.HTTPError as e:
+            stats.record(path, started, type(e).__name__, readings=count)
+            return
+        accepted = 0
+        if response.status_code == 200:
+            accepted = response.json().get('accepted', count) if count > 1 else 1
+        stats.record(path, started, response.status_code, readings=count, accepted=accepted)
+
+
+class Command(BaseCommand):
+    help = ("Simulates a fleet of ESP32 devices posting readings and reports throughput, "
+            "p50/p95/p99 latency and error rates.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=60, help="Seconds to run.")
+        parser.add_argument('--interval', type=float, default=4.0, help="Seconds between readings per device.")
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Server to test (ignored with --serve).")
+        parser.add_argument('--serve', action='store_true',
+                            help="Start a uvicorn server for the run, configured by --profile.")
+        parser.add_argument('--profile', default='default', choices=sorted(PROFILES))
+        parser.add_argument('--port', type=int, default=8765, help="Port for --serve.")
+        parser.add_argument('--outage-every', type=float, default=30,
+                            help="Seconds between chances of a device dropping offline (0 disables).")
+        parser.add_argument('--outage-seconds', type=float, default=20, help="How long an offline spell lasts.")
+        parser.add_argument('--outage-fraction', type=float, default=0.1,
+                            help="Chance a device goes offline at each opportunity.")
+        parser.add_argument('--connections', type=int, default=100, help="Max concurrent HTTP connections.")
+        parser.add_argument('--timeout', type=float, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', dest='json_path', help="Also write the report to this file.")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the synthetic patients and exit.")
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted, _ = User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            self.stdout.write(f"Deleted {deleted} rows for synthetic devices.")
+            return
+
+        api_keys = self.provision(options['devices'])
+        server = None
+        url = options['url']
+        if options['serve']:
+            server, url = self.start_server(options['profile'], options['port'])
+        try:
+            stats, elapsed = asyncio.run(self.run(url, api_keys, options))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(10)
+
+        report = stats.report(elapsed)
+        report.update(profile=options['profile'] if options['serve'] else None, url=url,
+                      devices=options['devices'], interval_s=options['interval'])
+        self.write_report(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def provision(self, count):
+        """Synthetic patients loadtest-device-0000.. with API keys; reused across runs."""
+        existing = set(User.objects.filter(username__startswith=USERNAME_PREFIX).values_list('username', flat=True))
+        wanted = [f'{USERNAME_PREFIX}{i:04d}' for i in range(count)]
+        missing = [name for name in wanted if name not in existing]
+        if missing:
+            User.objects.bulk_create([User(username=name, first_name='Load', last_name=name[-4:]) for name in missing])
+            users = User.objects.filter(username__in=missing)
+            Patient.objects.bulk_create([Patient(user=u) for u in users])
+            counters.add('patients', len(missing))
+            self.stdout.write(f"Provisioned {len(missing)} synthetic patients.")
+        return [str(k) for k in Patient.objects.filter(user__username__in=wanted)
+                .order_by('user__username').values_list('api_key', flat=True)]
+
+    def start_server(self, profile, port):
+        env = dict(os.environ, **PROFILES[profile])
+        cmd = [sys.executable, '-m', 'uvicorn', 'health_project.asgi:application',
+               '--port', str(port), '--log-level', 'warning', '--no-access-log']
+        server = subprocess.Popen(cmd, cwd=settings.BASE_DIR, env=env)
+        url = f'http://127.0.0.1:{port}'
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(url + '/api/submit_data/', timeout=1)
+                return server, url
+            except httpx.HTTPError:
+                if server.poll() is not None:
+                    raise CommandError("Server exited during startup.")
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("Server did not start within 20 s.")
+
+    async def run(self, url, api_keys, options):
+        stats = Stats()
+        rng = random.Random(options['seed'])
+        devices = [Device(key, options['interval'], random.Random(rng.random())) for key in api_keys]
+        limits = httpx.Limits(max_connections=options['connections'], max_keepalive_connections=options['connections'])
+        started = time.monotonic()
+        deadline = started + options['duration']
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=options['timeout']) as client:
+            await asyncio.gather(*(
+                d.run(client, stats, deadline, options['outage_every'], options['outage_seconds'], options['outage_fraction'])
+                for d in devices
+            ))
+        return stats, time.monotonic() - started
+
+    def write_report(self, report):
+        profile = f" (profile {report['profile']})" if report['profile'] else ""
+        self.stdout.write(f"{report['devices']} devices every {report['interval_s']:g}s against {report['url']}{profile}, "
+                          f"{report['elapsed_s']:.1f}s")
+        self.stdout.write(f"Readings: {report['readings_sent']} sent, {report['readings_accepted']} accepted, "
+                          f"{report['readings_per_s']:.1f}/s")
+        for endpoint, e in report['endpoints'].items():
+            self.stdout.write(
+                f"  {endpoint:<20} {e['requests']:>7} req {e['rps']:>8.1f}/s  p50 {e['p50_ms']:.1f} ms  "
+                f"p95 {e['p95_ms']:.1f} ms  p99 {e['p99_ms']:.1f} ms  errors {e['error_rate']:.2%}  {e['statuses']}"
+            )
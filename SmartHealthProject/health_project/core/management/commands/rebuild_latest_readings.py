@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from django.core.management.base import BaseCommand
+
+from core.archive_reader import read_range
+from core.models import ArchivedPartition, LatestReading, Patient, SensorReading
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the LatestReading table (one row per patient) from SensorReading history, "
+            "or from the archive for patients with no readings left in the table.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        newest = (SensorReading.objects.filter(patient=OuterRef('pk'))
+                  .order_by('-timestamp', '-id').values('id')[:1])
+        patients = Patient.objects.annotate(reading_id=Subquery(newest))
+        reading_ids = list(patients.exclude(reading_id=None).values_list('reading_id', flat=True))
+        # Everything archived: the newest archived reading is still the patient's latest vitals
+        archived_only = list(patients.filter(reading_id=None)
+                             .filter(Exists(ArchivedPartition.objects.filter(patient=OuterRef('pk'))))
+                             .values_list('id', flat=True))
+
+        with transaction.atomic():
+            # Rows are overwritten in place, never wiped first, so no patient is ever left without one
+            for start in range(0, len(reading_ids), chunk_size):
+                self.upsert(SensorReading.objects.filter(id__in=reading_ids[start:start + chunk_size]))
+            self.upsert([reading for patient_id in archived_only for reading in read_range(patient_id, limit=1)])
+            stale, _ = (LatestReading.objects
+                        .exclude(Exists(SensorReading.objects.filter(patient=OuterRef('patient'))))
+                        .exclude(Exists(ArchivedPartition.objects.filter(patient=OuterRef('patient'))))
+                        .delete())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt latest readings for {len(reading_ids) + len(archived_only)} patients "
+            f"({len(archived_only)} from the archive), removed {stale} without readings."))
+
+    def upsert(self, readings):
+        LatestReading.objects.bulk_create(
+            [LatestReading(patient_id=r.patient_id, **LatestReading.values_from(r)) for r in readings],
+            update_conflicts=True, unique_fields=['patient'],
+            update_fields=['reading', *LatestReading.COPIED_FIELDS],
+        )
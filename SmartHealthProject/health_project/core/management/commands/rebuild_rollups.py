@@ -0,0 +1,64 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from core import archive
+from core.models import Patient, SensorReading, VitalsRollup
+from core.rollups import RESOLUTIONS, TRUNC_KIND
+
+
+class Command(BaseCommand):
+    help = "Recomputes VitalsRollup buckets from SensorReading (full rebuild or the last N days)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Only rebuild buckets from N days ago (local midnight) onwards.")
+        parser.add_argument('--patient', type=int, default=None, help="Only this patient id.")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days'] is not None:
+            # Start at local midnight so minute, hour and day buckets are all complete
+            day = timezone.localdate() - timedelta(days=options['days'])
+            since = timezone.make_aware(datetime.combine(day, time.min))
+
+        patient_ids = Patient.objects.values_list('id', flat=True)
+        if options['patient']:
+            patient_ids = patient_ids.filter(id=options['patient'])
+
+        total = 0
+        for patient_id in patient_ids.iterator():
+            total += self.rebuild_patient(patient_id, since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} rollup buckets."))
+
+    def rebuild_patient(self, patient_id, since):
+        # Archived days are no longer in SensorReading: keep their buckets as they are
+        hot_start = archive.hot_start(patient_id)
+        if hot_start is not None and (since is None or since < hot_start):
+            since = hot_start
+        readings = SensorReading.objects.filter(patient_id=patient_id)
+        rollups = VitalsRollup.objects.filter(patient_id=patient_id)
+        if since is not None:
+            readings = readings.filter(timestamp__gte=since)
+            rollups = rollups.filter(bucket_start__gte=since)
+
+        buckets = []
+        for res in RESOLUTIONS:
+            rows = (readings.annotate(bucket=Trunc('timestamp', TRUNC_KIND[res]))
+                    .values('bucket')
+                    .annotate(count=Count('id'),
+                              hr_min=Min('heart_rate'), hr_max=Max('heart_rate'), hr_sum=Sum('heart_rate'),
+                              temp_min=Min('body_temperature'), temp_max=Max('body_temperature'),
+                              temp_sum=Sum('body_temperature'))
+                    .order_by())
+            buckets += [VitalsRollup(patient_id=patient_id, resolution=res, bucket_start=row.pop('bucket'), **row)
+                        for row in rows]
+
+        with transaction.atomic():
+            rollups.delete()
+            VitalsRollup.objects.bulk_create(buckets, batch_size=500)
+        return len(buckets)
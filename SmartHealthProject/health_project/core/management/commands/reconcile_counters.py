@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core import counters
+
+
+class Command(BaseCommand):
+    help = "Recounts the dashboard totals from the real tables and fixes any drift (run periodically, e.g. nightly)."
+
+    def handle(self, *args, **options):
+        for name, (value, drift) in counters.reconcile().items():
+            note = f" (was off by {-drift:+d})" if drift else ""
+            self.stdout.write(f"{name}: {value}{note}")
+        self.stdout.write(self.style.SUCCESS("Counters reconciled."))
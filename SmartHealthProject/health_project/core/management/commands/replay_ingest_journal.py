@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.buffer import read_journal, save_by_patient, write_journal, write_rejected
+from core.ingest import save_grouped_readings
+
+
+class Command(BaseCommand):
+    help = "Writes readings left in the ingest buffer journal by a crashed process. Run before starting workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rejected', action='store_true',
+                            help="Retry the readings the buffer set aside in the journal's rejected/ folder instead.")
+
+    def handle(self, *args, **options):
+        journal_dir = settings.INGEST_BUFFER_JOURNAL_DIR
+        source = journal_dir / 'rejected' if options['rejected'] else journal_dir
+        if not source.exists():
+            self.stdout.write("No journal directory, nothing to replay.")
+            return
+
+        total = 0
+        for path in sorted(source.glob('*.jsonl')):
+            rows = list(read_journal(path))
+            try:
+                save_grouped_readings(rows)
+                unsaved, rejected = [], []
+            except Exception:
+                unsaved, rejected = save_by_patient(save_grouped_readings, rows)
+            if rejected:
+                kept = write_rejected(journal_dir, rejected)
+                self.stderr.write(f"{len(rejected)} readings from {path.name} refused by the database, "
+                                  f"saved to {kept}")
+            if unsaved:
+                # Keep only what is still missing, so a rerun doesn't insert the rest twice
+                write_journal(path, unsaved)
+                self.stderr.write(f"Could not write {len(unsaved)} readings from {path.name}; "
+                                  f"run again once the database is back.")
+                total += len(rows) - len(rejected) - len(unsaved)
+                continue
+            path.unlink()
+            total += len(rows) - len(rejected)
+            self.stdout.write(f"Replayed {len(rows) - len(rejected)} readings from {path.name}")
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {total} readings restored."))
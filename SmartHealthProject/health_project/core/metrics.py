@@ -0,0 +1,233 @@
+"""Per-view request metrics (latency, SQL queries, response size) in Prometheus text format.
+
+Counters live in process memory: with several server workers each one reports
+its own numbers, which is what Prometheus expects when scraping per worker.
+"""
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from . import outbox
+from .keycache import api_key_cache
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    """Fixed-bucket histogram; counts[i] holds values <= bounds[i], the last slot is +Inf."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.bounds + ('+Inf',), self.counts):
+            total += n
+            yield bound, total
+
+
+class ViewStats:
+    __slots__ = ('latency', 'queries', 'size', 'query_seconds', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.query_seconds = 0.0
+        self.statuses = {}   # '2xx' / '4xx' / ... -> count
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._views = {}   # view name -> ViewStats
+        self._lock = threading.Lock()
+
+    def record(self, view, status, seconds, queries, query_seconds, size):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats()
+            stats.latency.observe(seconds)
+            stats.queries.observe(queries)
+            stats.query_seconds += query_seconds
+            if size is not None:
+                stats.size.observe(size)
+            status_class = f"{status // 100}xx"
+            stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+
+    def views(self):
+        with self._lock:
+            return sorted(self._views.items())
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+# ==========================================
+# MIDDLEWARE
+# ==========================================
+
+class QueryCounter:
+    """connection.execute_wrapper that counts queries and the time spent in them."""
+
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+@sync_to_async
+def _add_wrapper(counter):
+    connection.execute_wrappers.append(counter)
+
+
+@sync_to_async
+def _remove_wrapper(counter):
+    connection.execute_wrappers.remove(counter)
+
+
+class MetricsMiddleware:
+    """Records a sample of requests into `request_metrics` and warns about ones over budget.
+
+    A request that is not sampled costs one random() call; with
+    METRICS_SAMPLE_RATE = 0 nothing is recorded at all.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.METRICS_SAMPLE_RATE
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        self._record(request, response, started, counter)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        # Sync views and ORM calls of this request run on its thread-sensitive worker
+        # thread, whose connection is not the event loop's: count queries there
+        await _add_wrapper(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await _remove_wrapper(counter)
+        self._record(request, response, started, counter)
+        return response
+
+    def _record(self, request, response, started, counter):
+        seconds = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match and match.view_name else 'unmatched'
+        # Streaming bodies (the SSE feed) have no size; their latency is time to first byte
+        size = None if response.streaming else len(response.content)
+        request_metrics.record(view, response.status_code, seconds, counter.count, counter.seconds, size)
+
+        if counter.count > settings.METRICS_QUERY_BUDGET or seconds > settings.METRICS_LATENCY_BUDGET:
+            logger.warning("Request over budget: %s %s (%s) took %.0f ms with %d queries (%.0f ms SQL)",
+                           request.method, request.path, view, seconds * 1000, counter.count,
+                           counter.seconds * 1000)
+
+
+# ==========================================
+# PROMETHEUS TEXT FORMAT
+# ==========================================
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram(lines, name, help_text, per_view):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for view, hist in per_view:
+        v = _label(view)
+        for bound, total in hist.cumulative():
+            lines.append(f'{name}_bucket{{view="{v}",le="{bound}"}} {total}')
+        lines.append(f'{name}_sum{{view="{v}"}} {hist.sum:.6f}')
+        lines.append(f'{name}_count{{view="{v}"}} {hist.count}')
+
+
+def render():
+    views = request_metrics.views()
+    lines = [
+        "# HELP smarthealth_metrics_sample_rate Fraction of requests recorded below.",
+        "# TYPE smarthealth_metrics_sample_rate gauge",
+        f"smarthealth_metrics_sample_rate {settings.METRICS_SAMPLE_RATE}",
+        "# HELP smarthealth_http_requests_total Sampled requests by view and status class.",
+        "# TYPE smarthealth_http_requests_total counter",
+    ]
+    for view, stats in views:
+        for status, n in sorted(stats.statuses.items()):
+            lines.append(f'smarthealth_http_requests_total{{view="{_label(view)}",status="{status}"}} {n}')
+    _histogram(lines, 'smarthealth_http_request_duration_seconds', "Time until the response is returned.",
+               [(view, s.latency) for view, s in views])
+    _histogram(lines, 'smarthealth_http_request_queries', "SQL queries per request.",
+               [(view, s.queries) for view, s in views])
+    lines += ["# HELP smarthealth_http_request_query_seconds_total Time spent in SQL.",
+              "# TYPE smarthealth_http_request_query_seconds_total counter"]
+    lines += [f'smarthealth_http_request_query_seconds_total{{view="{_label(view)}"}} {s.query_seconds:.6f}'
+              for view, s in views]
+    _histogram(lines, 'smarthealth_http_response_size_bytes', "Response body size (non-streaming responses).",
+               [(view, s.size) for view, s in views])
+
+    keys = api_key_cache.stats()
+    lines += ["# TYPE smarthealth_api_key_cache_entries gauge", f"smarthealth_api_key_cache_entries {keys['size']}"]
+    for name in ('hits', 'negative_hits', 'misses'):
+        lines += [f"# TYPE smarthealth_api_key_cache_{name}_total counter",
+                  f"smarthealth_api_key_cache_{name}_total {keys[name]}"]
+
+    queue = outbox.stats()
+    for name in ('pending', 'sending', 'failed', 'oldest_pending_seconds'):
+        lines += [f"# TYPE smarthealth_outbox_{name} gauge", f"smarthealth_outbox_{name} {queue[name]}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_sensorreading_device_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestReading',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_reading', serialize=False, to='core.patient')),
+                ('heart_rate', models.FloatField()),
+                ('body_temperature', models.FloatField()),
+                ('room_temperature', models.FloatField(blank=True, null=True)),
+                ('humidity', models.FloatField(blank=True, null=True)),
+                ('battery_level', models.IntegerField(blank=True, null=True)),
+                ('signal_strength', models.IntegerField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('reading', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.sensorreading')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_latestreading'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['patient', 'timestamp'], name='reading_patient_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_sensorreading_patient_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VitalsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(60, '1 minute'), (3600, '1 hour'), (86400, '1 day')])),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('hr_min', models.FloatField()),
+                ('hr_max', models.FloatField()),
+                ('hr_sum', models.FloatField()),
+                ('temp_min', models.FloatField()),
+                ('temp_max', models.FloatField()),
+                ('temp_sum', models.FloatField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.patient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('patient', 'resolution', 'bucket_start'), name='rollup_unique_bucket')],
+            },
+        ),
+    ]
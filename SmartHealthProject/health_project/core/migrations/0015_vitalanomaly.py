@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_vitalsrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VitalAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('heart_rate', 'Heart rate'), ('body_temperature', 'Body temperature')], max_length=32)),
+                ('kind', models.CharField(choices=[('spike', 'Out-of-range interval'), ('shift', 'Baseline shift')], max_length=10)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('score', models.FloatField()),
+                ('peak_value', models.FloatField()),
+                ('baseline', models.FloatField(blank=True, null=True)),
+                ('detected_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='core.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', 'start'], name='anomaly_patient_start_idx')],
+            },
+        ),
+    ]
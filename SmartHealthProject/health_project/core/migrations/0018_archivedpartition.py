@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_prescription_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('path', models.CharField(max_length=255)),
+                ('row_count', models.PositiveIntegerField()),
+                ('ts_min', models.DateTimeField()),
+                ('ts_max', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_partitions', to='core.patient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('patient', 'day'), name='archive_unique_patient_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:05
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def count_existing(apps, schema_editor):
+    model = lambda name: apps.get_model('core', name)
+    values = {
+        'doctors': model('Doctor').objects.count(),
+        'patients': model('Patient').objects.count(),
+        'prescriptions': model('Prescription').objects.count(),
+        'readings': model('SensorReading').objects.count(),
+        'archived_readings': model('ArchivedPartition').objects.aggregate(n=Sum('row_count'))['n'] or 0,
+    }
+    model('SystemCounter').objects.bulk_create(
+        model('SystemCounter')(name=name, value=value, reconciled_at=timezone.now()) for name, value in values.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_archivedpartition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SystemCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
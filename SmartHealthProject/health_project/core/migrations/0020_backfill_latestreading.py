@@ -0,0 +1,37 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+COPIED_FIELDS = ('heart_rate', 'body_temperature', 'room_temperature', 'humidity',
+                 'battery_level', 'signal_strength', 'timestamp')
+CHUNK_SIZE = 1000
+
+
+def backfill_latest(apps, schema_editor):
+    # Patients with readings from before LatestReading existed have no row yet
+    Patient = apps.get_model('core', 'Patient')
+    SensorReading = apps.get_model('core', 'SensorReading')
+    LatestReading = apps.get_model('core', 'LatestReading')
+
+    newest = (SensorReading.objects.filter(patient=OuterRef('pk'))
+              .order_by('-timestamp', '-id').values('id')[:1])
+    reading_ids = list(
+        Patient.objects.filter(latest_reading__isnull=True).annotate(reading_id=Subquery(newest))
+        .exclude(reading_id=None).values_list('reading_id', flat=True)
+    )
+    for start in range(0, len(reading_ids), CHUNK_SIZE):
+        readings = SensorReading.objects.filter(id__in=reading_ids[start:start + CHUNK_SIZE])
+        LatestReading.objects.bulk_create(
+            LatestReading(patient_id=r.patient_id, reading_id=r.id, **{f: getattr(r, f) for f in COPIED_FIELDS})
+            for r in readings
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_systemcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_latest, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+from django.db.models import Count, Exists, Max, Min, OuterRef, Sum
+from django.db.models.functions import Trunc
+
+# VitalsRollup.MINUTE / HOUR / DAY and the matching Trunc() kinds
+TRUNC_KIND = {60: 'minute', 3600: 'hour', 86400: 'day'}
+BATCH_SIZE = 500
+
+
+def backfill_rollups(apps, schema_editor):
+    # Readings stored before rollups were maintained on ingest have no buckets yet;
+    # dashboards now read averages from VitalsRollup only
+    Patient = apps.get_model('core', 'Patient')
+    SensorReading = apps.get_model('core', 'SensorReading')
+    VitalsRollup = apps.get_model('core', 'VitalsRollup')
+
+    patient_ids = (Patient.objects
+                   .filter(Exists(SensorReading.objects.filter(patient=OuterRef('pk'))))
+                   .exclude(Exists(VitalsRollup.objects.filter(patient=OuterRef('pk'))))
+                   .values_list('id', flat=True))
+    for patient_id in patient_ids.iterator():
+        readings = SensorReading.objects.filter(patient_id=patient_id)
+        buckets = []
+        for res, kind in TRUNC_KIND.items():
+            rows = (readings.annotate(bucket=Trunc('timestamp', kind))
+                    .values('bucket')
+                    .annotate(count=Count('id'),
+                              hr_min=Min('heart_rate'), hr_max=Max('heart_rate'), hr_sum=Sum('heart_rate'),
+                              temp_min=Min('body_temperature'), temp_max=Max('body_temperature'),
+                              temp_sum=Sum('body_temperature'))
+                    .order_by())
+            buckets += [VitalsRollup(patient_id=patient_id, resolution=res, bucket_start=row.pop('bucket'), **row)
+                        for row in rows]
+        VitalsRollup.objects.bulk_create(buckets, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_backfill_latestreading'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
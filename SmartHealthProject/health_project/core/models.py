@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 # --- Model 1: Doctor (UPDATED) ---
@@ -46,7 +47,14 @@ class SensorReading(models.Model):
     humidity = models.FloatField(null=True, blank=True)
     battery_level = models.IntegerField(null=True, blank=True)
     signal_strength = models.IntegerField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Defaults to arrival time, but batch uploads keep the device-side measurement time
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Per-patient "newest first" lists and time ranges (dashboards, history, detail)
+            models.Index(fields=['patient', 'timestamp'], name='reading_patient_ts_idx'),
+        ]
 
     def __str__(self):
         return f"Reading for {self.patient.user.username} at {self.timestamp}"
@@ -59,6 +67,8 @@ class Prescription(models.Model):
     dose = models.CharField(max_length=100) 
     reminder_time = models.TimeField()
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    # Lets the reminder scheduler pick up new and edited prescriptions incrementally
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.medicine_name} for {self.patient.user.username}"
@@ -71,4 +81,155 @@ class PatientNote(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Note for {self.patient}: {self.text[:20]}"
\ No newline at end of file
+        return f"Note for {self.patient}: {self.text[:20]}"
+
+# --- Model 6: Latest Reading (one row per patient, kept current on ingest) ---
+class LatestReading(models.Model):
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='latest_reading')
+    # Plain id copy: no constraint, so archiving/deleting readings never touches this table
+    reading = models.ForeignKey(SensorReading, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+')
+    heart_rate = models.FloatField()
+    body_temperature = models.FloatField()
+    room_temperature = models.FloatField(null=True, blank=True)
+    humidity = models.FloatField(null=True, blank=True)
+    battery_level = models.IntegerField(null=True, blank=True)
+    signal_strength = models.IntegerField(null=True, blank=True)
+    timestamp = models.DateTimeField(db_index=True)
+
+    # Columns copied over from SensorReading
+    COPIED_FIELDS = ('heart_rate', 'body_temperature', 'room_temperature', 'humidity',
+                     'battery_level', 'signal_strength', 'timestamp')
+
+    @classmethod
+    def values_from(cls, reading):
+        values = {name: getattr(reading, name) for name in cls.COPIED_FIELDS}
+        values['reading_id'] = reading.pk
+        return values
+
+    def __str__(self):
+        return f"Latest reading for patient {self.patient_id} at {self.timestamp}"
+
+
+# --- Model 7: Vitals Rollups (min/max/sum/count per patient per time bucket) ---
+class VitalsRollup(models.Model):
+    MINUTE = 60
+    HOUR = 3600
+    DAY = 86400
+    RESOLUTION_CHOICES = [(MINUTE, '1 minute'), (HOUR, '1 hour'), (DAY, '1 day')]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
+    resolution = models.PositiveIntegerField(choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField()      # local-time aligned (minute / hour / midnight)
+    count = models.PositiveIntegerField(default=0)
+    hr_min = models.FloatField()
+    hr_max = models.FloatField()
+    hr_sum = models.FloatField()
+    temp_min = models.FloatField()
+    temp_max = models.FloatField()
+    temp_sum = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'resolution', 'bucket_start'], name='rollup_unique_bucket'),
+        ]
+
+    @property
+    def hr_avg(self):
+        return self.hr_sum / self.count if self.count else None
+
+    @property
+    def temp_avg(self):
+        return self.temp_sum / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.get_resolution_display()} rollup for patient {self.patient_id} at {self.bucket_start}"
+
+
+# --- Model 8: Vital Anomalies (flagged by the detect_anomalies batch job) ---
+class VitalAnomaly(models.Model):
+    KIND_CHOICES = [
+        ('spike', 'Out-of-range interval'),
+        ('shift', 'Baseline shift'),
+    ]
+    METRIC_CHOICES = [
+        ('heart_rate', 'Heart rate'),
+        ('body_temperature', 'Body temperature'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='anomalies')
+    metric = models.CharField(max_length=32, choices=METRIC_CHOICES)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    score = models.FloatField()                          # peak |z| or mean-shift statistic
+    peak_value = models.FloatField()                     # most extreme value / mean after the shift
+    baseline = models.FloatField(null=True, blank=True)  # EWMA before the interval / mean before the shift
+    detected_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['patient', 'start'], name='anomaly_patient_start_idx')]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} in {self.get_metric_display()} for patient {self.patient_id} at {self.start}"
+
+
+# --- Model 9: Notification Outbox (Telegram messages waiting for the dispatcher) ---
+class OutboxMessage(models.Model):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENDING, 'Sending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    KIND_CHOICES = [('sos', 'SOS'), ('reminder', 'Medicine reminder'), ('alert', 'Automatic alert')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    chat_id = models.CharField(max_length=100)
+    text = models.TextField()
+    # Same key twice -> one message (e.g. a reminder for one prescription and minute)
+    dedupe_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)   # not retried before this
+    claimed_by = models.CharField(max_length=64, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)  # lease; expired leases are reclaimed
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx')]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} to {self.chat_id} ({self.status})"
+
+
+# --- Model 10: Archived Partitions (one compressed columnar file per patient per local day) ---
+class ArchivedPartition(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='archived_partitions')
+    day = models.DateField()                   # local date, like the daily rollups
+    path = models.CharField(max_length=255)    # relative to settings.ARCHIVE_DIR
+    row_count = models.PositiveIntegerField()
+    ts_min = models.DateTimeField()
+    ts_max = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'day'], name='archive_unique_patient_day'),
+        ]
+
+    def __str__(self):
+        return f"Archive of patient {self.patient_id} for {self.day} ({self.row_count} readings)"
+
+
+# --- Model 11: System Counters (dashboard totals, maintained incrementally; see core.counters) ---
+class SystemCounter(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
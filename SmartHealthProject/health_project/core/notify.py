@@ -0,0 +1,185 @@
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import telegram
+from django.conf import settings
+from telegram.error import BadRequest, Forbidden, InvalidToken, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+
+from .outbox import PermanentDeliveryError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TelegramDelivery:
+    """Long-lived async sender shared by the whole process.
+
+    Runs its own event loop on a background thread with a single Bot (one pooled
+    HTTP session). `send()` is thread-safe and returns at once with a
+    concurrent.futures.Future that resolves to True once delivered, False once
+    given up, or raises PermanentDeliveryError if Telegram refused the message. Messages to the same chat go out in order, at most `per_chat_rate`
+    per second; all chats together stay under `global_rate`.
+
+    With the default max_attempts=1 each message is tried once; the outbox
+    dispatcher owns retries. Raise it only for senders without an outbox.
+    """
+
+    def __init__(self, token, base_url, global_rate=30, per_chat_rate=1, max_concurrency=8,
+                 max_attempts=1, backoff=1.0):
+        self.token = token
+        self.base_url = base_url
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._pending = set()
+        self._reset_loop_state()
+
+    def _reset_loop_state(self):
+        # asyncio primitives bind to the first loop that uses them, so a restart needs new ones
+        self._bot = None
+        self._bot_lock = asyncio.Lock()
+        self._global = TokenBucket(self.global_rate)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._chats = {}   # chat_id -> (Lock, TokenBucket); only touched on the worker loop
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.TELEGRAM_BOT_TOKEN, settings.TELEGRAM_API_BASE_URL,
+            global_rate=settings.TELEGRAM_GLOBAL_RATE, per_chat_rate=settings.TELEGRAM_PER_CHAT_RATE,
+            max_concurrency=settings.TELEGRAM_MAX_CONCURRENCY,
+        )
+
+    # --- Thread side ---
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name='telegram-delivery', daemon=True)
+            self._thread.start()
+
+    def send(self, chat_id, text, parse_mode='Markdown'):
+        self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._deliver(str(chat_id), text, parse_mode), self._loop)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return future
+
+    def drain(self, timeout=None):
+        """Waits for queued messages; returns False if some were still pending at the timeout."""
+        _, not_done = concurrent.futures.wait(list(self._pending), timeout)
+        return not not_done
+
+    def stop(self, timeout=5):
+        """Drains, closes the HTTP session and stops the loop."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.drain(timeout)
+        try:
+            asyncio.run_coroutine_threadsafe(self._finish_tasks(), self._loop).result(timeout)
+        except Exception:
+            logger.exception("Telegram delivery tasks did not finish")
+        if self._bot is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._bot.shutdown(), self._loop).result(timeout)
+            except Exception:
+                logger.exception("Telegram bot shutdown failed")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+        self._reset_loop_state()
+
+    # --- Loop side ---
+    async def _finish_tasks(self):
+        # Sends cancelled by the caller (e.g. past the outbox deadline) unwind before the loop stops
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _get_bot(self):
+        async with self._bot_lock:
+            if self._bot is None:
+                bot = telegram.Bot(token=self.token, base_url=self.base_url,
+                                   request=HTTPXRequest(connection_pool_size=self.max_concurrency))
+                await bot.initialize()
+                self._bot = bot
+        return self._bot
+
+    def _chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = (asyncio.Lock(), TokenBucket(self.per_chat_rate, capacity=1))
+        return chat
+
+    async def _deliver(self, chat_id, text, parse_mode):
+        if not self.token:
+            logger.error("TELEGRAM_BOT_TOKEN is not set; dropping message to %s", chat_id)
+            return False
+
+        lock, chat_bucket = self._chat(chat_id)
+        async with lock:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    bot = await self._get_bot()
+                    await chat_bucket.acquire()
+                    await self._global.acquire()
+                    async with self._slots:
+                        await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                    return True
+                except RetryAfter as e:
+                    delay = e.retry_after
+                    if isinstance(delay, timedelta):
+                        delay = delay.total_seconds()
+                except (BadRequest, Forbidden, InvalidToken) as e:
+                    # Bad chat id / markup, blocked bot or bad token: retrying will not help
+                    logger.error("Telegram rejected message to %s: %s", chat_id, e)
+                    raise PermanentDeliveryError(str(e)) from e
+                except NetworkError as e:
+                    delay = self.backoff * 2 ** (attempt - 1)
+                    logger.warning("Telegram send to %s failed (attempt %d): %s", chat_id, attempt, e)
+                except TelegramError as e:
+                    logger.error("Telegram error for %s: %s", chat_id, e)
+                    return False
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(delay)
+        logger.error("Giving up on Telegram message to %s after %d attempts", chat_id, self.max_attempts)
+        return False
+
+
+delivery = TelegramDelivery.from_settings()
+atexit.register(delivery.stop)
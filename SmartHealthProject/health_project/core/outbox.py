@@ -0,0 +1,181 @@
+import concurrent.futures
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentDeliveryError(Exception):
+    """Raised through a delivery future when resending cannot help (blocked bot, bad chat id or markup)."""
+
+
+# ==========================================
+# WRITE SIDE (views, reminder bot, alerts)
+# ==========================================
+
+def enqueue(kind, chat_id, text, dedupe_key=None):
+    """Adds one message to the outbox. Returns False if `dedupe_key` was already used.
+
+    Call it inside the transaction of the action that triggers the message, so
+    the message is stored exactly when the action commits.
+    """
+    return enqueue_many([OutboxMessage(kind=kind, chat_id=str(chat_id), text=text, dedupe_key=dedupe_key)]) == 1
+
+
+def enqueue_many(messages):
+    """Bulk version of enqueue(); rows whose dedupe_key already exists are skipped. Returns the number added."""
+    keys = [m.dedupe_key for m in messages if m.dedupe_key]
+    seen = set(OutboxMessage.objects.filter(dedupe_key__in=keys).values_list('dedupe_key', flat=True)) if keys else set()
+    new = []
+    for m in messages:
+        if m.dedupe_key and m.dedupe_key in seen:
+            continue
+        if m.dedupe_key:
+            seen.add(m.dedupe_key)
+        new.append(m)
+    # ignore_conflicts covers a concurrent writer inserting the same key meanwhile
+    OutboxMessage.objects.bulk_create(new, ignore_conflicts=True)
+    return len(new)
+
+
+# ==========================================
+# DISPATCHER SIDE
+# ==========================================
+
+def _claimable(now):
+    # Due pending rows, plus rows whose claim expired (the dispatcher died mid-batch)
+    return (Q(status=OutboxMessage.PENDING, available_at__lte=now)
+            | Q(status=OutboxMessage.SENDING, claimed_until__lt=now))
+
+
+def claim_batch(limit, lease_seconds, worker='dispatcher'):
+    """Claims up to `limit` due messages for this worker and counts the attempt.
+
+    The conditional UPDATE only takes rows still claimable, so two dispatchers
+    never get the same row while its lease is valid.
+    """
+    now = timezone.now()
+    ids = list(OutboxMessage.objects.filter(_claimable(now))
+               .order_by('available_at', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    token = f"{worker}:{uuid.uuid4().hex[:12]}"
+    OutboxMessage.objects.filter(_claimable(now), id__in=ids).update(
+        status=OutboxMessage.SENDING, claimed_by=token,
+        claimed_until=now + timedelta(seconds=lease_seconds), attempts=F('attempts') + 1,
+    )
+    return list(OutboxMessage.objects.filter(id__in=ids, claimed_by=token).order_by('available_at', 'id'))
+
+
+def mark_sent(messages):
+    if not messages:
+        return
+    now = timezone.now()
+    # Matching claimed_by skips rows another dispatcher reclaimed after our lease ran out
+    for token in {m.claimed_by for m in messages}:
+        OutboxMessage.objects.filter(id__in=[m.id for m in messages if m.claimed_by == token], claimed_by=token).update(
+            status=OutboxMessage.SENT, sent_at=now, claimed_until=None, last_error='')
+
+
+def mark_failed(message, error, max_attempts=None, backoff=None, permanent=False):
+    """Schedules a retry with exponential backoff, or gives up after max_attempts (at once if `permanent`)."""
+    max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+    backoff = settings.OUTBOX_RETRY_BACKOFF if backoff is None else backoff
+    if permanent:
+        changes = dict(status=OutboxMessage.FAILED)
+        logger.error("Outbox message %s rejected, not retrying: %s", message.id, error)
+    elif message.attempts >= max_attempts:
+        changes = dict(status=OutboxMessage.FAILED)
+        logger.error("Giving up on outbox message %s after %d attempts: %s", message.id, message.attempts, error)
+    else:
+        delay = backoff * 2 ** (message.attempts - 1)
+        changes = dict(status=OutboxMessage.PENDING, available_at=timezone.now() + timedelta(seconds=delay))
+    OutboxMessage.objects.filter(id=message.id, claimed_by=message.claimed_by).update(
+        claimed_until=None, last_error=str(error)[:1000], **changes)
+
+
+class Dispatcher:
+    """Claims batches from the outbox and hands them to the Telegram delivery worker.
+
+    Delivery is at-least-once: a message is marked sent only after Telegram
+    accepted it, so a crash between the two can resend it. Retries happen here
+    only (mark_failed); the delivery worker should make a single attempt and
+    raise PermanentDeliveryError for messages that must not be retried.
+
+    The whole batch shares one deadline, `send_timeout`, shorter than the lease:
+    messages still queued then are cancelled and retried later, instead of being
+    sent after another dispatcher may have claimed them again.
+    """
+
+    def __init__(self, delivery, batch_size=None, lease_seconds=None, send_timeout=None, worker='dispatcher'):
+        self.delivery = delivery
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.lease_seconds = lease_seconds or settings.OUTBOX_LEASE_SECONDS
+        # The default leaves at least a quarter of a shorter lease for marking the batch
+        self.send_timeout = send_timeout or min(settings.OUTBOX_SEND_TIMEOUT, self.lease_seconds * 0.75)
+        if self.send_timeout >= self.lease_seconds:
+            raise ValueError("send_timeout must be shorter than the lease")
+        self.worker = worker
+
+    def run_once(self):
+        """Sends one batch; returns (sent, failed)."""
+        batch = claim_batch(self.batch_size, self.lease_seconds, self.worker)
+        futures = [(m, self.delivery.send(m.chat_id, m.text)) for m in batch]
+        concurrent.futures.wait([future for _, future in futures], timeout=self.send_timeout)
+        sent, failed = [], 0
+        for message, future in futures:
+            permanent = False
+            if not future.done() and future.cancel():
+                ok, error = False, f'Not delivered within {self.send_timeout:g}s'
+            else:
+                try:
+                    ok, error = future.result(timeout=0), 'Telegram delivery failed, see log'
+                except Exception as e:
+                    ok, error, permanent = False, e, isinstance(e, PermanentDeliveryError)
+            if ok:
+                sent.append(message)
+            else:
+                mark_failed(message, error, permanent=permanent)
+                failed += 1
+        mark_sent(sent)
+        return len(sent), failed
+
+
+def purge_sent(older_than_days=None):
+    days = settings.OUTBOX_KEEP_SENT_DAYS if older_than_days is None else older_than_days
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = OutboxMessage.objects.filter(status=OutboxMessage.SENT, sent_at__lt=cutoff).delete()
+    return deleted
+
+
+def stats(window=timedelta(minutes=15), sample=1000):
+    """Queue depth by status, age of the oldest pending message and delivery latency.
+
+    Latency is created -> sent, over up to `sample` messages sent within `window`.
+    """
+    now = timezone.now()
+    counts = dict(OutboxMessage.objects.exclude(status=OutboxMessage.SENT)
+                  .values_list('status').annotate(n=Count('id')).order_by())
+    oldest = OutboxMessage.objects.filter(status=OutboxMessage.PENDING).aggregate(oldest=Min('created_at'))['oldest']
+    latencies = sorted(
+        (sent_at - created_at).total_seconds()
+        for created_at, sent_at in OutboxMessage.objects.filter(sent_at__gte=now - window)
+        .order_by('-sent_at').values_list('created_at', 'sent_at')[:sample]
+    )
+    return {
+        'pending': counts.get(OutboxMessage.PENDING, 0),
+        'sending': counts.get(OutboxMessage.SENDING, 0),
+        'failed': counts.get(OutboxMessage.FAILED, 0),
+        'depth': counts.get(OutboxMessage.PENDING, 0) + counts.get(OutboxMessage.SENDING, 0),
+        'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else 0.0,
+        'sent_recent': len(latencies),
+        'latency_avg': sum(latencies) / len(latencies) if latencies else None,
+        'latency_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+    }
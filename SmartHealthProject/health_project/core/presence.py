@@ -0,0 +1,120 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+
+
+class PresenceTracker:
+    """Which devices are online, kept in memory by the ingest path.
+
+    A device is online while its last upload is less than `timeout` seconds
+    old. Expiries are filed in a timing wheel (one slot per `tick` seconds), so
+    finding the devices that just went offline only looks at the slots that
+    elapsed since the last check, never at every device.
+
+    Listeners get (patient_id, is_online) on every transition. Offline
+    transitions are noticed when someone calls advance() or asks a question.
+
+    Per process, like the live hub: views pass the LatestReading timestamp as
+    `fallback` so a device that uploaded through another worker (or before a
+    restart) is still answered correctly.
+    """
+
+    def __init__(self, timeout, tick=1.0, clock=time.time):
+        self.timeout = timeout
+        self.tick = tick
+        self.clock = clock
+        self._last_seen = {}   # patient_id -> unix time of the last upload seen by this process
+        self._online = set()
+        self._slot_of = {}     # patient_id -> tick number its expiry is filed under
+        self._wheel = [set() for _ in range(math.ceil(timeout / tick) + 2)]
+        self._cursor = int(clock() // tick)   # last tick whose slot was swept
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _emit(self, events):
+        for patient_id, is_online in events:
+            for callback in self._listeners:
+                callback(patient_id, is_online)
+
+    def _file(self, patient_id, expires):
+        t = int(expires // self.tick)
+        old = self._slot_of.get(patient_id)
+        if old == t:
+            return
+        if old is not None:
+            self._wheel[old % len(self._wheel)].discard(patient_id)
+        self._wheel[t % len(self._wheel)].add(patient_id)
+        self._slot_of[patient_id] = t
+
+    def _advance(self, now, events):
+        current = int(now // self.tick)
+        # Sweep every slot at most once, from the last swept tick (it may hold later expiries) to now
+        for t in range(max(self._cursor, current - len(self._wheel) + 1), current + 1):
+            slot = self._wheel[t % len(self._wheel)]
+            expired = [pid for pid in slot if self._last_seen[pid] + self.timeout <= now]
+            for pid in expired:
+                slot.discard(pid)
+                del self._slot_of[pid]
+                self._online.discard(pid)
+                events.append((pid, False))
+        self._cursor = current
+
+    def seen(self, patient_ids):
+        """Records an upload from each device now."""
+        now = self.clock()
+        events = []
+        with self._lock:
+            self._advance(now, events)
+            for pid in patient_ids:
+                self._last_seen[pid] = now
+                self._file(pid, now + self.timeout)
+                if pid not in self._online:
+                    self._online.add(pid)
+                    events.append((pid, True))
+        self._emit(events)
+
+    def advance(self):
+        """Fires offline transitions that are due; cheap enough to call every few seconds."""
+        events = []
+        with self._lock:
+            self._advance(self.clock(), events)
+        self._emit(events)
+
+    def online(self, patient_ids, fallback=None):
+        """The subset of `patient_ids` online now, in one call.
+
+        `fallback`: {patient_id: aware datetime of the newest reading} for
+        devices this process may not have seen upload.
+        """
+        now = self.clock()
+        events = []
+        with self._lock:
+            self._advance(now, events)
+            result = {pid for pid in patient_ids if pid in self._online}
+        self._emit(events)
+        if fallback:
+            cutoff = now - self.timeout
+            result.update(pid for pid in patient_ids
+                          if fallback.get(pid) is not None and fallback[pid].timestamp() > cutoff)
+        return result
+
+    def is_online(self, patient_id, fallback=None):
+        return bool(self.online([patient_id], {patient_id: fallback}))
+
+    def seconds_since(self, patient_id, fallback=None):
+        """Seconds since the device was last heard from (None if never)."""
+        times = [t for t in (self._last_seen.get(patient_id), fallback and fallback.timestamp()) if t is not None]
+        return self.clock() - max(times) if times else None
+
+
+presence = PresenceTracker(timeout=settings.PRESENCE_TIMEOUT_SECONDS)
+
+
+def mark_seen(sender, readings, **kwargs):
+    """readings_ingested receiver: every device in the batch is online as of now."""
+    presence.seen({r.patient_id for r in readings})
@@ -0,0 +1,176 @@
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import outbox
+from .models import OutboxMessage, Prescription
+
+logger = logging.getLogger(__name__)
+
+
+def occurrence(reminder_time, after):
+    """First local datetime at `reminder_time` (whole minute) that is >= `after`."""
+    local = timezone.localtime(after)
+    day = local.date()
+    slot_time = reminder_time.replace(second=0, microsecond=0)
+    for _ in range(2):
+        slot = timezone.make_aware(datetime.combine(day, slot_time))
+        if slot >= after:
+            return slot
+        day += timedelta(days=1)
+    return slot
+
+
+def reminder_message(patient, prescriptions):
+    """One message listing every medicine a patient has due in the same slot."""
+    lines = "\n".join(f"- **{p.medicine_name}** ({p.dose})" for p in prescriptions)
+    return (
+        f"🔔 **Medicine Reminder!** 🔔\n\n"
+        f"Hello {patient.user.first_name},\n\n"
+        f"It's time to take your medicine:\n"
+        f"{lines}"
+    )
+
+
+def dedupe_key(patient_id, slot):
+    # One message per patient per slot, whichever process or restart queues it first
+    return f"reminder:{patient_id}:{timezone.localtime(slot):%Y-%m-%d %H:%M}"
+
+
+class ReminderScheduler:
+    """Keeps every prescription's next reminder in a heap ordered by due time.
+
+    The loop sleeps until the earlier of the next due slot and the next refresh,
+    fires everything due at that instant in one batch, and reschedules each
+    prescription for the following day. Sleep targets are absolute times, so
+    slow sends never push later reminders back or skip a minute.
+
+    Changes are picked up by polling Prescription.updated_at (indexed). Entries
+    whose time changed are left in the heap and skipped when popped; deleted
+    prescriptions drop out when their slot fires.
+    """
+
+    def __init__(self, clock=timezone.now, sleep=time.sleep, refresh_seconds=None, catchup_minutes=None):
+        self.clock = clock
+        self.sleep = sleep
+        self.refresh_interval = timedelta(seconds=refresh_seconds or settings.REMINDER_REFRESH_SECONDS)
+        self.catchup = timedelta(minutes=settings.REMINDER_CATCHUP_MINUTES if catchup_minutes is None else catchup_minutes)
+        self._heap = []        # (due, prescription_id)
+        self._due = {}         # prescription_id -> due currently scheduled
+        self._times = {}       # prescription_id -> reminder_time
+        self._seen_until = None
+        self._looked_at = None  # clock time of the last start/refresh
+        self._next_refresh = None
+
+    def _schedule(self, prescription_id, reminder_time, after):
+        due = occurrence(reminder_time, after)
+        if self._due.get(prescription_id) == due:
+            return
+        self._due[prescription_id] = due
+        self._times[prescription_id] = reminder_time
+        heapq.heappush(self._heap, (due, prescription_id))
+
+    def start(self):
+        """Loads all prescriptions; slots missed within the catch-up window fire right away."""
+        now = self.clock()
+        self._seen_until = Prescription.objects.aggregate(last=Max('updated_at'))['last']
+        for pid, reminder_time in Prescription.objects.values_list('id', 'reminder_time').iterator():
+            self._schedule(pid, reminder_time, now - self.catchup)
+        self._looked_at = now
+        self._next_refresh = now + self.refresh_interval
+        logger.info("Scheduled %d prescriptions", len(self._due))
+
+    def refresh(self):
+        """Reschedules prescriptions created or edited since the last look.
+
+        They are scheduled from the time of that look, so a slot falling between
+        the edit and this refresh still fires (late) instead of moving to tomorrow.
+        """
+        now = self.clock()
+        since = min(now, self._looked_at or now)
+        changed = Prescription.objects.order_by('updated_at').values_list('id', 'reminder_time', 'updated_at')
+        if self._seen_until is not None:
+            # >= so rows saved in the same instant as the last one seen are not missed; rescheduling is idempotent
+            changed = changed.filter(updated_at__gte=self._seen_until)
+        for pid, reminder_time, updated_at in changed:
+            if self._times.get(pid) != reminder_time or pid not in self._due:
+                self._due.pop(pid, None)
+                self._schedule(pid, reminder_time, since)
+            self._seen_until = updated_at
+        self._looked_at = now
+        self._next_refresh = now + self.refresh_interval
+
+    def pop_due(self, now):
+        """Removes and returns (slot, [prescription ids]) for the earliest slot due by `now`, or None."""
+        while self._heap and self._heap[0][0] <= now:
+            slot = self._heap[0][0]
+            ids = []
+            while self._heap and self._heap[0][0] == slot:
+                _, pid = heapq.heappop(self._heap)
+                if self._due.get(pid) == slot:   # otherwise a stale entry for an edited prescription
+                    ids.append(pid)
+            if ids:
+                return slot, ids
+        return None
+
+    def fire(self, slot, ids):
+        """Queues one message per patient for this slot, in one transaction; returns how many were new.
+
+        Prescriptions, patients and users come from a single joined query. The
+        outbox row, keyed by (patient, slot), is the record of what was sent.
+        """
+        prescriptions = list(Prescription.objects.filter(id__in=ids)
+                             .select_related('patient__user').order_by('patient_id', 'medicine_name'))
+        found = {p.id for p in prescriptions}
+        for pid in ids:
+            if pid in found:
+                self._schedule(pid, self._times[pid], slot + timedelta(minutes=1))
+            else:
+                self._due.pop(pid, None)
+                self._times.pop(pid, None)
+
+        messages = []
+        for patient_id, group in groupby(prescriptions, key=attrgetter('patient_id')):
+            group = list(group)
+            patient = group[0].patient
+            if not patient.telegram_chat_id:
+                logger.info("Patient %s has a reminder but no chat_id", patient.user.username)
+                continue
+            messages.append(OutboxMessage(kind='reminder', chat_id=patient.telegram_chat_id,
+                                          text=reminder_message(patient, group), dedupe_key=dedupe_key(patient_id, slot)))
+        with transaction.atomic():
+            return outbox.enqueue_many(messages)
+
+    def run_pending(self):
+        """Refreshes if it is time, then fires every slot due now. Returns reminders queued."""
+        if self._next_refresh is None:
+            self.start()
+        elif self.clock() >= self._next_refresh:
+            self.refresh()
+        queued = 0
+        while (batch := self.pop_due(self.clock())) is not None:
+            queued += self.fire(*batch)
+        return queued
+
+    def next_wakeup(self):
+        wake = self._next_refresh
+        if self._heap and self._heap[0][0] < wake:
+            wake = self._heap[0][0]
+        return wake
+
+    def run_forever(self):
+        while True:
+            queued = self.run_pending()
+            if queued:
+                logger.info("Queued %d reminders", queued)
+            delay = (self.next_wakeup() - self.clock()).total_seconds()
+            if delay > 0:
+                self.sleep(delay)
@@ -0,0 +1,198 @@
+import threading
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from .models import Patient, SensorReading, VitalsRollup
+
+# Finest first
+RESOLUTIONS = (VitalsRollup.MINUTE, VitalsRollup.HOUR, VitalsRollup.DAY)
+TRUNC_KIND = {VitalsRollup.MINUTE: 'minute', VitalsRollup.HOUR: 'hour', VitalsRollup.DAY: 'day'}
+
+
+def bucket_start(ts, resolution):
+    """Start of the bucket holding `ts`, aligned in local time (same as Trunc() in SQL)."""
+    local = timezone.localtime(ts).replace(second=0, microsecond=0)
+    if resolution >= VitalsRollup.HOUR:
+        local = local.replace(minute=0)
+    if resolution >= VitalsRollup.DAY:
+        local = local.replace(hour=0)
+    return local
+
+
+# ==========================================
+# INCREMENTAL MAINTENANCE (ingest path)
+# ==========================================
+
+def _merge(buckets, key, n, hr_min, hr_max, hr_sum, t_min, t_max, t_sum):
+    b = buckets.get(key)
+    if b is None:
+        buckets[key] = [n, hr_min, hr_max, hr_sum, t_min, t_max, t_sum]
+    else:
+        b[0] += n
+        b[1] = min(b[1], hr_min); b[2] = max(b[2], hr_max); b[3] += hr_sum
+        b[4] = min(b[4], t_min); b[5] = max(b[5], t_max); b[6] += t_sum
+
+
+def _accumulate(readings, buckets=None):
+    buckets = {} if buckets is None else buckets
+    for r in readings:
+        hr, temp = r.heart_rate, r.body_temperature
+        for res in RESOLUTIONS:
+            _merge(buckets, (r.patient_id, res, bucket_start(r.timestamp, res)), 1, hr, hr, hr, temp, temp, temp)
+    return buckets
+
+
+def apply_buckets(buckets):
+    """Folds accumulated buckets into VitalsRollup (one upsert per bucket)."""
+    for (patient_id, res, start), (n, hr_min, hr_max, hr_sum, t_min, t_max, t_sum) in buckets.items():
+        bucket = VitalsRollup.objects.filter(patient_id=patient_id, resolution=res, bucket_start=start)
+        merge = dict(
+            count=F('count') + n,
+            hr_min=Least('hr_min', Value(hr_min)), hr_max=Greatest('hr_max', Value(hr_max)),
+            hr_sum=F('hr_sum') + hr_sum,
+            temp_min=Least('temp_min', Value(t_min)), temp_max=Greatest('temp_max', Value(t_max)),
+            temp_sum=F('temp_sum') + t_sum,
+        )
+        if bucket.update(**merge):
+            continue
+        try:
+            with transaction.atomic():
+                VitalsRollup.objects.create(
+                    patient_id=patient_id, resolution=res, bucket_start=start, count=n,
+                    hr_min=hr_min, hr_max=hr_max, hr_sum=hr_sum,
+                    temp_min=t_min, temp_max=t_max, temp_sum=t_sum,
+                )
+        except IntegrityError:
+            # Another writer created the bucket first
+            bucket.update(**merge)
+
+
+def apply_rollups(readings):
+    """Folds new readings into their minute / hour / day buckets (one upsert per bucket)."""
+    apply_buckets(_accumulate(readings))
+
+
+# --- Deferred mode: buckets summed in memory, written by the background worker once per interval ---
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def defer(readings):
+    """Adds committed readings to the in-memory buckets written by flush()."""
+    with _pending_lock:
+        _accumulate(readings, _pending)
+
+
+def flush():
+    """Writes the pending buckets in one transaction. Returns the number of buckets written.
+
+    Buckets of patients deleted meanwhile are dropped; on any other error the
+    buckets are kept for the next flush. A crash loses at most one interval,
+    which `manage.py rebuild_rollups` restores.
+    """
+    with _pending_lock:
+        buckets = dict(_pending)
+        _pending.clear()
+    if not buckets:
+        return 0
+    try:
+        try:
+            with transaction.atomic():
+                apply_buckets(buckets)
+        except IntegrityError:
+            existing = set(Patient.objects.filter(id__in={key[0] for key in buckets}).values_list('id', flat=True))
+            buckets = {key: b for key, b in buckets.items() if key[0] in existing}
+            with transaction.atomic():
+                apply_buckets(buckets)
+    except Exception:
+        with _pending_lock:
+            for key, b in buckets.items():
+                _merge(_pending, key, *b)
+        raise
+    return len(buckets)
+
+
+# ==========================================
+# READ SIDE (views)
+# ==========================================
+
+def pick_resolution(start, end, max_points):
+    """Finest resolution that covers [start, end) in at most `max_points` buckets."""
+    span = (end - start).total_seconds()
+    for res in RESOLUTIONS:
+        if span / res <= max_points:
+            return res
+    return VitalsRollup.DAY
+
+
+def aligned_resolution(start, end):
+    """Coarsest resolution whose buckets fit exactly inside [start, end)."""
+    for res in reversed(RESOLUTIONS):
+        if all(t is None or bucket_start(t, res) == timezone.localtime(t) for t in (start, end)):
+            return res
+    return VitalsRollup.MINUTE
+
+
+def series(patient, start, end, max_points=48):
+    """Buckets for a chart/table over [start, end), oldest first, at most ~max_points rows."""
+    res = pick_resolution(start, end, max_points)
+    return res, (VitalsRollup.objects
+                 .filter(patient=patient, resolution=res,
+                         bucket_start__gte=bucket_start(start, res), bucket_start__lt=end)
+                 .order_by('bucket_start'))
+
+
+def _combine(a, b):
+    """Merges two count / sum / min / max aggregates."""
+    merged = {'count': (a['count'] or 0) + (b['count'] or 0)}
+    for prefix in ('hr', 'temp'):
+        sums = [x[f'{prefix}_sum'] for x in (a, b) if x[f'{prefix}_sum'] is not None]
+        merged[f'{prefix}_sum'] = sum(sums) if sums else None
+        merged[f'{prefix}_min'] = min((x[f'{prefix}_min'] for x in (a, b) if x[f'{prefix}_min'] is not None), default=None)
+        merged[f'{prefix}_max'] = max((x[f'{prefix}_max'] for x in (a, b) if x[f'{prefix}_max'] is not None), default=None)
+    return merged
+
+
+def summarize(start=None, end=None, **filters):
+    """Count / avg / min / max of vitals over [start, end).
+
+    Whole buckets come from the coarsest usable rollup; when a bound is not on a
+    minute (e.g. "the last 24 hours"), the readings in the partial minute at
+    that end are added from SensorReading with one more query.
+    `filters` narrow the patients, e.g. patient=p or patient__doctor=d.
+    """
+    inner_start, inner_end = start, end
+    edges = Q()
+    if start is not None and bucket_start(start, VitalsRollup.MINUTE) != start:
+        inner_start = bucket_start(start, VitalsRollup.MINUTE) + timedelta(minutes=1)
+        edges |= Q(timestamp__gte=start, timestamp__lt=inner_start if end is None else min(inner_start, end))
+    if end is not None and bucket_start(end, VitalsRollup.MINUTE) != end:
+        inner_end = bucket_start(end, VitalsRollup.MINUTE)
+        edges |= Q(timestamp__gte=inner_end if start is None else max(inner_end, start), timestamp__lt=end)
+
+    res = aligned_resolution(inner_start, inner_end)
+    qs = VitalsRollup.objects.filter(resolution=res, **filters)
+    if inner_start is not None:
+        qs = qs.filter(bucket_start__gte=inner_start)
+    if inner_end is not None:
+        qs = qs.filter(bucket_start__lt=inner_end)
+    agg = qs.aggregate(
+        count=Sum('count'), hr_sum=Sum('hr_sum'), temp_sum=Sum('temp_sum'),
+        hr_min=Min('hr_min'), hr_max=Max('hr_max'), temp_min=Min('temp_min'), temp_max=Max('temp_max'),
+    )
+    if edges:
+        agg = _combine(agg, SensorReading.objects.filter(edges, **filters).aggregate(
+            count=Count('id'), hr_sum=Sum('heart_rate'), temp_sum=Sum('body_temperature'),
+            hr_min=Min('heart_rate'), hr_max=Max('heart_rate'),
+            temp_min=Min('body_temperature'), temp_max=Max('body_temperature'),
+        ))
+    count = agg.pop('count') or 0
+    hr_sum, temp_sum = agg.pop('hr_sum'), agg.pop('temp_sum')
+    agg['count'] = count
+    agg['hr_avg'] = hr_sum / count if count else None
+    agg['temp_avg'] = temp_sum / count if count else None
+    return agg
@@ -0,0 +1,118 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import archive_reader, counters
+from .alerts import build_rules, evaluate_readings, rule_engine
+from .ingest import readings_ingested, update_latest
+from .ingest_metrics import ingest_metrics, record_ingest
+from .keycache import api_key_cache
+from .live import bump_live_versions, publish_readings
+from .presence import mark_seen
+from .rollups import apply_rollups
+from .models import ArchivedPartition, Doctor, Patient, Prescription, SensorReading
+
+
+# --- Device auth cache: drop the key when its patient changes or disappears ---
+# Only this process's cache is cleared; other workers notice within API_KEY_CACHE_TTL.
+@receiver(pre_save, sender=Patient)
+def invalidate_replaced_api_key(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or instance.pk is None or (update_fields is not None and 'api_key' not in update_fields):
+        return
+    old_key = Patient.objects.filter(pk=instance.pk).values_list('api_key', flat=True).first()
+    if old_key is not None and old_key != instance.api_key:
+        api_key_cache.invalidate(old_key)
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_patient_api_key(sender, instance, **kwargs):
+    # Also clears a cached "unknown key" answer when a new patient is created
+    api_key_cache.invalidate(instance.api_key)
+    rule_engine.forget_profile(instance.id)
+    ingest_metrics.forget_patient_doctor(instance.id)
+
+
+# --- Alert rules cache the doctor's chat id per patient and keep per-patient state ---
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def refresh_alert_profiles(sender, instance, **kwargs):
+    rule_engine.forget_all_profiles()
+
+
+@receiver(post_delete, sender=Patient)
+def forget_patient_state(sender, instance, **kwargs):
+    rule_engine.forget_patient(instance.id)
+    ingest_metrics.forget_patient(instance.id)
+
+
+@receiver(setting_changed)
+def reload_alert_rules(setting, **kwargs):
+    if setting in ('ALERT_RULES', 'ALERT_COOLDOWN_SECONDS'):
+        rule_engine.set_rules(build_rules(settings.ALERT_RULES), cooldown=settings.ALERT_COOLDOWN_SECONDS)
+
+
+# --- Readings saved one by one (admin, shell) bypass ingest; keep LatestReading and rollups current ---
+@receiver(post_save, sender=SensorReading)
+def update_latest_on_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    update_latest([instance])
+    if created:
+        counters.add('readings', 1)
+    if created and settings.ROLLUPS_ON_INGEST:
+        apply_rollups([instance])
+
+
+# --- Dashboard counters: created / deleted rows (bulk operations are caught by reconcile_counters) ---
+COUNTED_MODELS = {Doctor: 'doctors', Patient: 'patients', Prescription: 'prescriptions'}
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Prescription)
+def count_created(sender, instance, created=False, **kwargs):
+    if created:
+        counters.add(COUNTED_MODELS[sender], 1)
+
+
+@receiver(post_delete, sender=Doctor)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Prescription)
+def count_deleted(sender, instance, **kwargs):
+    counters.add(COUNTED_MODELS[sender], -1)
+
+
+# --- Archived partitions: the files (and their memory-map cache) go with the registry row ---
+@receiver(post_delete, sender=ArchivedPartition)
+def remove_archived_files(sender, instance, **kwargs):
+    # After commit, so a rolled-back delete (e.g. of a patient) keeps its data
+    transaction.on_commit(partial(archive_reader.remove_partition, instance.path))
+
+
+@receiver(pre_delete, sender=Patient)
+def uncount_patient_readings(sender, instance, **kwargs):
+    # SensorReading has no delete receiver (bulk deletes stay fast), so its rows are counted
+    # here, before the cascade; archive rows are summed now too, while they still exist
+    counters.add('readings', -SensorReading.objects.filter(patient=instance).count())
+    archived = instance.archived_partitions.aggregate(n=Sum('row_count'))['n'] or 0
+    counters.add('archived_readings', -archived)
+
+
+# --- Device presence first, so the payloads pushed below already say the device is online ---
+readings_ingested.connect(mark_seen, dispatch_uid='core.presence.mark_seen')
+
+# --- Push new vitals to open live streams ---
+readings_ingested.connect(publish_readings, dispatch_uid='core.live.publish_readings')
+readings_ingested.connect(bump_live_versions, dispatch_uid='core.live.bump_live_versions')
+
+# --- Evaluate alert rules on every accepted reading (on the background worker) ---
+readings_ingested.connect(evaluate_readings, dispatch_uid='core.alerts.evaluate_readings')
+
+# --- Fleet health counters for the admin dashboard ---
+readings_ingested.connect(record_ingest, dispatch_uid='core.ingest_metrics.record_ingest')
@@ -1,3 +1,1355 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib
+import json
+import math
+import random
+import tempfile
+import uuid
+from pathlib import Path
+from datetime import datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.db.models import Avg, Count, Max, Min
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import alerts, anomaly, archive, archive_reader, background, counters, metrics, outbox, rollups
+from .background import BackgroundWorker
+from .buffer import ReadingBuffer, read_journal
+from .fake_telegram import FakeTelegramServer
+from .history import history_page, range_summary
+from .ingest import flush_aggregates, save_readings
+from .ingest_metrics import IngestMetrics
+from .keycache import ApiKeyCache, api_key_cache
+from .live import live_hub
+from .management.commands.benchmark import compare
+from .management.commands.load_test import Device, Stats
+from .models import (ArchivedPartition, Doctor, LatestReading, OutboxMessage, Patient, PatientNote, Prescription,
+                     SensorReading, SystemCounter, VitalAnomaly, VitalsRollup)
+from .notify import TelegramDelivery, TokenBucket
+from .presence import PresenceTracker
+from .reminders import ReminderScheduler
+
+
+# --- Shared fixtures ---
+def make_doctor(username='doc'):
+    user = User.objects.create_user(username, first_name='Greg', last_name='House')
+    return Doctor.objects.create(user=user, telegram_chat_id='1000')
+
+
+def make_patient(doctor, username='pat', readings=0):
+    user = User.objects.create_user(username, first_name='Pat', last_name='Smith')
+    patient = Patient.objects.create(user=user, doctor=doctor)
+    now = timezone.now()
+    save_readings(patient.id, [
+        {'heart_rate': 70 + i % 10, 'body_temperature': 36.5, 'room_temperature': 25.0,
+         'humidity': 60.0, 'timestamp': now - timedelta(seconds=i)}
+        for i in range(readings)
+    ])
+    return patient
+
+
+# ==========================================
+# INGEST API
+# ==========================================
+
+class BatchIngestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor())
+
+    def setUp(self):
+        api_key_cache.clear()
+
+    def post_batch(self, readings, api_key=None):
+        body = {'api_key': str(api_key or self.patient.api_key), 'readings': readings}
+        return self.client.post(reverse('api-submit-batch'), json.dumps(body), content_type='application/json')
+
+    def test_valid_batch(self):
+        now = timezone.now()
+        response = self.post_batch([{'heart_rate': 70 + i, 'body_temperature': 36.6,
+                                     'timestamp': (now - timedelta(seconds=i)).isoformat()} for i in range(3)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(response.json()['accepted'], 3)
+        self.assertEqual(sorted(self.patient.sensorreading_set.values_list('heart_rate', flat=True)), [70, 71, 72])
+
+    def test_malformed_item_is_rejected_alone(self):
+        response = self.post_batch([{'heart_rate': 70, 'body_temperature': 36.6}, {'heart_rate': 'fast'},
+                                    'not a reading'])
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['status'], data['accepted'], data['rejected']), ('partial', 1, 2))
+        self.assertEqual([r['status'] for r in data['results']], ['ok', 'error', 'error'])
+        self.assertEqual(data['results'][1]['message'], 'Invalid heart_rate')
+        self.assertEqual(self.patient.sensorreading_set.count(), 1)
+
+    @override_settings(INGEST_MAX_BATCH_SIZE=2)
+    def test_oversized_batch(self):
+        response = self.post_batch([{'heart_rate': 70, 'body_temperature': 36.6}] * 3)
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(self.patient.sensorreading_set.exists())
+
+    def test_unknown_key(self):
+        response = self.post_batch([{'heart_rate': 70, 'body_temperature': 36.6}],
+                                   api_key='00000000-0000-0000-0000-000000000000')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(SensorReading.objects.exists())
+
+
+class ReadingBufferTests(SimpleTestCase):
+    def setUp(self):
+        self.saved = []
+        self.bad_patients = set()
+        self.database_down = False
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.journal_dir = Path(tmp.name)
+
+    def save(self, rows):
+        if self.database_down:
+            raise OperationalError("database is locked")
+        if any(patient_id in self.bad_patients for patient_id, _ in rows):
+            raise IntegrityError("FOREIGN KEY constraint failed")
+        self.saved.extend(rows)
+
+    def make_buffer(self, max_size=100):
+        buffer = ReadingBuffer(self.save, max_size=max_size, flush_size=1000, flush_interval=60,
+                               journal_dir=self.journal_dir, fsync=False)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def reading(self, hr):
+        return {'heart_rate': hr, 'body_temperature': 36.6, 'timestamp': timezone.now()}
+
+    def test_journal_is_written_before_ack_and_removed_after_commit(self):
+        buffer = self.make_buffer()
+        self.assertTrue(buffer.offer(1, [self.reading(70), self.reading(71)]))
+        [segment] = self.journal_dir.glob('*.jsonl')
+        with open(segment, 'a') as f:
+            f.write('{"patient_id": 1, "heart')   # torn write from a crash
+        self.assertEqual([(pid, f['heart_rate']) for pid, f in read_journal(segment)], [(1, 70), (1, 71)])
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(len(self.saved), 2)
+        self.assertEqual(list(self.journal_dir.glob('*.jsonl')), [])
+
+    def test_rows_refused_by_the_database_are_set_aside(self):
+        buffer = self.make_buffer()
+        self.bad_patients = {2}
+        buffer.offer(1, [self.reading(70)])
+        buffer.offer(2, [self.reading(80)])      # patient deleted meanwhile
+        buffer.offer(3, [self.reading(90)])
+        with self.assertLogs('core.buffer', 'ERROR'):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(sorted(pid for pid, _ in self.saved), [1, 3])
+        self.assertEqual(len(buffer), 0)
+        [rejected] = (self.journal_dir / 'rejected').glob('*.jsonl')
+        self.assertEqual([pid for pid, _ in read_journal(rejected)], [2])
+
+        buffer.offer(1, [self.reading(71)])      # the buffer is not blocked
+        self.assertEqual(buffer.flush(), 1)
+
+    def test_requeue_respects_max_size(self):
+        buffer = self.make_buffer(max_size=3)
+        buffer.offer(1, [self.reading(70), self.reading(71), self.reading(72)])
+        self.database_down = True
+        with self.assertLogs('core.buffer', 'ERROR'):
+            buffer.flush()
+        self.assertEqual(len(buffer), 3)          # requeued, journal segment kept
+        self.assertEqual(len(list(self.journal_dir.glob('*.jsonl'))), 1)
+        self.assertFalse(buffer.offer(1, [self.reading(73)]))
+
+        self.database_down = False
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual([f['heart_rate'] for _, f in self.saved], [70, 71, 72])
+        self.assertEqual(list(self.journal_dir.glob('*.jsonl')), [])
+
+
+class BufferFullTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor())
+
+    @override_settings(INGEST_BUFFER_FLUSH_INTERVAL=2.0)
+    def test_full_buffer_answers_503_with_retry_after(self):
+        full = ReadingBuffer(save=lambda rows: None, max_size=0, flush_size=1, flush_interval=2.0)
+        body = json.dumps({'api_key': str(self.patient.api_key), 'heart_rate': 70, 'body_temperature': 36.6})
+        with mock.patch('core.ingest.get_buffer', return_value=full):
+            response = self.client.post(reverse('api-submit-data'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertFalse(SensorReading.objects.exists())
+
+
+class ApiKeyCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor())
+
+    def setUp(self):
+        api_key_cache.clear()
+
+    def test_ttl_and_negative_caching(self):
+        cache = ApiKeyCache(max_size=10, ttl=60, negative_ttl=5)
+        unknown = '00000000-0000-0000-0000-000000000000'
+        with mock.patch('core.keycache.time.monotonic', return_value=1000):
+            with self.assertNumQueries(2):
+                self.assertEqual(cache.resolve(self.patient.api_key), self.patient.id)
+                self.assertIsNone(cache.resolve(unknown))
+            with self.assertNumQueries(0):
+                self.assertEqual(cache.resolve(str(self.patient.api_key).upper()), self.patient.id)
+                self.assertIsNone(cache.resolve(unknown))
+                self.assertIsNone(cache.resolve('not-a-uuid'))
+        with mock.patch('core.keycache.time.monotonic', return_value=1010):
+            with self.assertNumQueries(1):    # only the unknown key expired
+                cache.resolve(self.patient.api_key)
+                cache.resolve(unknown)
+        with mock.patch('core.keycache.time.monotonic', return_value=1061):
+            with self.assertNumQueries(1):
+                cache.resolve(self.patient.api_key)
+        self.assertEqual(cache.stats()['negative_hits'], 1)
+
+    def test_invalidated_on_key_change_and_delete(self):
+        old_key = self.patient.api_key
+        api_key_cache.resolve(old_key)
+        self.patient.api_key = uuid.uuid4()
+        self.patient.save()
+        self.assertIsNone(api_key_cache.resolve(old_key))
+        self.assertEqual(api_key_cache.resolve(self.patient.api_key), self.patient.id)
+
+        new_key = self.patient.api_key
+        self.patient.delete()
+        with self.assertNumQueries(1):
+            self.assertIsNone(api_key_cache.resolve(new_key))
+
+    def test_patient_deleted_by_another_worker_answers_403(self):
+        api_key_cache.resolve(self.patient.api_key)   # still cached here after the delete elsewhere
+        body = json.dumps({'api_key': str(self.patient.api_key), 'heart_rate': 70, 'body_temperature': 36.6})
+        with mock.patch('core.ingest.save_readings', side_effect=IntegrityError("FOREIGN KEY constraint failed")):
+            response = self.client.post(reverse('api-submit-data'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        with self.assertNumQueries(1):
+            api_key_cache.resolve(self.patient.api_key)   # the stale entry was dropped
+
+
+class LatestReadingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor())
+
+    def reading(self, hr, ts):
+        return {'heart_rate': hr, 'body_temperature': 36.6, 'timestamp': ts}
+
+    def test_older_reading_does_not_overwrite_newer(self):
+        now = timezone.now()
+        save_readings(self.patient.id, [self.reading(90, now)])
+        save_readings(self.patient.id, [self.reading(60, now - timedelta(minutes=5)),   # replayed backlog
+                                        self.reading(61, now - timedelta(minutes=4))])
+        latest = LatestReading.objects.get(patient=self.patient)
+        self.assertEqual((latest.heart_rate, latest.timestamp), (90, now))
+
+        save_readings(self.patient.id, [self.reading(95, now + timedelta(seconds=1))])
+        self.assertEqual(LatestReading.objects.get(patient=self.patient).heart_rate, 95)
+
+    def test_migration_backfills_missing_rows(self):
+        now = timezone.now()
+        save_readings(self.patient.id, [self.reading(70, now - timedelta(seconds=1)), self.reading(80, now)])
+        newest = SensorReading.objects.get(heart_rate=80)
+        LatestReading.objects.all().delete()   # as on a database from before the table existed
+
+        backfill = importlib.import_module('core.migrations.0020_backfill_latestreading').backfill_latest
+        backfill(django_apps, None)
+        latest = LatestReading.objects.get(patient=self.patient)
+        self.assertEqual((latest.reading_id, latest.heart_rate, latest.timestamp), (newest.id, 80, now))
+
+
+# ==========================================
+# QUERY PLANS
+# ==========================================
+
+class QueryPlanTests(TestCase):
+    """Runs EXPLAIN QUERY PLAN on every vitals query a view issues.
+
+    Fails if SQLite falls back to a full table scan or a temp B-tree sort on the
+    readings tables, i.e. if a query stops matching the indexes on SensorReading.
+    """
+
+    WATCHED_TABLES = ('core_sensorreading', 'core_latestreading', 'core_vitalsrollup', 'core_vitalanomaly',
+                      'core_archivedpartition')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_doctor()
+        cls.patient = make_patient(cls.doctor, readings=50)
+        make_patient(cls.doctor, username='pat2', readings=50)
+        cls.admin = User.objects.create_superuser('admin')
+
+    def setUp(self):
+        api_key_cache.clear()
+
+    def assertPlansUseIndexes(self, user, url, method='get'):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 400)
+
+        checked = 0
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT') or not any(t in sql for t in self.WATCHED_TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                self.assertNotIn('TEMP B-TREE', step, f"{url}: sort without index\n{sql}\n{plan}")
+                for table in self.WATCHED_TABLES:
+                    self.assertFalse(step.startswith(f'SCAN {table}') and 'INDEX' not in step,
+                                     f"{url}: full scan of {table}\n{sql}\n{plan}")
+            checked += 1
+        return checked
+
+    def test_admin_dashboard(self):
+        self.assertTrue(self.assertPlansUseIndexes(self.admin, reverse('admin-dashboard')))
+
+    def test_doctor_dashboard(self):
+        self.assertTrue(self.assertPlansUseIndexes(self.doctor.user, reverse('doctor-dashboard')))
+
+    def test_patient_detail(self):
+        url = reverse('patient-detail', args=[self.patient.id])
+        self.assertTrue(self.assertPlansUseIndexes(self.doctor.user, url))
+
+    def test_patient_dashboard(self):
+        self.assertTrue(self.assertPlansUseIndexes(self.patient.user, reverse('patient-dashboard')))
+
+    def test_patient_live_data(self):
+        self.assertTrue(self.assertPlansUseIndexes(self.patient.user, reverse('patient-live-data')))
+
+    def test_patient_history(self):
+        self.assertTrue(self.assertPlansUseIndexes(self.patient.user, reverse('patient-history')))
+
+    def test_history_older_page_in_range(self):
+        self.client.force_login(self.patient.user)
+        cursor = self.client.get(reverse('history-api'), {'limit': 10}).json()['next_cursor']
+        url = reverse('history-api') + f'?cursor={cursor}&from=2020-01-01&to=2100-01-01'
+        self.assertTrue(self.assertPlansUseIndexes(self.patient.user, url))
+
+    def test_send_sos(self):
+        self.assertTrue(self.assertPlansUseIndexes(self.patient.user, reverse('send-sos')))
+        self.assertTrue(OutboxMessage.objects.filter(kind='sos', chat_id='1000').exists())
+
+
+# ==========================================
+# QUERY COUNTS
+# ==========================================
+
+class DoctorDashboardQueryCountTests(TestCase):
+    """The doctor dashboard must cost the same number of queries for 1 or 20 patients."""
+
+    def setUp(self):
+        api_key_cache.clear()
+        self.doctor = make_doctor()
+        self.client.force_login(self.doctor.user)
+
+    def add_patients(self, count):
+        start = Patient.objects.count()
+        for i in range(start, start + count):
+            patient = make_patient(self.doctor, username=f'pat{i}', readings=3)
+            PatientNote.objects.create(patient=patient, doctor=self.doctor, text='Check BP')
+            PatientNote.objects.create(patient=patient, doctor=self.doctor, text='Follow up')
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('doctor-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_flat(self):
+        self.add_patients(1)
+        baseline = self.count_queries()
+        self.add_patients(19)
+        self.assertEqual(self.count_queries(), baseline)
+
+
+# ==========================================
+# LIVE UPDATES
+# ==========================================
+
+class LiveUpdateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor(), readings=1)
+
+    def ingest(self, heart_rate, timestamp):
+        with self.captureOnCommitCallbacks(execute=True):
+            save_readings(self.patient.id, [{'heart_rate': heart_rate, 'body_temperature': 36.6,
+                                             'timestamp': timestamp}])
+
+    async def test_pushes_newer_vitals_only(self):
+        await self.async_client.aforce_login(self.patient.user)
+        response = await self.async_client.get(reverse('live-stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 5000\n\n")
+        self.assertIn(b'"heart_rate": 70', await anext(stream))   # current vitals on connect
+
+        now = timezone.now()
+        await sync_to_async(self.ingest)(55, now - timedelta(hours=1))   # replayed backlog: not pushed
+        live_hub.publish({'patient_id': self.patient.id, 'is_active': True}, event='status')
+        self.assertTrue((await asyncio.wait_for(anext(stream), 2)).startswith(b'event: status'))
+
+        await sync_to_async(self.ingest)(99, now + timedelta(seconds=1))
+        chunk = await asyncio.wait_for(anext(stream), 2)
+        self.assertTrue(chunk.startswith(b'event: vitals') and b'"heart_rate": 99' in chunk, chunk)
+        await stream.aclose()
+
+    def test_live_data_etag(self):
+        cache.clear()
+        self.client.force_login(self.patient.user)
+        url = reverse('patient-live-data')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        now = timezone.now()
+        self.ingest(55, now - timedelta(hours=1))   # replayed backlog: the version doesn't move back
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.ingest(99, now + timedelta(seconds=1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['heart_rate'], 99)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_idle_patient_poll_needs_no_query(self):
+        cache.clear()
+        self.client.force_login(self.patient.user)
+        url = reverse('patient-live-data')
+        etag = self.client.get(url)['ETag']
+        an_hour_later = timezone.now().timestamp() + 3600
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=an_hour_later), \
+                CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertFalse([q for q in ctx.captured_queries if 'core_latestreading' in q['sql']])
+
+
+# ==========================================
+# ROLLUPS AND DEFERRED WORK
+# ==========================================
+
+class BackgroundWorkerTests(SimpleTestCase):
+    def test_inline_until_started_then_queued(self):
+        done = []
+        worker = BackgroundWorker(interval=60, max_pending=2)
+        worker.every_interval(lambda: done.append('tick'))
+        worker.submit(done.append, 1)
+        self.assertEqual(done, [1])            # not started: runs in the caller
+
+        worker.hold()
+        for job in (2, 3, 4):
+            worker.submit(done.append, job)
+        self.assertEqual(done, [1, 4])         # queue full: the third job ran in the caller
+        worker.run_pending()
+        self.assertEqual(done, [1, 4, 2, 3, 'tick'])
+
+
+class DeferredAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor())
+
+    def setUp(self):
+        self.worker = BackgroundWorker(interval=60, max_pending=100)
+        self.worker.every_interval(flush_aggregates)
+        self.worker.hold()
+        patcher = mock.patch.object(background, 'worker', self.worker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_buckets_written_once_per_interval(self):
+        minute = timezone.now().replace(second=30, microsecond=0) - timedelta(minutes=1)
+        for i in range(3):
+            with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+                save_readings(self.patient.id, [{'heart_rate': 60 + 10 * i, 'body_temperature': 36.5,
+                                                 'timestamp': minute + timedelta(seconds=i)}])
+            self.assertFalse([q for q in ctx.captured_queries if 'core_vitalsrollup' in q['sql']])
+        self.assertFalse(VitalsRollup.objects.exists())
+
+        self.worker.run_pending()
+        self.assertEqual(VitalsRollup.objects.count(), 3)    # minute, hour and day bucket
+        bucket = VitalsRollup.objects.get(resolution=VitalsRollup.MINUTE)
+        self.assertEqual((bucket.count, bucket.hr_min, bucket.hr_max, bucket.hr_sum), (3, 60, 80, 210))
+        with self.assertNumQueries(0):
+            self.worker.run_pending()                         # nothing pending, no query
+
+    def test_readings_counter_written_once_per_interval(self):
+        before = counters.totals()['readings']
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+                save_readings(self.patient.id, [{'heart_rate': 70, 'body_temperature': 36.5,
+                                                 'timestamp': timezone.now()}] * 2)
+            self.assertFalse([q for q in ctx.captured_queries if 'core_systemcounter' in q['sql']])
+        self.assertEqual(counters.totals()['readings'], before + 6)   # this process sees its own deltas
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.worker.run_pending()
+        self.assertEqual(len([q for q in ctx.captured_queries if 'core_systemcounter' in q['sql']]), 1)
+        self.assertEqual(SystemCounter.objects.get(name='readings').value, before + 6)
+        self.assertEqual({drift for _, drift in counters.reconcile().values()}, {0})
+
+
+class RollupTests(TestCase):
+    """Rollup reads against the same aggregates computed directly over SensorReading."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor())
+        cls.end = timezone.make_aware(datetime(2026, 3, 10, 12, 0))
+        # Every 7m13s over three days, so buckets are partly filled and no bound is a reading time
+        save_readings(cls.patient.id, [
+            {'heart_rate': 60 + i * 7 % 50, 'body_temperature': 36 + i % 13 / 10,
+             'timestamp': cls.end - timedelta(seconds=433 * i)}
+            for i in range(600)
+        ])
+
+    def at(self, day, hour, minute=0, second=0):
+        return timezone.make_aware(datetime(2026, 3, day, hour, minute, second))
+
+    def direct(self, start=None, end=None):
+        qs = SensorReading.objects.filter(patient=self.patient)
+        if start is not None:
+            qs = qs.filter(timestamp__gte=start)
+        if end is not None:
+            qs = qs.filter(timestamp__lt=end)
+        return qs.aggregate(count=Count('id'), hr_avg=Avg('heart_rate'), temp_avg=Avg('body_temperature'),
+                            hr_min=Min('heart_rate'), hr_max=Max('heart_rate'))
+
+    def snapshot(self):
+        return sorted((r.resolution, r.bucket_start, r.count, r.hr_min, r.hr_max, round(r.hr_sum, 6),
+                       r.temp_min, r.temp_max, round(r.temp_sum, 6)) for r in VitalsRollup.objects.all())
+
+    def test_resolution_choice(self):
+        start = self.at(9, 10)
+        self.assertEqual(rollups.pick_resolution(start, start + timedelta(hours=1), 61), VitalsRollup.MINUTE)
+        self.assertEqual(rollups.pick_resolution(start, start + timedelta(days=1), 31), VitalsRollup.HOUR)
+        self.assertEqual(rollups.pick_resolution(start, start + timedelta(days=30), 31), VitalsRollup.DAY)
+        self.assertEqual(rollups.aligned_resolution(self.at(8, 0), self.at(10, 0)), VitalsRollup.DAY)
+        self.assertEqual(rollups.aligned_resolution(self.at(8, 10), self.at(10, 0)), VitalsRollup.HOUR)
+        self.assertEqual(rollups.aligned_resolution(self.at(8, 10, 17), None), VitalsRollup.MINUTE)
+        self.assertEqual(rollups.aligned_resolution(None, None), VitalsRollup.DAY)
+
+    def test_summarize_matches_direct_aggregate(self):
+        # Readings at 23:47:47 on the 8th, 23:58:20 on the 9th and 05:59:10 on the 10th
+        first, last, lone = (self.end - timedelta(seconds=433 * i) for i in (301, 100, 50))
+        second = timedelta(seconds=1)
+        ranges = [
+            (None, None),
+            (self.at(8, 0), self.at(10, 0)),                           # whole days
+            (self.at(8, 10), self.at(9, 3)),                           # whole hours
+            (self.at(8, 10, 17), self.at(9, 3, 41)),                   # whole minutes
+            (first - second, last + second),                           # off the minute, readings in both edges
+            (self.end - timedelta(hours=24, seconds=7), None),         # "last 24 hours"
+            (lone - second, lone + second),                            # inside a single minute
+        ]
+        for start, end in ranges:
+            with self.subTest(start=start, end=end):
+                expected = self.direct(start, end)
+                summary = rollups.summarize(start, end, patient=self.patient)
+                self.assertEqual(summary['count'], expected['count'])
+                for key in ('hr_avg', 'temp_avg', 'hr_min', 'hr_max'):
+                    if expected[key] is None:
+                        self.assertIsNone(summary[key])
+                    else:
+                        self.assertAlmostEqual(summary[key], expected[key], places=9, msg=key)
+        by_doctor = rollups.summarize(patient__doctor=self.patient.doctor)
+        self.assertAlmostEqual(by_doctor['hr_avg'], self.direct()['hr_avg'], places=9)
+
+    def test_series_covers_range_at_picked_resolution(self):
+        start = self.end - timedelta(hours=24)
+        res, buckets = rollups.series(self.patient, start, self.end, max_points=31)
+        buckets = list(buckets)
+        self.assertEqual(res, VitalsRollup.HOUR)
+        self.assertEqual(buckets[0].bucket_start, rollups.bucket_start(start, res))
+        self.assertEqual(sum(b.count for b in buckets), self.direct(buckets[0].bucket_start, self.end)['count'])
+        for b in buckets:
+            direct = self.direct(b.bucket_start, b.bucket_start + timedelta(hours=1))
+            self.assertAlmostEqual(b.hr_avg, direct['hr_avg'], places=9)
+
+    def test_rebuild_command_and_migration_match_incremental(self):
+        incremental = self.snapshot()
+        VitalsRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=mock.MagicMock())
+        self.assertEqual(self.snapshot(), incremental)
+
+        VitalsRollup.objects.all().delete()   # as on a database from before rollups were kept on ingest
+        backfill = importlib.import_module('core.migrations.0021_backfill_vitalsrollup').backfill_rollups
+        backfill(django_apps, None)
+        self.assertEqual(self.snapshot(), incremental)
+        backfill(django_apps, None)            # patients that already have buckets are left alone
+        self.assertEqual(self.snapshot(), incremental)
+
+
+# ==========================================
+# HISTORY
+# ==========================================
+
+class HistoryCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor(), readings=5)
+
+    def test_malformed_or_naive_cursor_is_400(self):
+        self.client.force_login(self.patient.user)
+        url = reverse('history-api')
+        cursor = self.client.get(url, {'limit': 2}).json()['next_cursor']
+        self.assertEqual(len(self.client.get(url, {'limit': 2, 'cursor': cursor}).json()['readings']), 2)
+
+        naive = base64.urlsafe_b64encode(b"2026-01-01T10:00:00|5").decode()
+        for bad in (naive, 'not-base64!', base64.urlsafe_b64encode(b"yesterday|5").decode()):
+            response = self.client.get(url, {'cursor': bad})
+            self.assertEqual(response.status_code, 400, bad)
+            self.assertEqual(response.json()['message'], 'Invalid cursor')
+
+
+# ==========================================
+# ANOMALY DETECTION
+# ==========================================
+
+def noisy_series(n=1500, seed=7):
+    """Heart rate with a short spike, a baseline shift and a short dip."""
+    rng = random.Random(seed)
+    x = [70 + rng.gauss(0, 3) for _ in range(n)]
+    for i in range(300, 306): x[i] += 40
+    for i in range(800, n): x[i] += 15
+    for i in range(1200, 1204): x[i] -= 50
+    return x
+
+
+class AnomalyReferenceTests(SimpleTestCase):
+    """The NumPy detectors must match the pure-Python reference, however the series is chunked."""
+
+    def test_primitives_match_reference(self):
+        x = noisy_series()
+        arr = np.array(x)
+        np.testing.assert_allclose(anomaly.rolling_zscore(arr, 60, 2.0), anomaly.rolling_zscore_py(x, 60, 2.0))
+        np.testing.assert_allclose(anomaly.change_scores(arr, 60, 2.0), anomaly.change_scores_py(x, 60, 2.0))
+        for alpha, initial in ((0.05, None), (0.5, None), (0.3, 50.0)):
+            np.testing.assert_allclose(anomaly.ewma(arr, alpha, initial), anomaly.ewma_py(x, alpha, initial))
+
+    def test_chunked_detector_matches_reference(self):
+        x = noisy_series()
+        ts = [1.7e9 + i for i in range(len(x))]
+        expected = anomaly.detect_py(ts, x, min_std=2.0)
+        self.assertEqual(sorted(a['kind'] for a in expected), ['shift', 'spike', 'spike'])
+
+        for chunk in (len(x), 500, 97):
+            detector = anomaly.SeriesDetector(min_std=2.0)
+            for i in range(0, len(x), chunk):
+                detector.feed(ts[i:i + chunk], x[i:i + chunk])
+            found = detector.finish()
+            self.assertEqual(len(found), len(expected), chunk)
+            for got, want in zip(found, expected):
+                self.assertEqual(got['kind'], want['kind'])
+                for key in ('start', 'end', 'score', 'peak_value', 'baseline'):
+                    self.assertTrue(math.isclose(got[key], want[key], rel_tol=1e-9), (chunk, key))
+
+
+class DetectAnomaliesCommandTests(TestCase):
+    def test_flags_anomalies_and_replaces_previous_run(self):
+        patient = make_patient(make_doctor())
+        start = timezone.now() - timedelta(hours=1)
+        save_readings(patient.id, [
+            {'heart_rate': hr, 'body_temperature': 36.6, 'timestamp': start + timedelta(seconds=i)}
+            for i, hr in enumerate(noisy_series())
+        ])
+
+        call_command('detect_anomalies', chunk_size=400, stdout=mock.MagicMock())
+        call_command('detect_anomalies', days=1, stdout=mock.MagicMock())
+        flagged = VitalAnomaly.objects.filter(patient=patient, metric='heart_rate')
+        self.assertEqual(sorted(flagged.values_list('kind', flat=True)), ['shift', 'spike', 'spike'])
+        self.assertFalse(VitalAnomaly.objects.filter(metric='body_temperature').exists())
+
+
+# ==========================================
+# ALERT RULES
+# ==========================================
+
+class AlertRuleTests(SimpleTestCase):
+    def test_threshold_immediate_and_sustained(self):
+        instant = alerts.ThresholdRule('hot', 'body_temperature', above=38.5)
+        self.assertEqual(instant.check(None, 0, 37.0), (None, None))
+        self.assertEqual(instant.check(None, 0, 39.0), ((0, 0), 'body temperature 39 above 38.5'))
+
+        sustained = alerts.ThresholdRule('tachy', 'heart_rate', above=120, for_seconds=30)
+        state, message = sustained.check(None, 100, 130)
+        self.assertEqual((state, message), ((100, 100), None))
+        state, message = sustained.check(state, 120, 135)
+        self.assertIsNone(message)
+        self.assertEqual(sustained.check(state, 130, 140), ((100, 130), 'heart rate 140 above 120 for 30s'))
+        self.assertEqual(sustained.check(state, 131, 90), (None, None))     # back in range: timer restarts
+
+    def test_sustained_threshold_restarts_after_gap(self):
+        rule = alerts.ThresholdRule('tachy', 'heart_rate', above=120, for_seconds=30, max_gap=60)
+        state, _ = rule.check(None, 0, 130)
+        state, _ = rule.check(state, 20, 130)
+        state, message = rule.check(state, 20 + 4 * 3600, 130)               # back after four hours offline
+        self.assertEqual((state, message), ((14420, 14420), None))
+        state, message = rule.check(state, 14440, 130)
+        self.assertIsNone(message)
+        self.assertEqual(rule.check(state, 14450, 131)[1], 'heart rate 131 above 120 for 30s')
+
+    def test_rate_of_change_within_window(self):
+        rule = alerts.RateOfChangeRule('jump', 'heart_rate', max_change=40, window_seconds=10)
+        window, message = rule.check(None, 0, 70)
+        self.assertIsNone(message)
+        window, message = rule.check(window, 5, 100)
+        self.assertIsNone(message)
+        window, message = rule.check(window, 8, 115)
+        self.assertEqual(message, 'heart rate changed 70 -> 115 in 8s')
+        window, message = rule.check(window, 30, 160)                        # older samples left the window
+        self.assertIsNone(message)
+        self.assertEqual(list(window), [(30, 160)])
+
+    def test_rule_must_implement_check(self):
+        with self.assertRaises(TypeError):
+            alerts.Rule('base', 'heart_rate')
+
+
+class AlertEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient(make_doctor())
+
+    def setUp(self):
+        self.now = 1000.0
+        self.engine = alerts.RuleEngine(alerts.build_rules([
+            {'type': 'threshold', 'name': 'tachycardia', 'metric': 'heart_rate', 'above': 120},
+            {'type': 'rate', 'name': 'jump', 'metric': 'heart_rate', 'max_change': 40, 'window_seconds': 10},
+        ]), cooldown=300, state_ttl=600, clock=lambda: self.now)
+
+    def reading(self, seconds, heart_rate):
+        ts = timezone.make_aware(datetime(2026, 1, 1, 12)) + timedelta(seconds=seconds)
+        return SensorReading(patient_id=self.patient.id, heart_rate=heart_rate, timestamp=ts)
+
+    def fired(self, *readings):
+        return [rule.name for _, rule, _ in self.engine.evaluate(readings)]
+
+    def test_cooldown_per_rule(self):
+        self.assertEqual(self.fired(self.reading(0, 70), self.reading(5, 130)), ['tachycardia', 'jump'])
+        self.now += 60
+        self.assertEqual(self.fired(self.reading(60, 135)), [])              # still cooling down
+        self.now += 300
+        self.assertEqual(self.fired(self.reading(360, 135)), ['tachycardia'])
+
+    def test_state_pruned_on_delete_idle_and_rule_change(self):
+        self.fired(self.reading(0, 70), self.reading(5, 130))
+        self.assertEqual(set(self.engine._state[self.patient.id]), {'jump', 'tachycardia'})
+        self.engine.set_rules(self.engine.rules[:1])
+        self.assertEqual(self.engine._state, {})
+        self.assertEqual(set(self.engine._last_fired[self.patient.id]), {'tachycardia'})
+
+        self.fired(self.reading(10, 70))
+        self.assertEqual(self.engine._state[self.patient.id], {})            # nothing to remember in range
+        self.now += 601 + self.engine.PRUNE_INTERVAL
+        self.engine.evaluate([])
+        self.assertEqual((self.engine._state, self.engine._last_fired, self.engine._seen), ({}, {}, {}))
+
+        self.fired(self.reading(700, 130))
+        self.engine.forget_patient(self.patient.id)
+        self.assertEqual((self.engine._state, self.engine._last_fired, self.engine._profiles), ({}, {}, {}))
+
+    def test_evaluated_on_background_worker(self):
+        worker = BackgroundWorker(interval=60, max_pending=100)
+        worker.every_interval(flush_aggregates)
+        worker.hold()
+        with mock.patch.object(background, 'worker', worker), mock.patch.object(alerts, 'rule_engine', self.engine):
+            with self.captureOnCommitCallbacks(execute=True):
+                save_readings(self.patient.id, [{'heart_rate': 150, 'body_temperature': 36.5,
+                                                 'timestamp': timezone.now()}])
+            self.assertFalse(OutboxMessage.objects.exists())
+            worker.run_pending()
+        self.assertIn('TACHYCARDIA', OutboxMessage.objects.get().text)
+
+
+# ==========================================
+# TELEGRAM DELIVERY
+# ==========================================
+
+class TelegramDeliveryTests(SimpleTestCase):
+    """Runs the delivery worker against the local fake Bot API."""
+
+    def setUp(self):
+        self.server = FakeTelegramServer().start()
+        self.delivery = TelegramDelivery('123:abc', self.server.base_url, global_rate=100, per_chat_rate=20,
+                                         max_attempts=3, backoff=0.01)
+
+    def tearDown(self):
+        self.delivery.stop()
+        self.server.stop()
+
+    def test_delivers_in_order_within_per_chat_rate(self):
+        # Spacing is checked where the limiter hands out tokens; arrival times at the server carry loop jitter
+        acquired = {}
+        acquire = TokenBucket.acquire
+
+        async def recording_acquire(bucket):
+            await acquire(bucket)
+            acquired.setdefault(bucket, []).append(bucket._updated)
+
+        with mock.patch.object(TokenBucket, 'acquire', recording_acquire):
+            futures = [self.delivery.send(chat, f'm{i}') for i in range(5) for chat in ('1', '2')]
+            self.assertTrue(all(f.result(5) for f in futures))
+        for chat in ('1', '2'):
+            sent = [m for m in self.server.messages if m['chat_id'] == chat]
+            self.assertEqual([m['text'] for m in sent], [f'm{i}' for i in range(5)])
+            times = acquired[self.delivery._chats[chat][1]]
+            gaps = [b - a for a, b in zip(times, times[1:])]
+            self.assertEqual(len(times), 5)
+            self.assertGreaterEqual(min(gaps), 1 / 20 - 1e-6)
+
+    def test_retries_flood_control_and_server_errors(self):
+        self.server.fail_next(retry_after=1)
+        self.server.fail_next(status=502)
+        self.assertTrue(self.delivery.send('1', 'hi').result(5))
+        self.assertEqual([m['text'] for m in self.server.messages], ['hi'])
+
+    def test_gives_up(self):
+        self.server.fail_next(status=400)
+        with self.assertRaises(outbox.PermanentDeliveryError):
+            self.delivery.send('1', 'bad markup').result(5)
+        self.server.fail_next(3, status=500)
+        self.assertFalse(self.delivery.send('1', 'server down').result(5))
+        self.assertEqual(self.server.messages, [])
+
+
+# ==========================================
+# NOTIFICATION OUTBOX
+# ==========================================
+
+class OutboxTests(TestCase):
+    """Dispatcher against the fake Bot API: claims, retries, dedupe and stats."""
+
+    def setUp(self):
+        self.server = FakeTelegramServer().start()
+        self.delivery = TelegramDelivery('123:abc', self.server.base_url, global_rate=100, per_chat_rate=100,
+                                         max_attempts=1)
+        self.dispatcher = outbox.Dispatcher(self.delivery, batch_size=10, lease_seconds=30)
+
+    def tearDown(self):
+        self.delivery.stop()
+        self.server.stop()
+
+    def test_dedupe_key(self):
+        self.assertTrue(outbox.enqueue('reminder', '5', 'Take pills', dedupe_key='reminder:1:08:00'))
+        self.assertFalse(outbox.enqueue('reminder', '5', 'Take pills', dedupe_key='reminder:1:08:00'))
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_dispatch_retry_and_stats(self):
+        for i in range(3):
+            outbox.enqueue('alert', str(10 + i), f'alert {i}')
+        self.server.fail_next(status=500)
+
+        with self.settings(OUTBOX_RETRY_BACKOFF=0):
+            self.assertEqual(self.dispatcher.run_once(), (2, 1))
+            self.assertEqual(self.dispatcher.run_once(), (1, 0))
+        self.assertEqual(self.dispatcher.run_once(), (0, 0))
+        self.assertEqual(sorted(m['text'] for m in self.server.messages), ['alert 0', 'alert 1', 'alert 2'])
+        self.assertEqual(OutboxMessage.objects.filter(status=OutboxMessage.SENT).count(), 3)
+
+        s = outbox.stats()
+        self.assertEqual((s['depth'], s['failed'], s['sent_recent']), (0, 0, 3))
+        self.assertIsNotNone(s['latency_p95'])
+
+    def test_rejected_message_fails_without_retry(self):
+        outbox.enqueue('alert', '9', 'to a chat that blocked the bot')
+        self.server.fail_next(status=403)
+        with self.assertLogs('core.outbox', 'ERROR'):
+            self.assertEqual(self.dispatcher.run_once(), (0, 1))
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.FAILED, 1))
+        self.assertEqual(self.dispatcher.run_once(), (0, 0))
+
+    def test_batch_deadline_shorter_than_lease(self):
+        self.delivery.per_chat_rate = 1        # the second message to a chat waits a second for its token
+        self.assertTrue(self.delivery.send('4', 'warm-up').result(5))
+        for i in range(3):
+            outbox.enqueue('alert', '5', f'alert {i}')
+        dispatcher = outbox.Dispatcher(self.delivery, batch_size=10, lease_seconds=30, send_timeout=0.5)
+        self.assertEqual(dispatcher.run_once(), (1, 2))
+        self.delivery.drain(1)
+        self.assertEqual([m['text'] for m in self.server.messages], ['warm-up', 'alert 0'])   # the rest were cancelled
+        late = OutboxMessage.objects.filter(status=OutboxMessage.PENDING)
+        self.assertEqual(late.count(), 2)
+        self.assertEqual(set(late.values_list('last_error', flat=True)), {'Not delivered within 0.5s'})
+        with self.assertRaises(ValueError):
+            outbox.Dispatcher(self.delivery, lease_seconds=30, send_timeout=30)
+
+    def test_expired_claim_is_reclaimed(self):
+        outbox.enqueue('sos', '7', 'help')
+        self.assertEqual(len(outbox.claim_batch(10, lease_seconds=60)), 1)
+        self.assertEqual(outbox.claim_batch(10, lease_seconds=60), [])
+        OutboxMessage.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.dispatcher.run_once(), (1, 0))
+        self.assertEqual(OutboxMessage.objects.get().attempts, 2)
+
+
+# ==========================================
+# REMINDER SCHEDULER
+# ==========================================
+
+class ReminderSchedulerTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient(self.doctor)
+        self.patient.telegram_chat_id = '77'
+        self.patient.save()
+        self.now = timezone.make_aware(datetime(2026, 3, 10, 8, 0, 30))
+        self.scheduler = self.new_scheduler()
+
+    def new_scheduler(self):
+        return ReminderScheduler(clock=lambda: self.now, refresh_seconds=30, catchup_minutes=60)
+
+    def at(self, hour, minute):
+        return timezone.make_aware(datetime(2026, 3, 10, hour, minute))
+
+    def add(self, hour, minute, name):
+        return Prescription.objects.create(patient=self.patient, doctor=self.doctor, medicine_name=name,
+                                           dose='1 tablet', reminder_time=time(hour, minute))
+
+    def queued(self):
+        """Medicine names per queued message, e.g. [['B', 'C'], ['Missed']]."""
+        return sorted([line.split('**')[1] for line in text.splitlines() if line.startswith('- ')]
+                      for text in OutboxMessage.objects.values_list('text', flat=True))
+
+    def test_batches_slots_and_catches_up_after_restart(self):
+        self.add(6, 0, 'Old')         # outside the catch-up window
+        self.add(7, 30, 'Missed')     # due 30 min before start
+        self.add(8, 5, 'B')
+        self.add(8, 5, 'C')
+
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertEqual(self.scheduler.next_wakeup(), self.at(8, 1))   # next refresh comes first
+
+        self.now = self.at(8, 5)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.scheduler.run_pending(), 1)   # B and C in one message
+        # Prescriptions, patients and users in one joined query
+        self.assertEqual(sum('auth_user' in q['sql'] or 'core_patient' in q['sql'] for q in ctx.captured_queries), 1)
+        self.assertEqual(self.queued(), [['B', 'C'], ['Missed']])
+
+        # A restart replays the same slots; the (patient, slot) dedupe key drops them
+        self.assertEqual(self.new_scheduler().run_pending(), 0)
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+
+    def test_refresh_picks_up_changes(self):
+        moved = self.add(9, 0, 'Moved')
+        deleted = self.add(8, 20, 'Deleted')
+        self.assertEqual(self.scheduler.run_pending(), 0)
+
+        moved.reminder_time = time(8, 10)
+        moved.save()
+        self.add(8, 10, 'New')
+        deleted.delete()
+
+        self.now = self.at(8, 1)
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.now = self.at(8, 10)
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.now = self.at(9, 0)
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.assertEqual(self.queued(), [['Moved', 'New']])
+
+    def test_slot_between_edit_and_refresh_still_fires(self):
+        self.now = timezone.make_aware(datetime(2026, 3, 10, 7, 59, 40))
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.add(8, 0, 'Just added')                    # saved at 07:59:50, due 08:00
+        self.now = timezone.make_aware(datetime(2026, 3, 10, 8, 0, 10))
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertEqual(self.queued(), [['Just added']])
+        self.assertEqual(self.scheduler._due[Prescription.objects.get().id], self.at(8, 0) + timedelta(days=1))
+
+
+# ==========================================
+# COLD ARCHIVE
+# ==========================================
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        api_key_cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = self.settings(ARCHIVE_DIR=Path(tmp.name) / 'archive', ARCHIVE_CACHE_DIR=Path(tmp.name) / 'cache')
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.patient = make_patient(make_doctor())
+        now = timezone.now()
+        # Every 2 hours over the last 5 days, with ties on timestamp to exercise the id tie-break
+        save_readings(self.patient.id, [
+            {'heart_rate': 60 + i, 'body_temperature': 36.6, 'battery_level': 80 if i % 2 else None,
+             'timestamp': now - timedelta(hours=2 * (i // 2))}
+            for i in range(120)
+        ])
+        self.expected = list(SensorReading.objects.filter(patient=self.patient)
+                             .order_by('-timestamp', '-id').values_list('id', 'heart_rate', 'battery_level'))
+
+    def all_pages(self, page_size=7, **bounds):
+        rows, cursor = [], None
+        while True:
+            page = history_page(self.patient, cursor, page_size=page_size, **bounds)
+            rows += [(r.id, r.heart_rate, r.battery_level) for r in page.readings]
+            if not page.has_next:
+                return rows
+            cursor = page.next_cursor
+
+    def test_archive_moves_old_days_and_history_reads_through(self):
+        call_command('archive_readings', days=2, stdout=mock.MagicMock())
+        cutoff = archive.retention_cutoff(2)
+        self.assertFalse(SensorReading.objects.filter(timestamp__lt=cutoff).exists())
+        self.assertTrue(SensorReading.objects.exists())
+        archived = ArchivedPartition.objects.filter(patient=self.patient)
+        self.assertEqual(sum(archived.values_list('row_count', flat=True)) + SensorReading.objects.count(), 120)
+
+        self.assertEqual(self.all_pages(), self.expected)
+        # A range entirely inside the archive
+        start, end = archive.day_bounds(archived.order_by('day').first().day)
+        in_range = [r for r in self.all_pages(start=start, end=end)]
+        self.assertTrue(in_range)
+        self.assertTrue(set(in_range) < set(self.expected))
+
+    def test_rerun_after_interrupted_delete_does_not_duplicate(self):
+        cutoff = archive.retention_cutoff(2)
+        # Crash after the first day's file is written but before its rows are deleted
+        with mock.patch('django.db.models.query.QuerySet.delete', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                archive.archive_patient(self.patient.id, cutoff)
+        self.assertTrue(any(Path(archive.settings.ARCHIVE_DIR).rglob('*.npz')))
+        self.assertEqual(self.all_pages(), self.expected)
+        archive.archive_patient(self.patient.id, cutoff)
+        self.assertEqual(self.all_pages(), self.expected)
+        self.assertEqual(sum(ArchivedPartition.objects.values_list('row_count', flat=True))
+                         + SensorReading.objects.count(), 120)
+
+    def test_dashboard_counters_stay_exact(self):
+        Prescription.objects.create(patient=self.patient, doctor=self.patient.doctor, medicine_name='A',
+                                    dose='1 tablet', reminder_time=time(8, 0))
+        SensorReading.objects.create(patient=self.patient, heart_rate=70, body_temperature=36.5,
+                                     timestamp=timezone.now())
+        archive.archive_patient(self.patient.id, archive.retention_cutoff(2))
+        totals = counters.totals()
+        self.assertEqual((totals['patients'], totals['doctors'], totals['prescriptions']), (1, 1, 1))
+        self.assertEqual(totals['readings'] + totals['archived_readings'], 121)
+        self.assertGreater(totals['archived_readings'], 0)
+        self.assertEqual({drift for _, drift in counters.reconcile().values()}, {0})
+
+        admin = User.objects.create_superuser('admin')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('admin-dashboard'))
+        self.assertEqual(response.context['total_readings'], 121)
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+
+        self.patient.user.delete()
+        self.assertEqual(counters.totals()['readings'] + counters.totals()['archived_readings'], 0)
+        self.assertEqual({drift for _, drift in counters.reconcile().values()}, {0})
+
+    def test_detect_anomalies_keeps_archived_days(self):
+        call_command('archive_readings', days=2, stdout=mock.MagicMock())
+        hot_start = archive.hot_start(self.patient.id)
+        old = VitalAnomaly.objects.create(patient=self.patient, metric='heart_rate', kind='spike',
+                                          start=hot_start - timedelta(days=1), end=hot_start - timedelta(days=1),
+                                          peak_value=200, baseline=70, score=9)
+        call_command('detect_anomalies', stdout=mock.MagicMock())
+        call_command('detect_anomalies', days=5, stdout=mock.MagicMock())
+        self.assertTrue(VitalAnomaly.objects.filter(id=old.id).exists())
+
+    def test_rebuild_latest_keeps_fully_archived_patients(self):
+        newest = SensorReading.objects.filter(patient=self.patient).order_by('-timestamp', '-id').first()
+        archive.archive_patient(self.patient.id, archive.retention_cutoff(-1))     # through today
+        self.assertFalse(SensorReading.objects.filter(patient=self.patient).exists())
+        hot = make_patient(self.patient.doctor, username='hot', readings=3)
+        LatestReading.objects.update(heart_rate=0)
+        empty = make_patient(self.patient.doctor, username='empty')
+        LatestReading.objects.create(patient=empty, heart_rate=70, body_temperature=36.6, timestamp=timezone.now())
+
+        call_command('rebuild_latest_readings', chunk_size=1, stdout=mock.MagicMock())
+        latest = {row.patient_id: row for row in LatestReading.objects.all()}
+        self.assertEqual(set(latest), {self.patient.id, hot.id})      # the patient without readings lost the row
+        archived = latest[self.patient.id]
+        self.assertEqual((archived.reading_id, archived.heart_rate, archived.timestamp),
+                         (newest.id, newest.heart_rate, newest.timestamp))
+        self.assertEqual(latest[hot.id].heart_rate, SensorReading.objects.filter(patient=hot)
+                         .order_by('-timestamp', '-id').first().heart_rate)
+
+    def test_deleting_patient_removes_archive_files(self):
+        call_command('archive_readings', days=2, stdout=mock.MagicMock())
+        list(archive_reader.ArchiveReader(self.patient.id).slices())     # expands the memory-map cache
+        archive_dir, cache_dir = archive.settings.ARCHIVE_DIR, archive.settings.ARCHIVE_CACHE_DIR
+        self.assertTrue(any(archive_dir.rglob('*.npz')) and any(cache_dir.rglob('*.npy')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.user.delete()
+        self.assertFalse(ArchivedPartition.objects.exists())
+        self.assertEqual((list(archive_dir.iterdir()), list(cache_dir.iterdir())), ([], []))
+
+    def test_memory_mapped_reader(self):
+        before = range_summary(self.patient)
+        call_command('archive_readings', days=2, stdout=mock.MagicMock())
+        after = range_summary(self.patient)
+        self.assertEqual(after['count'], 120)
+        for key, value in before.items():
+            self.assertAlmostEqual(after[key], value, msg=key)
+
+        reader = archive_reader.ArchiveReader(self.patient.id)
+        views = list(reader.slices())
+        self.assertTrue(views)
+        self.assertTrue(all(isinstance(v['heart_rate'], np.memmap) for v in views))
+        self.assertEqual(reader.aggregate()['count'], sum(len(v['ts']) for v in views))
+
+        self.client.force_login(self.patient.doctor.user)
+        response = self.client.get(reverse('patient-detail', args=[self.patient.id]), {'from': '2000-01-01'})
+        self.assertEqual(response.context['range_summary']['count'], 120)
+
+
+class LoadTestDeviceTests(SimpleTestCase):
+    def test_offline_devices_replay_backlog_as_batches(self):
+        def handler(request):
+            body = json.loads(request.content)
+            if request.url.path == '/api/submit_batch/':
+                self.assertTrue(all('timestamp' in r for r in body['readings']))
+                return httpx.Response(200, json={'status': 'success', 'accepted': len(body['readings'])})
+            return httpx.Response(200, json={'status': 'success'})
+
+        async def run():
+            stats = Stats()
+            devices = [Device(f'key-{i}', 0.05, random.Random(i)) for i in range(5)]
+            deadline = asyncio.get_running_loop().time() + 1.0   # loop clock is time.monotonic
+            async with httpx.AsyncClient(base_url='http://test', transport=httpx.MockTransport(handler)) as client:
+                await asyncio.gather(*(d.run(client, stats, deadline, 0.3, 0.2, 1.0) for d in devices))
+            return stats
+
+        report = asyncio.run(run()).report(1.0)
+        self.assertIn('/api/submit_batch/', report['endpoints'])
+        self.assertEqual(report['readings_sent'], report['readings_accepted'])
+        single = report['endpoints']['/api/submit_data/']
+        self.assertEqual(single['error_rate'], 0)
+        self.assertLessEqual(single['p50_ms'], single['p99_ms'])
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def result(self, queries, wall_ms, peak_kib, scale=1):
+        return {'scale': {'doctors': scale},
+                'benchmarks': {'doctor_dashboard_view': {'queries': queries, 'wall_ms_median': wall_ms, 'peak_kib': peak_kib}}}
+
+    def test_flags_query_time_and_memory_regressions(self):
+        baseline = self.result(6, 10.0, 400.0)
+        self.assertEqual(compare(self.result(6, 14.0, 500.0), baseline), [])
+        problems = compare(self.result(7, 30.0, 2000.0), baseline)
+        self.assertEqual(len(problems), 3)
+        self.assertIn('7 queries (baseline 6)', problems[0])
+
+    def test_refuses_baseline_from_another_scale(self):
+        with self.assertRaises(CommandError):
+            compare(self.result(6, 10.0, 400.0, scale=2), self.result(6, 10.0, 400.0))
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_doctor()
+        make_patient(cls.doctor, readings=5)
+
+    def setUp(self):
+        metrics.request_metrics.clear()
+
+    def test_records_per_view_and_exports_prometheus_text(self):
+        self.client.force_login(self.doctor.user)
+        self.client.get(reverse('doctor-dashboard'))
+        self.client.get(reverse('doctor-dashboard'))
+        with self.settings(METRICS_TOKEN='scrape-secret'):
+            body = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret').content.decode()
+        self.assertIn('smarthealth_http_requests_total{view="doctor-dashboard",status="2xx"} 2', body)
+        self.assertIn('smarthealth_http_request_duration_seconds_count{view="doctor-dashboard"} 2', body)
+        self.assertIn('smarthealth_http_request_queries_bucket{view="doctor-dashboard",le="+Inf"} 2', body)
+        self.assertIn('smarthealth_outbox_pending 0', body)
+
+    async def test_counts_queries_under_asgi(self):
+        await self.async_client.aforce_login(self.doctor.user)
+        response = await self.async_client.get(reverse('doctor-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        stats = dict(metrics.request_metrics.views())['doctor-dashboard']
+        self.assertEqual(stats.queries.count, 1)
+        self.assertGreater(stats.queries.sum, 0)
+        self.assertGreater(stats.query_seconds, 0)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_endpoint_needs_admin_or_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 404)                      # anonymous, from 127.0.0.1
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.1.2.3',
+                                         HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 404)
+        self.client.force_login(self.doctor.user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(METRICS_QUERY_BUDGET=1)
+    def test_warns_over_query_budget(self):
+        self.client.force_login(self.doctor.user)
+        with self.assertLogs('core.metrics', 'WARNING') as logs:
+            self.client.get(reverse('doctor-dashboard'))
+        self.assertIn('doctor-dashboard', logs.output[0])
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_sampling_off_records_nothing(self):
+        self.client.force_login(self.doctor.user)
+        self.client.get(reverse('doctor-dashboard'))
+        self.assertEqual(metrics.request_metrics.views(), [])
+
+
+class IngestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_doctor()
+        cls.patient = make_patient(cls.doctor)
+        cls.admin = User.objects.create_superuser('admin')
+
+    def test_rates_lag_and_gaps_from_ring_buffers(self):
+        stats = IngestMetrics(window=300, samples=100)
+        now = timezone.now()
+        batch = [SensorReading(patient_id=self.patient.id, heart_rate=70, body_temperature=36.5,
+                               timestamp=now - timedelta(seconds=2 * i)) for i in range(120)]
+        with self.assertNumQueries(1):
+            stats.record(batch[:60], now=now)
+        with self.assertNumQueries(0):
+            stats.record(batch[60:], now=now + timedelta(seconds=5))
+        snap = stats.snapshot(now=now + timedelta(seconds=5))
+        self.assertAlmostEqual(snap['rate_1m'], 2.0)
+        self.assertEqual(snap['per_doctor'], [('Dr. Greg House', 2.0)])
+        self.assertEqual(snap['lag']['samples'], 100)   # ring keeps the last 100 only
+        self.assertAlmostEqual(snap['lag']['max'], 243.0)
+        self.assertEqual(snap['gap']['p50'], 5.0)
+        self.assertEqual(snap['devices_silent'], 0)
+        self.assertEqual(stats.snapshot(now=now + timedelta(seconds=400))['devices_silent'], 1)
+
+    def test_doctor_lookup_runs_outside_the_lock(self):
+        stats = IngestMetrics(window=300, samples=100)
+        lookup = Patient.objects.filter
+        lock_free = []
+
+        def filter(*args, **kwargs):
+            lock_free.append(stats._lock.acquire(blocking=False))   # snapshot() could run meanwhile
+            if lock_free[-1]:
+                stats._lock.release()
+            return lookup(*args, **kwargs)
+
+        with mock.patch.object(Patient.objects, 'filter', filter):
+            stats.record([SensorReading(patient_id=self.patient.id, heart_rate=70, timestamp=timezone.now())])
+        self.assertEqual(lock_free, [True])
+        self.assertEqual(stats.snapshot()['per_doctor'][0][0], 'Dr. Greg House')
+
+    def test_forgets_deleted_and_long_silent_devices(self):
+        stats = IngestMetrics(window=300, samples=100)
+        other = make_patient(self.doctor, username='other')
+        now = timezone.now()
+        for patient in (self.patient, other):
+            stats.record([SensorReading(patient_id=patient.id, heart_rate=70, timestamp=now)], now=now)
+        with mock.patch('core.signals.ingest_metrics', stats):
+            other.delete()
+        self.assertEqual(list(stats.last_arrival), [self.patient.id])
+
+        later = now + timedelta(seconds=stats.ARRIVAL_TTL + 1)
+        stats.record([SensorReading(patient_id=other.id, heart_rate=70, timestamp=later)], now=later)
+        self.assertEqual(list(stats.last_arrival), [other.id])
+
+    def test_admin_dashboard_shows_pipeline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            save_readings(self.patient.id, [{'heart_rate': 80, 'body_temperature': 36.6, 'timestamp': timezone.now()}])
+        self.client.force_login(self.admin)
+        ingest_stats = self.client.get(reverse('admin-dashboard')).context['ingest_stats']
+        self.assertIn(('Dr. Greg House', ingest_stats['per_doctor'][0][1]), ingest_stats['per_doctor'])
+
+
+class PresenceTrackerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.events = []
+        self.tracker = PresenceTracker(timeout=15, clock=lambda: self.now)
+        self.tracker.add_listener(lambda pid, online: self.events.append((pid, online)))
+
+    def test_transitions_and_expiry_wheel(self):
+        self.tracker.seen([1, 2])
+        self.now += 10
+        self.tracker.seen([2])
+        self.assertEqual(self.tracker.online([1, 2, 3]), {1, 2})
+        self.now += 5          # device 1 last seen exactly 15 s ago
+        self.tracker.advance()
+        self.assertEqual(self.tracker.online([1, 2, 3]), {2})
+        self.now += 100        # long idle: every slot swept once
+        self.tracker.advance()
+        self.tracker.seen([1])
+        self.assertEqual(self.events, [(1, True), (2, True), (1, False), (2, False), (1, True)])
+        self.assertEqual(self.tracker.seconds_since(2), 105)
+
+    def test_fallback_for_devices_seen_elsewhere(self):
+        recent = datetime.fromtimestamp(self.now - 5, tz=timezone.get_current_timezone())
+        stale = datetime.fromtimestamp(self.now - 60, tz=timezone.get_current_timezone())
+        self.assertEqual(self.tracker.online([1, 2, 3], fallback={1: recent, 2: stale}), {1})
+        self.assertEqual(self.tracker.seconds_since(2, stale), 60)
+        self.assertIsNone(self.tracker.seconds_since(3))
+        self.assertEqual(self.events, [])
+
+
+class AdminUserListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin')
+        doctor = make_doctor()
+        for i in range(30):
+            make_patient(doctor, username=f'pat{i:02d}')
+        User.objects.create_user('receptionist', email='desk@clinic.test')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_roles_in_constant_queries(self):
+        with self.settings(ADMIN_USERS_PAGE_SIZE=100), CaptureQueriesContext(connection) as ctx:
+            users = self.client.get(reverse('admin-users')).context['users']
+        roles = {u.username: u.role_type for u in users}
+        self.assertEqual(roles['admin'], 'admin')
+        self.assertEqual(roles['doc'], 'doctor')
+        self.assertEqual(roles['pat07'], 'patient')
+        self.assertEqual(roles['receptionist'], 'staff')
+        # Roles come from EXISTS subqueries, never from per-user lookups
+        per_user = [q['sql'] for q in ctx.captured_queries
+                    if ('core_doctor' in q['sql'] or 'core_patient' in q['sql']) and 'EXISTS' not in q['sql']]
+        self.assertEqual(per_user, [])
+
+        with self.settings(ADMIN_USERS_PAGE_SIZE=10), CaptureQueriesContext(connection) as full_page:
+            self.client.get(reverse('admin-users'), {'page': 1})
+        with self.settings(ADMIN_USERS_PAGE_SIZE=10), self.assertNumQueries(len(full_page.captured_queries)):
+            self.client.get(reverse('admin-users'), {'page': 4})
+        # session, user, counters, recent users with roles, last reading
+        with self.assertNumQueries(5):
+            self.client.get(reverse('admin-dashboard'))
+
+    def test_paging_search_and_role_filter(self):
+        with self.settings(ADMIN_USERS_PAGE_SIZE=10):
+            page = self.client.get(reverse('admin-users')).context['page']
+            self.assertEqual((page.paginator.count, page.paginator.num_pages, len(page.object_list)), (33, 4, 10))
+            found = self.client.get(reverse('admin-users'), {'q': 'desk@'}).context['users']
+            self.assertEqual([u.username for u in found], ['receptionist'])
+            doctors = self.client.get(reverse('admin-users'), {'role': 'doctor'}).context['users']
+            self.assertEqual([u.username for u in doctors], ['doc'])
@@ -18,6 +18,7 @@ urlpatterns = [
     # --- PATIENT URLs ---
     path('dashboard/patient/', views.patient_dashboard_view, name='patient-dashboard'),
     path('patient/history/', views.patient_history_view, name='patient-history'),
+    path('api/history/', views.history_api_view, name='history-api'),
     path('patient/medications/', views.patient_medications_view, name='patient-medications'),
     path('patient/settings/', views.patient_settings_view, name='patient-settings'),
     path('patient/password/', views.patient_password_view, name='patient-password'),
@@ -25,6 +26,8 @@ urlpatterns = [
     
     # --- FIX: LIVE DATA API (Used by JavaScript Polling) ---
     path('patient/live-data/', views.get_patient_live_data, name='patient-live-data'),
+    # Live push (SSE, needs the ASGI server); patients get their own vitals, doctors all their patients
+    path('live/stream/', views.live_stream_view, name='live-stream'),
 
     # --- DOCTOR URLs ---
     path('dashboard/doctor/', views.doctor_dashboard_view, name='doctor-dashboard'),
@@ -43,4 +46,8 @@ urlpatterns = [
 
     # --- API ---
     path('api/submit_data/', views.api_submit_data, name='api-submit-data'),
+    path('api/submit_batch/', views.api_submit_batch, name='api-submit-batch'),
+
+    # --- MONITORING ---
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
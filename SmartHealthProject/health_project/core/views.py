@@ -4,36 +4,25 @@ from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from .models import Doctor, Patient, SensorReading, Prescription, PatientNote
+from .models import Doctor, Patient, SensorReading, Prescription, PatientNote, LatestReading, VitalsRollup
 from django.utils import timezone
 from datetime import timedelta
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+import hmac
 import json
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Avg
-import asyncio
-import telegram
+from django.views.decorators.http import etag
+from django.core.paginator import Paginator
+from django.db import IntegrityError
+from django.db.models import Case, Exists, Max, OuterRef, Prefetch, Q, Value, When
 from django.conf import settings
-
-# --- TELEGRAM CONFIGURATION ---
-BOT_TOKEN = settings.TELEGRAM_BOT_TOKEN
-
-# --- Helper to send Telegram Messages ---
-async def send_async_msg(chat_id, msg):
-    try:
-        bot = telegram.Bot(token=BOT_TOKEN)
-        await bot.send_message(chat_id=chat_id, text=msg, parse_mode='Markdown')
-    except Exception as e:
-        print(f"Telegram Error: {e}")
-
-def send_telegram(chat_id, msg):
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(send_async_msg(chat_id, msg))
-        loop.close()
-    except Exception as e:
-        print(f"Async Error: {e}")
+from . import counters, history, ingest, metrics, outbox, rollups
+from .ingest_metrics import ingest_metrics
+from .keycache import api_key_cache
+from .live import live_etag, live_hub, live_payload, sse_event
+from .presence import presence
 
 # ==========================================
 # AUTHENTICATION & HOME
@@ -75,31 +64,39 @@ def home_view(request):
 # ADMIN VIEWS
 # ==========================================
 
+def _users_with_roles():
+    """Users annotated with role_type ('admin' / 'doctor' / 'patient' / 'staff') in the same query."""
+    return User.objects.annotate(role_type=Case(
+        When(is_superuser=True, then=Value('admin')),
+        When(Exists(Doctor.objects.filter(user=OuterRef('pk'))), then=Value('doctor')),
+        When(Exists(Patient.objects.filter(user=OuterRef('pk'))), then=Value('patient')),
+        default=Value('staff'),
+    ))
+
 @login_required(login_url='login-page')
 def admin_dashboard_view(request):
     if not request.user.is_superuser:
         return redirect('home')
         
-    total_doctors = Doctor.objects.count()
-    total_patients = Patient.objects.count()
-    total_prescriptions = Prescription.objects.count()
-    total_readings = SensorReading.objects.count()
+    # Incrementally maintained counters (core.counters): one small query instead of COUNT(*) on every table
+    totals = counters.totals()
+    total_doctors = totals['doctors']
+    total_patients = totals['patients']
+    total_prescriptions = totals['prescriptions']
+    total_readings = totals['readings'] + totals['archived_readings']
     
-    users_queryset = User.objects.order_by('-date_joined')[:5]
-    recent_users = []
-    for u in users_queryset:
-        if u.is_superuser: u.role_type = 'admin'
-        elif hasattr(u, 'doctor'): u.role_type = 'doctor'
-        elif hasattr(u, 'patient'): u.role_type = 'patient'
-        else: u.role_type = 'staff'
-        recent_users.append(u)
+    # Newest accounts first: ids follow join order and, unlike date_joined, are indexed
+    recent_users = list(_users_with_roles().order_by('-id')[:5])
     
     # Check if system is online (any reading in last 30s)
-    last_reading = SensorReading.objects.order_by('-timestamp').first()
+    last_seen = LatestReading.objects.aggregate(last=Max('timestamp'))['last']
     system_status = "Offline"
-    if last_reading and last_reading.timestamp > (timezone.now() - timedelta(seconds=30)):
+    if last_seen and last_seen > (timezone.now() - timedelta(seconds=30)):
         system_status = "Online"
 
+    # Fleet health from the ingest ring buffers (this server process only)
+    ingest_stats = ingest_metrics.snapshot()
+
     context = {
         'user': request.user,
         'total_doctors': total_doctors,
@@ -108,6 +105,7 @@ def admin_dashboard_view(request):
         'total_readings': total_readings,
         'recent_users': recent_users,
         'system_status': system_status,
+        'ingest_stats': ingest_stats,
         'today_date': timezone.now()
     }
     return render(request, 'core/admin_dashboard.html', context)
@@ -127,15 +125,20 @@ def admin_patients_view(request):
 @login_required(login_url='login-page')
 def admin_users_view(request):
     if not request.user.is_superuser: return redirect('home')
-    users = User.objects.all().order_by('-date_joined')
-    
-    for u in users:
-        if u.is_superuser: u.role_label = 'Admin'
-        elif hasattr(u, 'doctor'): u.role_label = 'Doctor'
-        elif hasattr(u, 'patient'): u.role_label = 'Patient'
-        else: u.role_label = 'Staff'
-        
-    return render(request, 'core/admin_manage_users.html', {'users': users})
+    users = _users_with_roles().order_by('-id')
+
+    # ?q= searches username, name and email; ?role= keeps one role
+    query = request.GET.get('q', '').strip()
+    if query:
+        users = users.filter(Q(username__icontains=query) | Q(first_name__icontains=query)
+                             | Q(last_name__icontains=query) | Q(email__icontains=query))
+    role = request.GET.get('role', '')
+    if role in ('admin', 'doctor', 'patient', 'staff'):
+        users = users.filter(role_type=role)
+
+    page = Paginator(users, settings.ADMIN_USERS_PAGE_SIZE).get_page(request.GET.get('page'))
+    context = {'users': page.object_list, 'page': page, 'query': query, 'role': role}
+    return render(request, 'core/admin_manage_users.html', context)
 
 # ==========================================
 # PATIENT VIEWS
@@ -149,19 +152,12 @@ def patient_dashboard_view(request):
     
     prescriptions = Prescription.objects.filter(patient=patient).order_by('reminder_time')
     all_readings = SensorReading.objects.filter(patient=patient).order_by('-timestamp')
-    latest_reading = all_readings.first()
-    
-    # Strict Threshold (15 Seconds)
-    time_threshold = timezone.now() - timedelta(seconds=15)
-    
-    is_active = False
+    latest_reading = LatestReading.objects.filter(patient=patient).first()
+    is_active = presence.is_online(patient.id, latest_reading.timestamp if latest_reading else None)
     battery = "--"
     signal = "--"
     
     if latest_reading:
-        if latest_reading.timestamp > time_threshold:
-            is_active = True
-            
         if latest_reading.battery_level is not None:
             battery = latest_reading.battery_level
         
@@ -186,38 +182,64 @@ def patient_dashboard_view(request):
     return render(request, 'core/patient_dashboard.html', context)
 
 # --- API for Patient Dashboard Polling (Live Updates) ---
+def _live_data_etag(request):
+    if not hasattr(request.user, 'patient'):
+        return None
+    return live_etag(request.user.patient.id)
+
 @login_required(login_url='login-page')
+@etag(_live_data_etag)
 def get_patient_live_data(request):
     if not hasattr(request.user, 'patient'):
         return JsonResponse({})
 
     patient = request.user.patient
-    reading = SensorReading.objects.filter(patient=patient).order_by('-timestamp').first()
-    time_threshold = timezone.now() - timedelta(seconds=15)
-    
-    data = {
-        'is_active': False, 'heart_rate': '--', 'body_temp': '--',
-        'room_temp': '--', 'humidity': '--', 'battery': '--', 'signal': '--'
-    }
-
-    if reading:
-        if reading.timestamp > time_threshold:
-            data['is_active'] = True
-        
-        data['heart_rate'] = int(reading.heart_rate)
-        data['body_temp'] = round(reading.body_temperature, 1)
-        if reading.room_temperature: data['room_temp'] = round(reading.room_temperature, 1)
-        if reading.humidity: data['humidity'] = int(reading.humidity)
-        if reading.battery_level: data['battery'] = reading.battery_level
-        
-        sig = reading.signal_strength
-        if sig:
-            if sig > -50: data['signal'] = "Excellent"
-            elif sig > -70: data['signal'] = "Good"
-            elif sig > -85: data['signal'] = "Weak"
-            else: data['signal'] = "Poor"
+    reading = LatestReading.objects.filter(patient=patient).first()
+    return JsonResponse(live_payload(reading))
+
+# --- Live push (SSE): new readings streamed to patient / doctor dashboards ---
+def _live_stream_scope(user):
+    """Returns the patient ids a user may watch, with their current LatestReading rows."""
+    if hasattr(user, 'patient'):
+        patient_ids = [user.patient.id]
+    elif hasattr(user, 'doctor'):
+        patient_ids = list(Patient.objects.filter(doctor=user.doctor).values_list('id', flat=True))
+    else:
+        return [], []
+    return patient_ids, list(LatestReading.objects.filter(patient_id__in=patient_ids))
 
-    return JsonResponse(data)
+@login_required(login_url='login-page')
+async def live_stream_view(request):
+    # Streaming needs the ASGI server; under WSGI tell the browser to keep polling
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+    patient_ids, latest = await sync_to_async(_live_stream_scope)(user)
+    if not patient_ids:
+        return HttpResponse(status=204)
+
+    async def events():
+        sub = live_hub.subscribe(patient_ids)
+        try:
+            yield "retry: 5000\n\n"
+            for r in latest:
+                yield sse_event(live_payload(r))
+            while True:
+                # Devices that went quiet reach every open stream as 'status' events via the presence tracker
+                presence.advance()
+                pending = await sub.get(timeout=5)
+                for event, payload in pending:
+                    yield sse_event(payload, event)
+                if not pending:
+                    yield ": keep-alive\n\n"
+        finally:
+            live_hub.unsubscribe(sub)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @login_required(login_url='login-page')
 def send_sos_view(request):
@@ -226,13 +248,13 @@ def send_sos_view(request):
         doctor = patient.doctor
         
         if doctor and doctor.telegram_chat_id:
-            last_reading = SensorReading.objects.filter(patient=patient).order_by('-timestamp').first()
-            time_threshold = timezone.now() - timedelta(minutes=1)
+            last_reading = LatestReading.objects.filter(patient=patient).first()
+            silent_for = presence.seconds_since(patient.id, last_reading.timestamp if last_reading else None)
             diagnosis = "✅ **Sensors seem operational.** Patient initiated alert manually."
             
-            if not last_reading:
+            if silent_for is None:
                 diagnosis = "⚠️ **CRITICAL:** No data has ever been received from this device."
-            elif last_reading.timestamp < time_threshold:
+            elif silent_for > 60:
                 diagnosis = "⚠️ **CRITICAL: DEVICE OFFLINE**\nLast data received over 1 minute ago."
             
             msg = (
@@ -241,19 +263,79 @@ def send_sos_view(request):
                 f"**Contact:** {patient.contact_number}\n\n"
                 f"**SYSTEM DIAGNOSTIC:**\n{diagnosis}"
             )
-            send_telegram(doctor.telegram_chat_id, msg)
+            # Stored in the outbox; the dispatcher delivers it even if Telegram is slow or down right now
+            outbox.enqueue('sos', doctor.telegram_chat_id, msg)
             messages.success(request, "Emergency Alert sent to Dr. " + doctor.user.last_name)
         else:
             messages.error(request, "Error: Your doctor has not set up Telegram alerts.")
             
     return redirect('patient-dashboard')
 
+# --- History paging: ?from=&to= (dates or datetimes) and ?cursor= for older pages ---
+def _history_page_context(request, patient):
+    try:
+        start = history.parse_bound(request.GET.get('from'))
+        end = history.parse_bound(request.GET.get('to'), end=True)
+        page = history.history_page(patient, request.GET.get('cursor'), start, end)
+    except ValueError as e:
+        messages.error(request, str(e))
+        start = end = None
+        page = history.history_page(patient)
+
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    first_url = '?' + params.urlencode()
+    next_url = None
+    if page.has_next:
+        params['cursor'] = page.next_cursor
+        next_url = '?' + params.urlencode()
+    return {
+        'page_readings': page.readings,
+        'next_url': next_url,
+        'first_url': first_url if 'cursor' in request.GET else None,
+        'range_from': request.GET.get('from', ''),
+        'range_to': request.GET.get('to', ''),
+        'range_start': start,
+        'range_end': end,
+    }
+
 @login_required(login_url='login-page')
 def patient_history_view(request):
     if not hasattr(request.user, 'patient'): return redirect('home')
     patient = request.user.patient
-    readings = SensorReading.objects.filter(patient=patient).order_by('-timestamp')
-    return render(request, 'core/patient_history.html', {'readings': readings})
+    page_context = _history_page_context(request, patient)
+    # Daily summary for the last 30 days, straight from the 1-day rollups
+    now = timezone.now()
+    _, daily = rollups.series(patient, now - timedelta(days=30), now, max_points=31)
+    context = {'readings': page_context.pop('page_readings'), 'daily_summary': list(reversed(daily)), **page_context}
+    return render(request, 'core/patient_history.html', context)
+
+# --- JSON history: same keyset paging, for charts and apps ---
+@login_required(login_url='login-page')
+def history_api_view(request):
+    if hasattr(request.user, 'patient'):
+        patient = request.user.patient
+    elif hasattr(request.user, 'doctor'):
+        patient_id = request.GET.get('patient_id', '')
+        patient = Patient.objects.filter(id=patient_id, doctor=request.user.doctor).first() if patient_id.isdigit() else None
+        if patient is None:
+            return JsonResponse({'status': 'error', 'message': 'Unknown patient'}, status=404)
+    else:
+        return JsonResponse({'status': 'error', 'message': 'Not allowed'}, status=403)
+
+    try:
+        limit = min(int(request.GET.get('limit', settings.HISTORY_PAGE_SIZE)), settings.HISTORY_MAX_PAGE_SIZE)
+        start = history.parse_bound(request.GET.get('from'))
+        end = history.parse_bound(request.GET.get('to'), end=True)
+        page = history.history_page(patient, request.GET.get('cursor'), start, end, page_size=max(limit, 1))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'readings': [history.reading_json(r) for r in page.readings],
+        'next_cursor': page.next_cursor,
+    })
 
 @login_required(login_url='login-page')
 def patient_medications_view(request):
@@ -307,26 +389,28 @@ def doctor_dashboard_view(request):
         return redirect('home')
     
     doctor = request.user.doctor
-    all_my_patients = Patient.objects.filter(doctor=doctor)
+    # One query for patients + user + latest vitals, one for all their notes
+    notes_qs = PatientNote.objects.order_by('-created_at')
+    all_my_patients = list(
+        Patient.objects.filter(doctor=doctor)
+        .select_related('user', 'latest_reading')
+        .prefetch_related(Prefetch('patientnote_set', queryset=notes_qs, to_attr='sorted_notes'))
+    )
     
     patients_data = {}
-    time_threshold = timezone.now() - timedelta(seconds=15)
+    # Which of this doctor's devices are online, answered in one call
+    online = presence.online(
+        [p.id for p in all_my_patients],
+        fallback={p.id: p.latest_reading.timestamp for p in all_my_patients if hasattr(p, 'latest_reading')},
+    )
 
     for p in all_my_patients:
-        last_reading = SensorReading.objects.filter(patient=p).last()
-        is_active = False
-        
-        if last_reading and last_reading.timestamp > time_threshold:
-            is_active = True
-            
+        last_reading = getattr(p, 'latest_reading', None)
+        is_active = p.id in online
         status_text = "Active Monitoring" if is_active else "Not Active"
         status_color = "text-green-500" if is_active else "text-red-500"
 
-        try:
-            notes = PatientNote.objects.filter(patient=p).order_by('-created_at')
-            notes_list = [{'id': n.id, 'text': n.text, 'date': n.created_at.strftime('%d/%m')} for n in notes]
-        except:
-            notes_list = []
+        notes_list = [{'id': n.id, 'text': n.text, 'date': n.created_at.strftime('%d/%m')} for n in p.sorted_notes]
         
         patients_data[p.id] = {
             'id': p.id,
@@ -349,15 +433,15 @@ def doctor_dashboard_view(request):
             'status_color': status_color
         }
 
-    all_readings = SensorReading.objects.filter(patient__in=all_my_patients)
-    avg_hr = all_readings.aggregate(Avg('heart_rate'))['heart_rate__avg']
-    avg_temp = all_readings.aggregate(Avg('body_temperature'))['body_temperature__avg']
+    # All-time averages from the daily rollups, not from every reading ever recorded
+    averages = rollups.summarize(patient__doctor=doctor)
+    avg_hr, avg_temp = averages['hr_avg'], averages['temp_avg']
 
     context = {
         'user': request.user,
         'doctor': doctor,
         'patients': all_my_patients,
-        'total_patients': all_my_patients.count(),
+        'total_patients': len(all_my_patients),
         'today_date_display': timezone.now().strftime("%A, %B %d, %Y"),
         'patients_data_json': json.dumps(patients_data),
         'avg_hr': int(avg_hr) if avg_hr else "--",
@@ -377,6 +461,8 @@ def add_prescription_view(request):
             Prescription.objects.create(patient=patient, doctor=request.user.doctor, medicine_name=med_name, dose=dose, reminder_time=time)
     return redirect('doctor-dashboard')
 
+TREND_RANGES = {'24h': timedelta(hours=24), '7d': timedelta(days=7), '30d': timedelta(days=30)}
+
 @login_required(login_url='login-page')
 def patient_detail_view(request, patient_id):
     if not hasattr(request.user, 'doctor'): return redirect('home')
@@ -389,42 +475,104 @@ def patient_detail_view(request, patient_id):
         Prescription.objects.create(patient=patient, doctor=request.user.doctor, medicine_name=med_name, dose=dose, reminder_time=time)
         return redirect('patient-detail', patient_id=patient.id)
     prescriptions = Prescription.objects.filter(patient=patient).order_by('reminder_time')
-    all_readings = SensorReading.objects.filter(patient=patient).order_by('-timestamp')
-    context = {'patient': patient, 'prescriptions': prescriptions, 'all_readings': all_readings}
+    page_context = _history_page_context(request, patient)
+    range_start, range_end = page_context.pop('range_start'), page_context.pop('range_end')
+    # Exact stats for a filtered range, reading archived days from their memory-mapped columns
+    range_summary = None
+    if range_start or range_end:
+        range_summary = history.range_summary(patient, range_start, range_end)
+
+    # Trend table: the range picks the rollup resolution (24h -> hourly, 7d/30d -> daily)
+    trend_range = request.GET.get('trend', '24h')
+    if trend_range not in TREND_RANGES: trend_range = '24h'
+    now = timezone.now()
+    start = now - TREND_RANGES[trend_range]
+    trend_resolution, trend = rollups.series(patient, start, now, max_points=31)
+
+    context = {
+        'patient': patient, 'prescriptions': prescriptions, 'all_readings': page_context.pop('page_readings'),
+        'trend': trend, 'trend_range': trend_range, 'trend_ranges': TREND_RANGES.keys(),
+        'trend_hourly': trend_resolution < VitalsRollup.DAY,
+        'trend_summary': rollups.summarize(start=start, patient=patient),
+        'anomalies': patient.anomalies.order_by('-start')[:10],
+        'range_summary': range_summary,
+        **page_context,
+    }
     return render(request, 'core/patient_detail.html', context)
 
+def _invalid_key_response():
+    return JsonResponse({'status': 'error', 'message': 'Invalid API Key'}, status=403)
+
+def _submit(api_key, patient_id, readings):
+    """Stores readings; returns an error response, or None when they were accepted."""
+    try:
+        accepted = ingest.submit_readings(patient_id, readings)
+    except IntegrityError:
+        # The patient was deleted through another worker while this one still had the key cached
+        api_key_cache.invalidate(api_key)
+        return _invalid_key_response()
+    return None if accepted else _buffer_full_response()
+
+def _buffer_full_response():
+    retry_after = max(1, int(settings.INGEST_BUFFER_FLUSH_INTERVAL))
+    response = JsonResponse({'status': 'error', 'message': 'Server busy, retry later'}, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
 @csrf_exempt
 def api_submit_data(request):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
-            key = data.get('api_key')
-            hr = data.get('heart_rate')
-            temp = data.get('body_temperature')
-            room_temp = data.get('room_temperature')
-            humidity = data.get('humidity')
-            battery = data.get('battery_level')
-            signal = data.get('signal_strength')
+            patient_id = api_key_cache.resolve(data.get('api_key'))
+            if patient_id is None:
+                return _invalid_key_response()
 
             try:
-                patient = Patient.objects.get(api_key=key)
-            except Patient.DoesNotExist:
-                return JsonResponse({'status': 'error', 'message': 'Invalid API Key'}, status=403)
-
-            SensorReading.objects.create(
-                patient=patient,
-                heart_rate=hr,
-                body_temperature=temp,
-                room_temperature=room_temp,
-                humidity=humidity,
-                battery_level=battery,
-                signal_strength=signal
-            )
+                fields = ingest.parse_reading(data)
+            except ValueError as e:
+                return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+            error = _submit(data.get('api_key'), patient_id, [fields])
+            if error:
+                return error
             return JsonResponse({'status': 'success', 'message': 'Data received'})
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, AttributeError):
             return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
 
+# --- Batch upload: devices replay buffered samples after a reconnect ---
+@csrf_exempt
+def api_submit_batch(request):
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+
+    items = data.get('readings') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'status': 'error', 'message': 'readings must be a non-empty list'}, status=400)
+    if len(items) > settings.INGEST_MAX_BATCH_SIZE:
+        return JsonResponse({'status': 'error', 'message': f'Too many readings (max {settings.INGEST_MAX_BATCH_SIZE})'}, status=413)
+
+    patient_id = api_key_cache.resolve(data.get('api_key'))
+    if patient_id is None:
+        return _invalid_key_response()
+
+    valid, results = ingest.parse_batch(items)
+    error = _submit(data.get('api_key'), patient_id, [fields for _, fields in valid])
+    if error:
+        return error
+
+    return JsonResponse({
+        'status': 'success' if len(valid) == len(items) else 'partial',
+        'accepted': len(valid),
+        'rejected': len(items) - len(valid),
+        'results': results,
+    })
+
 @login_required(login_url='login-page')
 def settings_view(request):
     if not hasattr(request.user, 'doctor'): return redirect('home')
@@ -480,4 +628,21 @@ def delete_note_view(request, note_id):
     if note.doctor == request.user.doctor:
         note.delete()
         return JsonResponse({'status': 'success'})
-    return JsonResponse({'status': 'error'})
\ No newline at end of file
+    return JsonResponse({'status': 'error'})
+
+# --- Prometheus scrape endpoint (admins or METRICS_TOKEN, and only from METRICS_ALLOWED_IPS) ---
+def _metrics_allowed(request):
+    # Behind ngrok or a local proxy every client looks like 127.0.0.1, so the address alone proves nothing
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return False
+    if request.user.is_authenticated and request.user.is_superuser:
+        return True
+    token = settings.METRICS_TOKEN
+    scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(given.encode(), token.encode())
+
+
+def metrics_view(request):
+    if not _metrics_allowed(request):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Live dashboard push (/live/stream/, Server-Sent Events) only streams under ASGI:
+    uvicorn health_project.asgi:application --host 0.0.0.0 --port 8000
+Under runserver/WSGI the stream answers 204 and the dashboards fall back to polling.
 """
 
 import os
@@ -14,3 +18,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health_project.settings')
 
 application = get_asgi_application()
+
+# Deferred work (alert rules, counter and rollup flushes) runs on a background thread in server processes
+from core.background import worker  # noqa: E402
+
+worker.start()
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -118,3 +119,126 @@ CSRF_TRUSTED_ORIGINS = [
     'https://93a3f0acdcc7.ngrok-free.app',
 ]
 
+
+# --- SENSOR INGEST CONFIGURATION ---
+# Max readings accepted in one POST to /api/submit_batch/
+INGEST_MAX_BATCH_SIZE = int(os.getenv('INGEST_MAX_BATCH_SIZE', '1000'))
+# Rows per INSERT statement when bulk writing readings
+INGEST_BULK_BATCH_SIZE = 500
+
+# Write-behind mode: queue readings in memory (journaled to disk) and flush them
+# with one bulk insert per size/time threshold instead of one commit per request.
+# Run `manage.py replay_ingest_journal` before starting workers after a crash.
+INGEST_BUFFER_ENABLED = os.getenv('INGEST_BUFFER_ENABLED') == 'True'
+INGEST_BUFFER_MAX_SIZE = int(os.getenv('INGEST_BUFFER_MAX_SIZE', '20000'))
+INGEST_BUFFER_FLUSH_SIZE = int(os.getenv('INGEST_BUFFER_FLUSH_SIZE', '500'))
+INGEST_BUFFER_FLUSH_INTERVAL = float(os.getenv('INGEST_BUFFER_FLUSH_INTERVAL', '1.0'))
+INGEST_BUFFER_JOURNAL_DIR = BASE_DIR / 'ingest_journal'
+INGEST_BUFFER_FSYNC = True
+
+# --- DEVICE AUTH CACHE (api_key -> patient id, per process) ---
+# A key replaced or deleted through another worker keeps resolving here for up to API_KEY_CACHE_TTL
+API_KEY_CACHE_SIZE = 10000
+API_KEY_CACHE_TTL = 60            # seconds a known key stays cached
+API_KEY_CACHE_NEGATIVE_TTL = 30   # seconds an unknown key stays cached
+
+# --- CACHE ---
+# The live-data ETag version (reading id + timestamp per patient) is written here by the ingest
+# path and kept without expiry, so polls of an idle patient never reach the database.
+# LocMem is per process: with several workers, use a shared backend (file, redis), or set
+# LIVE_ETAG_CACHE_TIMEOUT to the seconds other processes may lag behind a new reading.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},   # one small version entry per patient
+    }
+}
+LIVE_ETAG_CACHE_TIMEOUT = None
+
+# --- VITALS ROLLUPS (1-min / 1-hour / 1-day min/max/avg per patient) ---
+# Maintained on every ingest; turn off to rely on `manage.py rebuild_rollups` as a compaction job.
+# Under a server the buckets are summed in memory and written by the background worker (below).
+ROLLUPS_ON_INGEST = True
+
+# --- HISTORY PAGING (keyset on timestamp, id) ---
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+# --- AUTOMATIC ALERT RULES (evaluated on every ingested reading) ---
+# type 'threshold': above/below a limit, optionally held for for_seconds
+#   (breaching samples more than max_gap seconds apart, default 60, restart the count).
+# type 'rate': changes by more than max_change within window_seconds.
+# Optional scope: 'conditions' (Patient.medical_condition) and/or 'patients' (ids).
+ALERT_RULES = [
+    {'type': 'threshold', 'name': 'tachycardia', 'metric': 'heart_rate', 'above': 120, 'for_seconds': 30},
+    {'type': 'threshold', 'name': 'bradycardia', 'metric': 'heart_rate', 'below': 45, 'for_seconds': 30},
+    {'type': 'threshold', 'name': 'fever', 'metric': 'body_temperature', 'above': 38.5, 'for_seconds': 60},
+    {'type': 'threshold', 'name': 'hypothermia', 'metric': 'body_temperature', 'below': 35.0, 'for_seconds': 60},
+    {'type': 'rate', 'name': 'heart_rate_jump', 'metric': 'heart_rate', 'max_change': 40, 'window_seconds': 10},
+    {'type': 'threshold', 'name': 'cardiac_watch', 'metric': 'heart_rate', 'above': 100, 'for_seconds': 60,
+     'conditions': ['Heart Disease', 'Arrhythmia']},
+]
+# Minimum seconds between two alerts of the same rule for the same patient
+ALERT_COOLDOWN_SECONDS = 600
+
+# --- TELEGRAM DELIVERY WORKER (one shared bot, rate limited; the outbox retries failed messages) ---
+# Point at a local fake server in tests/dev, e.g. http://127.0.0.1:8081/bot
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
+# Telegram's limits: ~30 messages/s overall, 1 message/s to the same chat
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_PER_CHAT_RATE = 1
+TELEGRAM_MAX_CONCURRENCY = 8
+
+# --- NOTIFICATION OUTBOX (drained by `manage.py dispatch_notifications`) ---
+OUTBOX_BATCH_SIZE = 100
+# A claimed batch not confirmed within this many seconds is picked up again
+OUTBOX_LEASE_SECONDS = 120
+# Messages of a batch not delivered within this many seconds are cancelled and retried; keep below the lease
+OUTBOX_SEND_TIMEOUT = 90
+OUTBOX_MAX_ATTEMPTS = 8
+# Seconds before a failed message is retried; doubles on each attempt
+OUTBOX_RETRY_BACKOFF = 30
+OUTBOX_POLL_INTERVAL = 1.0
+OUTBOX_KEEP_SENT_DAYS = 7
+
+# --- MEDICINE REMINDER SCHEDULER (run_bot.py) ---
+# How often new / edited prescriptions are picked up
+REMINDER_REFRESH_SECONDS = 30
+# After a restart, reminders that fell due this recently are still sent (once, via the outbox dedupe key)
+REMINDER_CATCHUP_MINUTES = 60
+
+# --- COLD ARCHIVE (manage.py archive_readings, e.g. nightly from cron) ---
+# Readings older than this many days move out of SensorReading into compressed per-patient daily files
+READING_RETENTION_DAYS = int(os.getenv('READING_RETENTION_DAYS', '90'))
+ARCHIVE_DIR = BASE_DIR / 'archive'
+# Archive partitions expanded to uncompressed per-column .npy files for memory-mapped reads
+ARCHIVE_CACHE_DIR = BASE_DIR / 'archive_cache'
+
+# --- REQUEST METRICS (core.metrics, scraped from /metrics/) ---
+# Fraction of requests timed and counted; lower it on busy servers (0 turns recording off)
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', '1.0'))
+# A warning is logged for any recorded request above either budget
+METRICS_QUERY_BUDGET = 30
+METRICS_LATENCY_BUDGET = 0.5   # seconds
+# /metrics/ needs an admin session or "Authorization: Bearer <METRICS_TOKEN>" (unset: admins only),
+# and in addition a client address from this list
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# --- INGEST PIPELINE METRICS (ring buffers shown on the admin dashboard, per process) ---
+INGEST_METRICS_WINDOW = 300    # seconds of per-second reading counts kept
+INGEST_METRICS_SAMPLES = 4096  # recent lag / inter-arrival samples kept for percentiles
+
+# --- DEVICE PRESENCE (core.presence) ---
+# A device is "online" while its last upload is younger than this
+PRESENCE_TIMEOUT_SECONDS = 15
+
+# --- ADMIN USER LIST ---
+ADMIN_USERS_PAGE_SIZE = 50
+
+# --- BACKGROUND WORKER (core.background, started by health_project/wsgi.py and asgi.py) ---
+# Shared rows updated by every upload (the readings counter, rollup buckets) are written once per interval
+# Alert rules are evaluated there as well, after the device has its response
+BACKGROUND_FLUSH_INTERVAL = 1.0   # seconds
+# Jobs queued beyond this run in the submitting request instead
+BACKGROUND_MAX_PENDING = 10000
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health_project.settings')
 
 application = get_wsgi_application()
+
+# Deferred work (alert rules, counter and rollup flushes) runs on a background thread in server processes
+from core.background import worker  # noqa: E402
+
+worker.start()